@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Optional
+
+import util  # correct_path, filtered_files, get_from_environment, means_false, debug, warn
+
+''' Persistent cache of the parsed annotation files '''
+
+CACHE_DIRECTORY = "annotation-cache"
+ENTRY_SUFFIX = ".json"
+# the files the parsed annotations depend on, besides the annotation file itself
+PARSER_FILES = ["annotations.py", "htmlfilter.py", "util.py", "html-restrictions.json"]
+
+__parser_hash = None
+__links_hashes = {}
+__cleared = set()
+
+
+# returns the cache directory inside the directory of the text documents, or None if caching is switched off.
+# RFC_ANNOTATION_CACHE set to CLEAR removes all entries once before they are used.
+def cache_directory(read_directory: str) -> Optional[str]:
+    setting = util.get_from_environment("ANNOTATION_CACHE", "on")
+    if util.means_false(setting):
+        return None
+    directory = util.correct_path(read_directory) + CACHE_DIRECTORY
+    if setting.lower() == "clear" and directory not in __cleared:
+        __cleared.add(directory)
+        clear(directory)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        util.warn(f"can't create annotation cache directory {directory}: {e}. Annotations won't be cached.")
+        return None
+    return directory
+
+
+# removes all entries of the cache
+def clear(directory: str):
+    util.debug(f"Clearing annotation cache {directory}.")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+# returns the hash of the parser and the html restrictions, which all entries depend on
+def __get_parser_hash() -> str:
+    global __parser_hash
+    if __parser_hash is None:
+        h = hashlib.sha256()
+        h.update(util.get_from_environment("HTML_WARNINGS", "0").encode("utf-8"))
+        for file in PARSER_FILES:
+            h.update(b"\0")
+            try:
+                with open(os.path.join(os.path.dirname(__file__), file), "rb") as f:
+                    h.update(f.read())
+            except OSError:
+                pass
+        __parser_hash = h.hexdigest()
+    return __parser_hash
+
+
+# returns the hash of the RFCs which are linked locally
+def __links_hash(rfcs: Optional[frozenset]) -> str:
+    if rfcs not in __links_hashes:
+        __links_hashes[rfcs] = hashlib.sha256("\0".join(sorted(rfcs or [])).encode("utf-8")).hexdigest()
+    return __links_hashes[rfcs]
+
+
+# returns the name of the entry of an annotation file: the same file linking other RFCs has another entry
+def __entry_name(path: str, rfcs: Optional[frozenset]) -> str:
+    path_hash = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return f"{path_hash[:32]}.{__links_hash(rfcs)[:16]}{ENTRY_SUFFIX}"
+
+
+# returns the hash of the content of an annotation file and of everything else its parsing depends on
+def content_hash(path: str, content: bytes, rfcs: Optional[frozenset]) -> str:
+    h = hashlib.sha256()
+    h.update(f"{__get_parser_hash()}\0{__links_hash(rfcs)}\0{path}\0".encode("utf-8"))
+    h.update(content)
+    return h.hexdigest()
+
+
+# returns the cached entry of an annotation file if it was stored for the same content hash, otherwise None
+def load(directory: Optional[str], path: str, rfcs: Optional[frozenset], file_hash: str) -> Optional[dict]:
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, __entry_name(path, rfcs)), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry["hash"] == file_hash:
+            return entry
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+# stores the entry of an annotation file: the parsed annotations, the messages of the parser and the checksums of the
+# errata the annotations were checked against
+def store(directory: Optional[str], path: str, rfcs: Optional[frozenset], file_hash: str, annotations: list,
+          out: str, err: str, errata_checksums: dict):
+    if directory is None:
+        return
+    file_name = os.path.join(directory, __entry_name(path, rfcs))
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "w", encoding="utf-8") as f:
+            json.dump({"hash": file_hash, "path": os.path.abspath(path), "annotations": annotations, "out": out,
+                       "err": err, "errata": errata_checksums}, f)
+        os.replace(temp_name, file_name)
+    except (OSError, TypeError, ValueError) as e:
+        util.debug(f"can't write annotation cache entry {file_name}: {e}")
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+
+
+# removes the entries of annotation files which don't exist anymore. The entries of the given paths are kept without
+# checking them. The generated annotations in generated_directory only exist in memory: their entries are removed if
+# they belong to one of the given RFCs, which were all generated, and kept otherwise, as the RFCs of other lists are
+# generated by other runs.
+def evict(directory: Optional[str], paths: [str], generated_directory: Optional[str] = None, rfcs: [str] = ()):
+    if directory is None:
+        return
+    known = {hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:32] for path in paths}
+    generated_directory = None if generated_directory is None else os.path.abspath(generated_directory)
+    rfcs = set(rfcs)
+    for file in util.filtered_files(directory, suffix=ENTRY_SUFFIX):
+        if file.split(".")[0] in known:
+            continue
+        try:
+            with open(os.path.join(directory, file), "r", encoding="utf-8") as f:
+                path = json.load(f)["path"]
+        except (OSError, ValueError, KeyError, TypeError):
+            path = None
+        if path is not None and os.path.dirname(path) == generated_directory:
+            stale = os.path.basename(path).split(".")[0] in rfcs
+        else:
+            stale = path is None or not os.path.exists(path)
+        if stale:
+            try:
+                os.remove(os.path.join(directory, file))
+            except OSError as e:
+                util.debug(f"can't remove annotation cache entry {file}: {e}")
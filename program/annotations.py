@@ -1,26 +1,187 @@
+import contextlib
+import hashlib
+import io
+import itertools
+import json
 import os
 import re
+import sys
 import textwrap
 from typing import Optional, List
 from datetime import datetime
 
+import annotationcache  # content_hash, load, store
 import drafts       # get_draft_index, get_draft_status
 import errata       # filter_errata, errata_checksum
 import htmlfilter   # filter_html
 import rfcindex     # read_xml_document, fetch_element, referenced_document_ids
-import util         # filtered_files, correct_path, replace_links_in_text, rewrite_rfc_anchor, create_anchor
+import util         # filtered_files, correct_path, replace_links_in_text, rewrite_rfc_anchor, create_anchor, LinkResolver
 
 ''' Get and output the annotations for RFC annotations tools '''
 
+# the record of the generated annotation files written to their directory, with their checksums
+WRITTEN_RECORD = ".written.json"
+
+# the parsed annotation files by path and linked RFCs, with the version of the file they were parsed from
+__parsed_files = {}
+
 
 # defines the built-in annotation types and their order
 def built_in_annotation_types() -> List[str]:
     return ["obsoleted", "potentially_obsoleted", "updated", "potentially_updated", "has_errata"]
 
 
+# the status and errata annotations generated during a run by RFC. They are kept in memory as the texts of annotation
+# files, named after the files in the directory of generated annotations, and are only written there if desired
+class GeneratedAnnotations:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # the texts of the generated annotations by RFC and file name, in the order they were generated
+        self.texts = {}
+
+    # returns the texts of the generated annotations of the desired RFC by file name, to which new ones may be added
+    def rfc_texts(self, rfc: str) -> dict:
+        return self.texts.setdefault(rfc, {})
+
+    # returns the text of the generated annotation with the given path, or None if there's none
+    def content(self, path: str) -> Optional[str]:
+        name = os.path.basename(path)
+        text = self.texts.get(name.split(".")[0], {}).get(name)
+        return text if text is not None and os.path.join(self.directory, name) == path else None
+
+    # returns the paths of all generated annotations
+    def paths(self) -> [str]:
+        return [os.path.join(self.directory, name) for texts in self.texts.values() for name in texts]
+
+    # writes the generated annotations to their directory for inspecting them. A record of the written files keeps
+    # their checksums: a file still containing what was written is replaced if it's outdated, and removed if its
+    # annotation of the same RFC isn't generated anymore. Changed files, and files the record doesn't know, are kept.
+    def write(self):
+        util.info(f"Writing generated annotations to {self.directory}... ", end="")
+        os.makedirs(self.directory, exist_ok=True)
+        record_name = os.path.join(self.directory, WRITTEN_RECORD)
+        try:
+            with open(record_name, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            record = {}
+
+        # returns the checksum of a file, or None if it doesn't exist
+        def checksum(path: str) -> Optional[str]:
+            try:
+                with open(path, "rb") as f:
+                    return hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                return None
+
+        written = 0
+        removed = 0
+        kept = []
+        for rfc, texts in self.texts.items():
+            for name, text in texts.items():
+                path = os.path.join(self.directory, name)
+                data = text.encode("utf-8")
+                current = checksum(path)
+                if current == hashlib.sha256(data).hexdigest():
+                    record[name] = current
+                elif current is None or current == record.get(name):
+                    with open(path, "wb") as f:
+                        f.write(data)
+                    record[name] = hashlib.sha256(data).hexdigest()
+                    written += 1
+                else:
+                    kept.append(name)
+        for name in util.filtered_files(self.directory):
+            if name.split(".")[0] in self.texts and name not in self.texts[name.split(".")[0]]:
+                if checksum(os.path.join(self.directory, name)) == record.get(name):
+                    os.remove(os.path.join(self.directory, name))
+                    del record[name]
+                    removed += 1
+                else:
+                    kept.append(name)
+        with open(record_name, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        util.info(f"{written} files written, {removed} files removed.")
+        if len(kept) > 0:
+            util.warn(f"{len(kept)} files in {self.directory} were changed or not written by the tool and are kept: "
+                      f"{', '.join(sorted(kept)[:5])}{', ...' if len(kept) > 5 else ''}. They are not used for the "
+                      "pages: put changed annotations into a directory of your own annotations, and remove these "
+                      "files to get the generated ones.")
+
+
+# the annotation files of the given directories and their children by RFC, scanned once per run. A directory called
+# ".git" or containing a file called ".ignore" is skipped, including its children. The generated annotations take the
+# place of the files of their directory, ordered by name, or follow all files if their directory isn't found.
+class AnnotationIndex:
+
+    def __init__(self, directories: Optional[str], generated: Optional[GeneratedAnnotations] = None):
+        self.generated = generated
+        self.generated_added = False
+        # the annotation directories which don't exist
+        self.missing = []
+        # the files applying to all RFCs, and the files of each RFC. The files of a directory are sorted by
+        # (directory, 0 for global and 1 for RFC files, position in the directory)
+        self.global_files = []
+        self.rfc_files = {}
+        self.directory_count = 0
+        if directories is not None:
+            for directory in directories.split(","):
+                self.__scan(directory.strip())
+        if self.generated is not None and not self.generated_added:
+            self.__add_generated()
+
+    def __scan(self, directory: str):
+        if os.path.basename(directory) == ".git" or os.path.exists(os.path.join(directory, ".ignore")):
+            return
+        if self.generated is not None and os.path.abspath(directory) == os.path.abspath(self.generated.directory):
+            # the files of the generated annotations are never read
+            if not self.generated_added:
+                self.__add_generated()
+            return
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            self.missing.append(directory)
+            return
+        nr = self.directory_count
+        self.directory_count += 1
+        for position, entry in enumerate(entries):
+            path = os.path.join(directory, entry.name)
+            if entry.name.startswith("global."):
+                self.global_files.append((nr, 0, position, path))
+            elif "." in entry.name:
+                self.rfc_files.setdefault(entry.name.split(".")[0], []).append((nr, 1, position, path))
+        for entry in entries:
+            if entry.is_dir():
+                self.__scan(entry.path)
+
+    def __add_generated(self):
+        nr = self.directory_count
+        self.directory_count += 1
+        self.generated_added = True
+        for rfc, texts in self.generated.texts.items():
+            for position, name in enumerate(sorted(texts)):
+                self.rfc_files.setdefault(rfc, []).append((nr, 1, position,
+                                                           os.path.join(self.generated.directory, name)))
+
+    # returns the text of a generated annotation, or None for the path of an annotation file
+    def content(self, path: str) -> Optional[str]:
+        return None if self.generated is None else self.generated.content(path)
+
+    # returns the paths of the annotation files of the desired RFC in the order they are read
+    def files(self, rfc: str) -> [str]:
+        return [path for *_, path in sorted(self.global_files + self.rfc_files.get(rfc, []))]
+
+    # returns the paths of all annotation files
+    def paths(self) -> [str]:
+        return [path for *_, path in self.global_files] + \
+            [path for files in self.rfc_files.values() for *_, path in files]
+
+
 # retrieves a filtered and sorted list of annotations based on errata for the specified RFC
-def get_annotations(rfc: str, directories: Optional[str], errata_list: list, patches: Optional[dict],
-                    rfc_list: Optional[list]) -> list:
+def get_annotations(rfc: str, index: Optional[AnnotationIndex], errata_list: list, patches: Optional[dict],
+                    links: Optional[util.LinkResolver], cache_directory: Optional[str] = None) -> list:
 
     def create_sort_key(d: dict) -> str:
         if "type" in d:
@@ -33,10 +194,19 @@ def get_annotations(rfc: str, directories: Optional[str], errata_list: list, pat
         return "~"  # a key which will be added last
 
     ret = []
-    # search for annotations in the specified directories
-    if directories is not None:
-        for directory in directories.split(","):
-            ret.extend(__get_annotations_from_dir(rfc, directory.strip(), errata_list, patches, rfc_list))
+    # read the annotation files of the RFC, directory by directory
+    if index is not None:
+        for directory in index.missing:
+            util.error(f"Directory '{directory}' does not exist.")
+        for directory, paths in itertools.groupby(index.files(rfc), key=os.path.dirname):
+            current = 0
+            for path in paths:
+                annotations_in_dir = get_annotation_from_file(path, errata_list, patches, links, cache_directory,
+                                                              index.content(path))
+                ret.extend(annotations_in_dir)
+                current += len(annotations_in_dir)
+            if current > 0:
+                util.debug(f"Found {str(current).rjust(2)} annotations {directory}. ")
 
     # sort the annotations
     ret = sorted(ret, key=lambda d: create_sort_key(d))
@@ -61,15 +231,72 @@ def get_annotations(rfc: str, directories: Optional[str], errata_list: list, pat
     return ret
 
 
-# converts an annotation text file into an array of dictionaries storing the annotation details
+# converts an annotation text file into an array of dictionaries storing the annotation details. A file is only parsed
+# again if it, the errata or the linked RFCs changed (global annotations are read for every RFC), and if a cache
+# directory is given, only if it changed since the last run. The messages of the parser are repeated, and the caller
+# gets its own copies of the annotations, which it may modify. If content is given, it's used as the text of the file,
+# which doesn't need to exist.
 def get_annotation_from_file(path: str, errata_list: list, patches: Optional[dict],
-                             rfc_list: Optional[list] = None) -> [dict]:
+                             links: Optional[util.LinkResolver] = None, cache_directory: Optional[str] = None,
+                             content: Optional[str] = None) -> [dict]:
+    if content is not None:
+        version = content
+    else:
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return __parse_annotation_file(path, errata_list, patches, links)
+    rfcs = None if links is None else links.rfcs
+    parsed = __parsed_files.get((path, rfcs))
+    if parsed is None or parsed[0] != version or parsed[1] is not errata_list or parsed[2] is not patches:
+        entry = None
+        if cache_directory is not None:
+            if content is None:
+                with open(path, "rb") as f:
+                    file_hash = annotationcache.content_hash(path, f.read(), rfcs)
+            else:
+                file_hash = annotationcache.content_hash(path, content.encode("utf-8"), rfcs)
+            entry = annotationcache.load(cache_directory, path, rfcs, file_hash)
+            # the annotations were checked against the errata of their last parsing
+            if entry is not None and any(errata.errata_checksum(int(eid), errata_list, patches) != checksum
+                                         for eid, checksum in entry["errata"].items()):
+                entry = None
+        if entry is not None:
+            parsed = version, errata_list, patches, entry["annotations"], entry["out"], entry["err"]
+        else:
+            checked_errata = {}
+            with io.StringIO() as out, io.StringIO() as err:
+                try:
+                    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                        ret = __parse_annotation_file(path, errata_list, patches, links, checked_errata, content)
+                finally:
+                    sys.stdout.write(out.getvalue())
+                    sys.stderr.write(err.getvalue())
+                __parsed_files[(path, rfcs)] = version, errata_list, patches, ret, out.getvalue(), err.getvalue()
+                if cache_directory is not None:
+                    annotationcache.store(cache_directory, path, rfcs, file_hash, ret, out.getvalue(), err.getvalue(),
+                                          checked_errata)
+            return [dict(annotation) for annotation in ret]
+        __parsed_files[(path, rfcs)] = parsed
+    sys.stdout.write(parsed[4])
+    sys.stderr.write(parsed[5])
+    return [dict(annotation) for annotation in parsed[3]]
+
+
+# parses an annotation text file, or the content given for it. The checksums of the errata the annotations are checked
+# against are added to checked_errata, if given
+def __parse_annotation_file(path: str, errata_list: list, patches: Optional[dict],
+                            links: Optional[util.LinkResolver] = None, checked_errata: Optional[dict] = None,
+                            content: Optional[str] = None) -> [dict]:
 
     def check_errata_status(annotation: dict) -> dict:
         # check whether the current annotation is based on an outdated erratum version
         if "errata_id" in annotation:
             current_checksum: str = annotation["checksum"] if "checksum" in annotation else ""
             expected_checksum = errata.errata_checksum(int(annotation["errata_id"]), errata_list, patches)
+            if checked_errata is not None:
+                checked_errata[str(int(annotation["errata_id"]))] = expected_checksum
             if current_checksum != expected_checksum:
                 annotation["outdated"] = True
         return annotation
@@ -82,7 +309,7 @@ def get_annotation_from_file(path: str, errata_list: list, patches: Optional[dic
 
     ret = []
     plain_text_enclosing_element = "p"
-    with open(path, "r") as f:
+    with open(path, "r") if content is None else io.StringIO(content, newline=None) as f:
         lines = f.readlines()
         notes = []
         entry = {}
@@ -93,7 +320,7 @@ def get_annotation_from_file(path: str, errata_list: list, patches: Optional[dic
             if is_plain_text:
                 ann_notes.append(f"</{plain_text_enclosing_element}>")
             else:
-                ann_notes = util.rewrite_rfc_anchors(htmlfilter.filter_html(ann_notes, path=path), rfc_list)
+                ann_notes = util.rewrite_rfc_anchors(htmlfilter.filter_html(ann_notes, path=path), links)
             entry["notes"] = ann_notes
             return ann_notes
 
@@ -161,7 +388,7 @@ def get_annotation_from_file(path: str, errata_list: list, patches: Optional[dic
                         is_plain_text = True
                         notes.append(f"<{plain_text_enclosing_element} class='plaintext'>")
                 if is_plain_text:
-                    line = util.rewrite_rfc_anchor(util.replace_links_in_text(line, True), rfc_list)
+                    line = util.rewrite_rfc_anchor(util.replace_links_in_text(line, True), links)
                 notes.append(line)
         notes = save_current_annotation(notes)
         if len(notes) > 0:
@@ -171,38 +398,9 @@ def get_annotation_from_file(path: str, errata_list: list, patches: Optional[dic
     return ret
 
 
-# fetches recursively all annotation files for the desired RFC in the directory (and it's children)
-def __get_annotations_from_dir(rfc: str, directory: str, errata_list: list, patches: Optional[dict],
-                               rfc_list: Optional[list] = None) -> list:
-    ret = []
-    # Do not fetch annotations if the directory is called ".git"
-    if os.path.basename(directory) == ".git":
-        return ret
-    # Do not fetch annotations if there is a file called ".ignore"
-    if os.path.exists(os.path.join(directory, ".ignore")):
-        return ret
-    # Normal processing
-    current = 0
-    try:
-        for file in util.filtered_files(directory, "global.") + util.filtered_files(directory, f"{rfc}."):
-            path = os.path.join(directory, file)
-            annotations_in_dir = get_annotation_from_file(path, errata_list, patches, rfc_list)
-            ret.extend(annotations_in_dir)
-            current += len(annotations_in_dir)
-        if current > 0:
-            util.debug(f"Found {str(current).rjust(2)} annotations {directory}. ")
-        for subdir in os.scandir(directory):
-            if subdir.is_dir():
-                ret.extend(__get_annotations_from_dir(rfc, subdir.path, errata_list, patches, rfc_list))
-    except FileNotFoundError:
-        util.error(f"Directory '{directory}' does not exist.")
-        pass
-    return ret
-
-
 # returns status information (like obsoleted, updated etc.) for a single RFC (based on the information of
 # https://www.rfc-editor.org/rfc-index.xml). This information is used for the generation of annotation files.
-def __create_status_annotations(rfc_nr: str, rfc_list: list, root: dict, draft_index: Optional[dict],
+def __create_status_annotations(rfc_nr: str, links: util.LinkResolver, root: dict, draft_index: Optional[dict],
                                 errata_list: Optional[list] = None, patches=None,
                                 draft_status: Optional[dict] = None) -> list:
 
@@ -232,7 +430,7 @@ def __create_status_annotations(rfc_nr: str, rfc_list: list, root: dict, draft_i
                 target = entry if count == 0 else f"https://www.rfc-editor.org/errata/eid{entry}"
                 entry = "errata" if count == 0 else f"#{entry}"
             else:
-                target = util.get_rfc_target(rfc, rfc_list)
+                target = links.target(rfc)
                 entry = f"RFC{rfc}"
             s += util.create_anchor(href=target, text=entry)
             count += 1
@@ -275,9 +473,7 @@ def __create_status_annotations(rfc_nr: str, rfc_list: list, root: dict, draft_i
             ret.append(create_entry("OBSOLETED", "Obsoleted by ", obsoleted_by, 1))
         else:
             updated_by = rfcindex.referenced_document_ids(node, "updated-by")
-            for candidate in rfc_list:
-                if candidate in updated_by:
-                    updated_by.remove(candidate)
+            updated_by = [candidate for candidate in updated_by if candidate not in links.rfcs]
             if len(updated_by) > 0:
                 ret.append(create_entry("UPDATED", "Updated by ", updated_by, 2))
         errata_url = node.getElementsByTagName("errata-url")
@@ -305,110 +501,101 @@ def __create_status_annotations(rfc_nr: str, rfc_list: list, root: dict, draft_i
     return ret
 
 
-# creates annotation files containing the status of the RFCs (based on the information of
-# https://www.rfc-editor.org/rfc-index.xml)
-def create_from_status(rfc_list: list, annotation_directory: str, read_directory: str = ".",
-                       errata_list: Optional[list] = None, patches=None):
+# creates the annotations containing the status of the RFCs (based on the information of
+# https://www.rfc-editor.org/rfc-index.xml). If fetch is False, nothing is fetched: the cached RFC index is used as it
+# is, and without it no status annotations are created. Without the cached status of the drafts, the drafts are skipped.
+def create_from_status(rfc_list: list, generated: GeneratedAnnotations, read_directory: str = ".",
+                       errata_list: Optional[list] = None, patches=None, fetch: bool = True):
     read_directory = util.correct_path(read_directory)
-    _, lookup_map = rfcindex.read_xml_document(read_directory)
+    if not fetch and not os.path.exists(read_directory + "rfc-index.xml"):
+        util.warn(f"no cached rfc-index.xml in {read_directory}: status annotations are not created without fetching "
+                  "files.")
+        return
+    _, lookup_map = rfcindex.read_xml_document(read_directory, revalidate=fetch)
     if lookup_map is None:
         util.error("can't read RFC index")
         return
-    draft_index = drafts.get_draft_index(read_directory)
-    draft_status = drafts.get_draft_status(read_directory)
+    if not fetch and not os.path.exists(os.path.join(read_directory, "drafts", "status.json")):
+        util.warn(f"no cached status of the drafts in {read_directory}: drafts are skipped without fetching files.")
+        draft_index = None
+        draft_status = None
+    else:
+        draft_index = drafts.get_draft_index(read_directory)
+        draft_status = drafts.get_draft_status(read_directory)
 
     util.info("Creating status annotations... ", end="")
-    has_skipped_files = False
+    links = util.LinkResolver(rfc_list)
     for rfc in rfc_list:
         rfc: str = rfc.lower().strip()
         rfc = rfc if rfc.startswith("rfc") else "rfc" + rfc
-        for caption, notes, line in __create_status_annotations(rfc, rfc_list, lookup_map, draft_index, errata_list,
+        texts = generated.rfc_texts(rfc)
+        for caption, notes, line in __create_status_annotations(rfc, links, lookup_map, draft_index, errata_list,
                                                                 patches, draft_status):
             annotation_type = caption.replace(' ', '_').lower()
-            local_name = f"{rfc}.{annotation_type}.txt"
-            fn = os.path.join(annotation_directory, local_name)
-            if os.path.exists(fn):
-                if has_skipped_files:
-                    util.debug(f", {local_name}", end="")
-                else:
-                    util.debug(f"\n   Files exist and will be skipped: {local_name}", end="")
-                    has_skipped_files = True
-            else:
-                with open(fn, "w") as f:
-                    f.write(f"#A\n#C {caption}\n#T {annotation_type}\n#\n#\n<div>{notes}</div>\n\n")
-    if has_skipped_files:
-        util.debug("")
+            texts[f"{rfc}.{annotation_type}.txt"] = \
+                f"#A\n#C {caption}\n#T {annotation_type}\n#\n#\n<div>{notes}</div>\n\n"
     util.info("Done.")
 
 
-# create annotation files based on the errata stored (https://www.rfc-editor.org/errata.json) for the desired RFCs.
-def create_from_errata(rfc_list: list, annotation_directory: str, errata_list: Optional[list] = None, patches=None):
+# create annotations based on the errata stored (https://www.rfc-editor.org/errata.json) for the desired RFCs.
+def create_from_errata(rfc_list: list, generated: GeneratedAnnotations, errata_list: Optional[list] = None,
+                       patches=None):
 
     def patch_urls(text: str) -> str:
         return text.replace("<", "<&shy;")
 
     util.info("Creating errata annotations... ", end="")
-    has_skipped_files = False
     for rfc in rfc_list:
         rfc: str = rfc.lower().strip()
         rfc = rfc if rfc.startswith("rfc") else "rfc" + rfc
+        texts = generated.rfc_texts(rfc)
         for erratum in errata.filter_errata(rfc, errata_list, patches):
             eid = erratum["errata_id"]
             checksum = errata.errata_checksum(eid, errata_list, patches)
-            local_name = f"{rfc}.erratum.{eid}"
-            fn = os.path.join(annotation_directory, local_name)
-            if os.path.exists(fn):
-                if has_skipped_files:
-                    util.debug(f", {local_name}", end="")
-                else:
-                    util.debug(f"\n   Files exist and will be skipped: {local_name}", end="")
-                    has_skipped_files = True
-            else:
-                with open(fn, "w") as f:
-                    author = erratum["submitter_name"] if "submitter_name" in erratum else ""
-                    f.write(f"#A {author}\n")
-                    if "section" in erratum:
-                        entry = erratum["section"]
-                        if type(entry) is list:
-                            entry = entry[0]
-                        entry = f"{entry}".lower()
-                        if entry.startswith("line-"):
-                            f.write(f"#L {entry[5:]}\n")
-                        elif entry.startswith("fragment-"):
-                            f.write(f"#F {entry[9:]}\n")
-                        else:
-                            f.write(f"#S {entry}\n")
-                    if "errata_type_code" in erratum:
-                        f.write(f"#T {erratum['errata_type_code']}\n")
-                    f.write(f'#X errata_id:{eid}\n')
-                    f.write(f'#X checksum:{checksum}\n')
-                    if "errata_status_code" in erratum:
-                        f.write(f'#X errata_status_code:{erratum["errata_status_code"]}\n')
-                    f.write('#\n#\n')
-                    text_added = False
-                    if "orig_text" in erratum and erratum["orig_text"] is not None:
-                        text_added = True
-                        s = patch_urls(str(erratum["orig_text"]))
-                        f.write(f'<div class="original"><pre>\n{s}\n</pre></div>\n')
-                    if "correct_text" in erratum and erratum["correct_text"] is not None:
+            with io.StringIO() as f:
+                author = erratum["submitter_name"] if "submitter_name" in erratum else ""
+                f.write(f"#A {author}\n")
+                if "section" in erratum:
+                    entry = erratum["section"]
+                    if type(entry) is list:
+                        entry = entry[0]
+                    entry = f"{entry}".lower()
+                    if entry.startswith("line-"):
+                        f.write(f"#L {entry[5:]}\n")
+                    elif entry.startswith("fragment-"):
+                        f.write(f"#F {entry[9:]}\n")
+                    else:
+                        f.write(f"#S {entry}\n")
+                if "errata_type_code" in erratum:
+                    f.write(f"#T {erratum['errata_type_code']}\n")
+                f.write(f'#X errata_id:{eid}\n')
+                f.write(f'#X checksum:{checksum}\n')
+                if "errata_status_code" in erratum:
+                    f.write(f'#X errata_status_code:{erratum["errata_status_code"]}\n')
+                f.write('#\n#\n')
+                text_added = False
+                if "orig_text" in erratum and erratum["orig_text"] is not None:
+                    text_added = True
+                    s = patch_urls(str(erratum["orig_text"]))
+                    f.write(f'<div class="original"><pre>\n{s}\n</pre></div>\n')
+                if "correct_text" in erratum and erratum["correct_text"] is not None:
+                    if text_added:
+                        f.write("#\n#\n")
+                    text_added = True
+                    s = patch_urls(str(erratum["correct_text"]))
+                    f.write(f'<div class="correct">It should say:<pre>\n{s}\n</pre></div>\n')
+                if "notes" in erratum and erratum["notes"] is not None:
+                    s = str(erratum["notes"]).strip()
+                    if s.endswith("from pending"):
+                        s = s[:-12].rstrip()
+                    if len(s) > 0:
                         if text_added:
-                            f.write("#\n#\n")
-                        text_added = True
-                        s = patch_urls(str(erratum["correct_text"]))
-                        f.write(f'<div class="correct">It should say:<pre>\n{s}\n</pre></div>\n')
-                    if "notes" in erratum and erratum["notes"] is not None:
-                        s = str(erratum["notes"]).strip()
-                        if s.endswith("from pending"):
-                            s = s[:-12].rstrip()
-                        if len(s) > 0:
-                            if text_added:
-                                f.write('#\n#\n<hr/>\n')
-                            f.write('<div class="note"><pre>')
-                            for paragraph in s.split("\n"):
-                                for note_line in textwrap.wrap(paragraph, width=72, drop_whitespace=False):
-                                    note_line = util.replace_links_in_text(note_line, True)
-                                    f.write(f"\n{note_line.strip()}")
-                            f.write('\n</pre></div>\n\n')
-    if has_skipped_files:
-        util.debug("")
+                            f.write('#\n#\n<hr/>\n')
+                        f.write('<div class="note"><pre>')
+                        for paragraph in s.split("\n"):
+                            for note_line in textwrap.wrap(paragraph, width=72, drop_whitespace=False):
+                                note_line = util.replace_links_in_text(note_line, True)
+                                f.write(f"\n{note_line.strip()}")
+                        f.write('\n</pre></div>\n\n')
+                texts[f"{rfc}.erratum.{eid}"] = f.getvalue()
     util.info("Done.")
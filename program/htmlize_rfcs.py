@@ -1,6 +1,11 @@
+import concurrent.futures
 import html
+import multiprocessing
 import re
-import urllib
+import signal
+import threading
+import time
+import urllib.parse
 
 # Derived from rfc2html.py from the IETF Trust
 # This derivative work falls under the IETF Trust's license at
@@ -8,408 +13,879 @@ import urllib
 
 
 BOM_CODE = 65279
+# version of the markup rules, to be increased whenever a change of the rules changes the generated markup
+MARKUP_VERSION = 1
+MULTIDOC_SEPARATOR = "========================================================================"
+# documents with fewer pages are never split into batches by markup_in_batches()
+MIN_BATCH_PAGES = 8
+PAGE_BREAK = "</pre>\n<hr class='noprint'/><!--NewPage--><pre class='newpage'>"
+
+PAGE_ANCHOR_PATTERN = re.compile("(?si)(\f)([^\f]*\[Page (\w+)\])")
+# the end of the page header following a form feed. Batches of pages are split there, so the page footer, the form
+# feed and the page header, which are greyed out together, always end up in the same batch.
+PAGE_BOUNDARY_PATTERN = re.compile("\f\n[^\n]*(?=\n)")
+# the line boundaries recognized by str.splitlines()
+LINE_BREAK_PATTERN = re.compile("\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+ANCHOR_ID_PATTERN = re.compile('id="([^"]*)"')
+# the tags of a marked up line, including unterminated ones and stray ">", and its entities. See visible_text().
+VISIBLE_TAG_PATTERN = re.compile("<[^>]*>?|>")
+VISIBLE_ENTITY_PATTERN = re.compile("&[^;&]*;?")
+# the control characters removed by degraded_markup(): all but tabs, line feeds and form feeds
+DEGRADED_CONTROL_PATTERN = re.compile("[\x00-\x08\x0b\x0d-\x1f]")
+DEGRADED_PAGE_BREAK_PATTERN = re.compile("\n?\f\n?")
+
+
+# per-document state shared by the rules of one markup run
+class MarkupContext:
+
+    def __init__(self, name=None, profile=None, budget=None, references=None):
+        self.name = name
+        self.profile = profile
+        self.budget = budget
+        self.deadline = None if budget is None or not budget.document else time.perf_counter() + budget.document
+        self.prefixlen = 0
+        # the reference records of the document, see references(). Extracted by the markup if None.
+        self.references = references
+        self.reference = {}
+        self.ref_url = {}
+        self.ref_targets = []
+        # only used when marking up a batch of pages, see markup_in_batches()
+        self.skip = ()
+        self.page_anchors = None
+        self.multidoc = None
+        self.first_part = 0
+
+
+# a named, precompiled substitution of the markup pipeline. The replacement is either a template string or a
+# function called with the match and the MarkupContext of the current document. If head_lines is set, the rule
+# is only applied to that many lines at the start of the document.
+class MarkupRule:
+
+    def __init__(self, name, pattern, replacement, count=0, head_lines=None):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.replacement = replacement
+        self.count = count
+        self.head_lines = head_lines
+
+    def apply(self, text, context):
+        return self.substitute(text, context)[0]
+
+    # returns the resulting text and the number of matches
+    def substitute(self, text, context):
+        replacement = self.replacement
+        if callable(replacement):
+            function = replacement
+            replacement = lambda match: function(match, context)
+        if self.head_lines is None:
+            return self.pattern.subn(replacement, text, self.count)
+        lines = text.splitlines(True)
+        head = "".join(lines[:self.head_lines])
+        rest = "".join(lines[self.head_lines:])
+        head, matches = self.pattern.subn(replacement, head, self.count)
+        return head + rest, matches
+
+
+# a named step of the markup pipeline which can't be expressed as a single substitution
+class MarkupStep:
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def apply(self, text, context):
+        return self.function(text, context)
+
+
+# raised when the markup of a document or a single rule exceeds its time budget
+class MarkupTimeout(Exception):
+
+    def __init__(self, rule, seconds, budget, document=False):
+        super().__init__(rule, seconds, budget, document)
+        self.rule = rule
+        self.seconds = seconds
+        self.budget = budget
+        self.document = document
+
+    def __str__(self):
+        if self.document:
+            return f"markup exceeded its time budget of {self.budget}s (in rule '{self.rule}')"
+        return f"rule '{self.rule}' exceeded its time budget of {self.budget}s"
+
+
+# time budgets in seconds for the markup of a whole document and of a single rule (None or 0 for no limit). A
+# document exceeding a budget gets the degraded_markup() instead, and the MarkupTimeout is added to exceeded.
+# Where possible, a timer interrupts the rule, otherwise the budgets are checked after each rule.
+class MarkupBudget:
+
+    def __init__(self, document=None, rule=None):
+        self.document = document
+        self.rule = rule
+        self.exceeded = []
+
+    # runs a rule of the document with the given context within the budget
+    def apply(self, rule, text, context):
+        start = time.perf_counter()
+        limit = self.rule or None
+        if context.deadline is not None:
+            remaining = context.deadline - start
+            if remaining <= 0:
+                raise MarkupTimeout(rule.name, 0.0, self.document, True)
+            limit = remaining if limit is None else min(limit, remaining)
+        timer = limit is not None and hasattr(signal, "setitimer") and \
+            threading.current_thread() is threading.main_thread()
+        if timer:
+            def interrupt(signum, frame):
+                raise MarkupTimeout(rule.name, time.perf_counter() - start, *self.__exceeded(context))
+            handler = signal.signal(signal.SIGALRM, interrupt)
+            signal.setitimer(signal.ITIMER_REAL, limit)
+        try:
+            text = rule.apply(text, context) if context.profile is None else context.profile.apply(rule, text, context)
+        finally:
+            if timer:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, handler)
+        seconds = time.perf_counter() - start
+        if (self.rule and seconds > self.rule) or (context.deadline is not None and time.perf_counter() > context.deadline):
+            raise MarkupTimeout(rule.name, seconds, *self.__exceeded(context))
+        return text
+
+    # returns the exceeded budget and whether it is the one of the document
+    def __exceeded(self, context):
+        if context.deadline is not None and time.perf_counter() >= context.deadline:
+            return self.document, True
+        return self.rule, False
+
+
+# records the wall time, the number of matches and the input size of every rule applied to the documents. Set
+# document to the name of the document before marking it up.
+class MarkupProfile:
 
+    def __init__(self, document=None):
+        self.document = document
+        # tuples of document, rule name, seconds, matches (None for steps) and input size
+        self.records = []
+
+    def apply(self, rule, text, context):
+        start = time.perf_counter()
+        if isinstance(rule, MarkupRule):
+            result, matches = rule.substitute(text, context)
+        else:
+            result, matches = rule.apply(text, context), None
+        self.records.append((self.document, rule.name, time.perf_counter() - start, matches, len(text)))
+        return result
+
+    # returns the totals per rule, the slowest rules first
+    def rules(self):
+        totals = {}
+        for document, rule, seconds, matches, size in self.records:
+            total = totals.setdefault(rule, {"rule": rule, "seconds": 0.0, "calls": 0, "matches": None, "size": 0})
+            total["seconds"] += seconds
+            total["calls"] += 1
+            total["size"] += size
+            if matches is not None:
+                total["matches"] = (total["matches"] or 0) + matches
+        return sorted(totals.values(), key=lambda total: total["seconds"], reverse=True)
+
+    # returns the totals per document together with its slowest rule, the slowest documents first
+    def documents(self):
+        totals = {}
+        for document, rule, seconds, matches, size in self.records:
+            total = totals.setdefault(document, {"document": document, "seconds": 0.0, "slowest rule": None,
+                                                 "slowest rule seconds": 0.0})
+            total["seconds"] += seconds
+            if seconds > total["slowest rule seconds"]:
+                total["slowest rule"] = rule
+                total["slowest rule seconds"] = seconds
+        return sorted(totals.values(), key=lambda total: total["seconds"], reverse=True)
+
+
+# the markup pipeline as an ordered table of rules. All patterns are compiled once when the engine is created,
+# so a single engine should be reused for all documents (see get_engine()).
+class MarkupEngine:
+
+    def __init__(self, path=".", script="", extra=""):
+        self.path = path
+        self.script = script
+        self.extra = extra
+        self.rules = self.__build_rules()
+
+    # runs all rules over the given RFC text and returns the html markup
+    def markup(self, text, name=None, profile=None, budget=None, references=None):
+        return self.apply(text, MarkupContext(name, profile, budget, references))
+
+    # runs the rules from index start up to (but excluding) end, except those named in context.skip
+    def apply(self, text, context, start=0, end=None):
+        for rule in self.rules[start:end]:
+            if rule.name not in context.skip:
+                if context.budget is not None:
+                    text = context.budget.apply(rule, text, context)
+                elif context.profile is not None:
+                    text = context.profile.apply(rule, text, context)
+                else:
+                    text = rule.apply(text, context)
+        return text
 
-def markup(text, path=".", script="", extra="", name=None):
-
-    # ------------------------------------------------------------------------
-    # Start of markup handling
-
-    # Strip BOM if present
-    if ord(text[0]) == BOM_CODE:
-        text = text[1:]
-
-    # Convert \r which is not followed or preceded by a \n to \n
-    #  (in case this is a mac document)
-    text = re.sub("([^\n])\r([^\n])", "\g<1>\n\g<2>", text)
-    # Strip control characters with the exception of \t, \b and \n (we'll
-    # deal with \b later)
-    text = re.sub(r'[\x00-\x07\x0b-\x1f]', '', text)
-
-    # -------------
-    # Normalization
-
-    # Remove whitespace at the end of lines
-    text = re.sub("[\t ]+\n", "\n", text)
-
-    # Remove whitespace (including formfeeds) at the end of the document.
-    # (Trailing formfeeds will result in trailing blank pages.)
-    text = re.sub("[\t \r\n\f]+$", "\n", text)
-
-    text = text.expandtabs()
-
-    # Remove extra blank lines at the start of the document
-    text = re.sub("^\n*", "", text, 1)
-
-    # Fix up page breaks:
-    # \f should aways be preceeded and followed by \n
-    text = re.sub("([^\n])\f", "\g<1>\n\f", text)
-    text = re.sub("\f([^\n])", "\f\n\g<1>", text)
-    # Limit the number of blank lines after page break
-    text = re.sub("\f\n+", "\f\n", text)
-
-    # [Page nn] should be followed by \n\f\n
-    text = re.sub("(?i)(\[Page [0-9ivxlc]+\])[\n\f\t ]*(\n *[^\n\f\t ])", "\g<1>\n\f\g<2>", text)
-    
-    # Normalize indentation
-    linestarts = re.findall("(?m)^([ ]*)\S", text)
-    prefixlen = 72
-    for start in linestarts:
-        if len(start) < prefixlen:
-            prefixlen = len(start)
-    if prefixlen:
-        text = re.sub("\n"+(" "*prefixlen), "\n", text)
-
-    # reference name tag markup
-    reference = {}
-    ref_url = {}
-
-    ## Locate the start of the References section as the first reference
-    ## definition after the last reference usage
-
-    ref_beg = re.search("(?im)^(\d+(\.\d+)*)(\.?[ ]+)(References?|Normative References?|Informative References?)", text)
-    ref_text = text[ref_beg.end():] if ref_beg else text
-
-    ref_stop_list = re.findall(r'(?im)^(?:Appendix\s+[A-Z]\.|[0-9]+\.)(?:[0-9.]+)?\s+\S.+$', ref_text)
-    ref_stop_text = [ t for t in ref_stop_list if not 'reference' in t.lower() ][:1]
-    if ref_stop_text:
-        ref_end = ref_text.index(ref_stop_text[0])
-        ref_text = ref_text[:ref_end]
-
-    ##ref_usages = re.findall("(\W)(\[)([-\w.]+)((, ?[-\w.]+)*\])", text)
-    ref_defs = re.findall("(?sm)^( *\n *)\[([-\w.]+?)\]( +)(.*?)(\n *)$", ref_text)
-
-    ##ref_pos = [ match.start() for match in ref_usages ]
-    ##def_pos = [ match.start() for match in ref_defs ]
-    ##ref_pos = [ pos for pos in ref_pos if not pos in ref_defs ]
-    ##last_ref_pos = ref_pos[-1] if ref_pos else None
-
-    #sys.stderr.write("ref_defs: %s\n" % repr(ref_defs))        
-    for tuple in ref_defs:
-        title_match = re.search("(?sm)^(.*?(\"[^\"]+?\").+?|.*?(,[^,]+?,)[^,]+?)$", tuple[3])
-        if title_match:
-            reftitle = title_match.group(2) or title_match.group(3).strip("[ ,]+")
-            # Get rid of page break information inside the title
-            reftitle = re.sub("(?s)\n\n\S+.*\n\n", "", reftitle)
-            reftitle = html.escape(reftitle, quote=True)
-            reftitle = re.sub("[\n\t ]+", " ", reftitle) # Remove newlines and tabs
-            reference[tuple[1]] = reftitle if not re.search(r'(?i)(page|section|appendix)[- ]', reftitle) else ''
-        url_match = re.search(r"(http|https|ftp)://\S+", tuple[3])
-        if url_match:
-            ref_url[tuple[1]] = url_match.group(0)
-            
-    # -------------
-    # escape any html significant characters
-    text = html.escape(text)
-
-
-    # -------------
-    # Adding markup
-
-    text = "<pre>"+text+"</pre>"
-
-    # Typewriter-style underline:
-    text = re.sub("_[\b](.)", "<u>\g<1></u>", text)
-    # Strip remaining instances of \b
-    text = text.replace('\b', '')
-
-    # Document-specific fixes
-    if name and name == "draft-ietf-dnsop-interim-signed-root-01":
-        text = text.replace(u"F\x84ltstr\xF7m", u"F\u00e4ltstr\u00f6m")
-        text = text.replace(u"Ihr\x89n", u"Ihr\u00e9n")
-
-
-    # Line number markup goes here
-
-
-    # Obsoletes: ... markup
-    
-    def rfclist_replace(keyword, text):
-        def replacement(match):
+    # returns the index of the rule with the given name
+    def index(self, name):
+        for i, rule in enumerate(self.rules):
+            if rule.name == name:
+                return i
+        raise KeyError(name)
+
+    def __build_rules(self):
+        script = self.script
+        extra = self.extra
+        path = self.path
+
+        def strip_bom(text, context):
+            if ord(text[0]) == BOM_CODE:
+                text = text[1:]
+            return text
+
+        def normalize_indentation(text, context):
+            linestarts = indentation_pattern.findall(text)
+            prefixlen = 72
+            for start in linestarts:
+                if len(start) < prefixlen:
+                    prefixlen = len(start)
+            if prefixlen:
+                text = text.replace("\n"+(" "*prefixlen), "\n")
+            context.prefixlen = prefixlen
+            return text
+
+        def extract_references(text, context):
+            if context.references is None:
+                ## Locate the start of the References section as the first reference
+                ## definition after the last reference usage
+                ref_beg = ref_beg_pattern.search(text)
+                ref_text = text[ref_beg.end():] if ref_beg else text
+
+                ref_stop_list = ref_stop_pattern.findall(ref_text)
+                ref_stop_text = [ t for t in ref_stop_list if not 'reference' in t.lower() ][:1]
+                if ref_stop_text:
+                    ref_end = ref_text.index(ref_stop_text[0])
+                    ref_text = ref_text[:ref_end]
+
+                context.references = [reference_record(tuple) for tuple in ref_def_pattern.findall(ref_text)]
+            for record in context.references:
+                if record["title"] is not None:
+                    reftitle = html.escape(record["title"], quote=True)
+                    context.reference[record["tag"]] = reftitle if not title_page_pattern.search(reftitle) else ''
+                if record["url"] is not None:
+                    context.ref_url[record["tag"]] = record["url"]
+            return text
+
+        # returns the record of a reference definition: its tag, title, URL and the RFC it refers to
+        def reference_record(tuple):
+            reftitle = None
+            title_match = title_pattern.search(tuple[3])
+            if title_match:
+                reftitle = title_match.group(2) or title_match.group(3).strip("[ ,]+")
+                # Get rid of page break information inside the title
+                reftitle = title_page_break_pattern.sub("", reftitle)
+                reftitle = title_whitespace_pattern.sub(" ", reftitle) # Remove newlines and tabs
+            url_match = ref_url_pattern.search(tuple[3])
+            rfc_match = reference_rfc_pattern.match(tuple[1]) or \
+                reference_definition_rfc_pattern.search(title_page_break_pattern.sub("", tuple[3]))
+            return {"tag": tuple[1], "title": reftitle, "url": url_match.group(0) if url_match else None,
+                    "rfc": "rfc" + rfc_match.group(1) if rfc_match else None}
+
+        def escape(text, context):
+            return html.escape(text)
+
+        def enclose_in_pre(text, context):
+            return "<pre>"+text+"</pre>"
+
+        def strip_backspaces(text, context):
+            return text.replace('\b', '')
+
+        def document_specific_fixes(text, context):
+            if context.name and context.name == "draft-ietf-dnsop-interim-signed-root-01":
+                text = text.replace(u"F\x84ltstr\xF7m", u"F\u00e4ltstr\u00f6m")
+                text = text.replace(u"Ihr\x89n", u"Ihr\u00e9n")
+            return text
+
+        # Obsoletes: ... markup
+        def rfclist_replacement(match, context):
             group = list(match.groups(""))
-            group[3] = re.sub("\d+", """<a href=\"%s?%srfc=\g<0>\">\g<0></a>""" % (script, extra), group[3])
+            group[3] = rfclist_number_pattern.sub(rfclist_anchor, group[3])
             if group[8]:
-                group[8] = re.sub("\d+", """<a href=\"%s?%srfc=\g<0>\">\g<0></a>""" % (script, extra), group[8])
+                group[8] = rfclist_number_pattern.sub(rfclist_anchor, group[8])
             else:
                 group[8] = ""
             return "\n%s%s%s\n%s%s" % (group[0], group[3], group[5], group[7], group[8])
-        text = re.sub("\n(%s( RFCs| RFC)?: ?( RFCs| RFC)?)(( \d+,| \d+)+)(.*)\n(( *)((\d+, )*(\d+)))*" % keyword, replacement, text, 1)
-        return text
 
-    text = rfclist_replace("Obsoletes", text)
-    text = rfclist_replace("Updates", text)
-    
-    lines = text.splitlines(True)
-    head  = "".join(lines[:28])
-    rest  = "".join(lines[28:])
-
-    # title markup
-    head = re.sub("""(?im)(([12][0-9][0-9][0-9]|^Obsoletes.*|^Category: (Standards Track|Informational|Experimental|Best Current Practice)) *\n\n+ +)([A-Z][^\n]+)$""", """\g<1><span class=\"h1\">\g<4></span>""", head, 1)
-    head = re.sub("""(?i)(<span class="h1".+</span>)(\n +)([^<\n]+)\n""", """\g<1>\g<2><span class="h1">\g<3></span>\n""", head, 1)
-    head = re.sub("""(?i)(<span class="h1".+</span>)(\n +)([^<\n]+)\n""", """\g<1>\g<2><span class="h1">\g<3></span>\n""", head, 1)
-
-    text = head + rest
-
-    # http link markup
-    # link crossing a line.  Not permitting ":" after the line break will
-    # result in some URLs broken across lines not being recognized, but
-    # will on the other hand correctly handle a series of URL listed line
-    # by line, one on each line.
-    #  Link crossing a line, where the continuation contains '.' or '/'
-    text = re.sub("(?im)(\s|^|[^=]\"|\()((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[./][A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|$)",
-                    "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>", text)
-    text = re.sub("(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(&gt;)",
-                    "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>", text)
-    #  Link crossing a line, where first line ends in '-' or '/'
-    text = re.sub("(?im)(\s|^|[^=]\"|\()((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?[-/])(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|$)",
-                    "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>", text)
-    text = re.sub("(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(&gt;)",
-                    "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>", text)
-    # link crossing a line, enclosed in "<" ... ">"
-    text = re.sub("(?im)<((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])>",
-                    "<\g<1><a href=\"\g<1>\g<5>\">\g<1></a>\g<4><a href=\"\g<1>\g<5>\">\g<5></a>>", text)
-    text = re.sub("(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&;?#~=-]+[A-Za-z0-9_/@%&;?#~=-])(&gt;)",
-                    "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>", text)
-    # link crossing two lines, enclosed in "<" ... ">"
-    text = re.sub("(?im)<((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])>",
-                    "<\g<1><a href=\"\g<1>\g<5>\g<7>\">\g<1></a>\g<4><a href=\"\g<1>\g<5>\g<7>\">\g<5></a>\g<6><a href=\"\g<1>\g<5>\g<7>\">\g<7></a>>", text)
-    text = re.sub("(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(\n +)([A-Za-z0-9_./@%&;?#~=-]+[A-Za-z0-9_/@%&;?#~=-])(&gt;)",
-                    "\g<1><a href=\"\g<2>\g<6>\g<8>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\g<8>\">\g<6></a>\g<7><a href=\"\g<2>\g<6>\g<8>\">\g<8></a>\g<9>", text)
-    # link on a single line
-    text = re.sub("(?im)(\s|^|[^=]\"|&lt;|\()((http|https|ftp)://[:A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|&gt;|$)",
-                    "\g<1><a href=\"\g<2>\">\g<2></a>\g<4>", text)
-#         # Special case for licensing boilerplate
-#         text = text.replace('<a href="http://trustee.ietf.org/">http://trustee.ietf.org/</a>\n   license-info',
-#                             '<a href="http://trustee.ietf.org/licence-info">http://trustee.ietf.org/</a>\n   <a href="http://trustee.ietf.org/licence-info">licence-info</a>')
-
-    # undo markup if RFC2606 domain
-    text = re.sub("""(?i)<a href="[a-z]*?://([a-z0-9_-]+?\.)?example(\.(com|org|net))?(/.*?)?">(.*?)</a>""", "\g<5>", text) 
-
-    # draft markup
-    # draft name crossing line break
-    text = re.sub("([^/#=\?\w-])(draft-([-a-zA-Z0-9]+-)?)((?: {3,}\S.*)?\n +)([-a-zA-Z0-9]+[a-zA-Z0-9](.txt)?)",
-                    "\g<1><a href=\"%s?%sdraft=\g<2>\g<5>\">\g<2></a>\g<4><a href=\"%s?%sdraft=\g<2>\g<5>\">\g<5></a>" % (script, extra, script, extra), text)
-    # draft name on one line (but don't mess with what we just did above)
-    text = re.sub("([^/#=\?\w>=-])(draft-[-a-zA-Z0-9]+[a-zA-Z0-9](.txt)?)",
-                    "\g<1><a href=\"%s?%sdraft=\g<2>\">\g<2></a>" % (script, extra), text)
-
-    # rfc markup
-    # rfc and number on the same line
-    text = re.sub("""(?i)([^[/>\w-])(rfc([- ]?))([0-9]+)(\W)""",
-                    """\g<1><a href=\"%s?%srfc=\g<4>\">\g<2>\g<4></a>\g<5>""" % (script, extra), text)
-    # rfc and number on separate lines
-    text = re.sub("(?i)([^[/>\w-])(rfc([-]?))(\n +)([0-9]+)(\W)",
-                    "\g<1><a href=\"%s?%srfc=\g<5>\">\g<2></a>\g<4><a href=\"%s?%srfc=\g<5>\">\g<5></a>\g<6>" % (script, extra, script, extra), text)
-    # spelled out Request For Comments markup
-    text = re.sub("(?i)(\s)(Request\s+For\s+Comments\s+\([^)]+\)\s+)([0-9]+)",
-                    "\g<1>\g<2><a href=\"%s?%srfc=\g<3>\">\g<3></a>" % (script, extra), text)
-    # bcp markup
-    text = re.sub("(?i)([^[/>\w.-])(bcp([- ]?))([0-9]+)(\W)",
-                    "\g<1><a href=\"%s?%sbcp=\g<4>\">\g<2>\g<4></a>\g<5>" % (script, extra), text)
-    text = re.sub("(?i)([^[/>\w.-])(bcp([-]?))(\n +)([0-9]+)(\W)",
-                    "\g<1><a href=\"%s?%sbcp=\g<5>\">\g<2></a>\g<4><a href=\"%s?%sbcp=\g<5>\">\g<5></a>\g<6>" % (script, extra, script, extra), text)
-
-    def workinprogress_replacement(match):
-        g1 = match.group(1)
-        g2 = match.group(2)
-        g3 = match.group(3)
-        # eliminate embedded hyperlinks in text we'll use as anchor text
-        g4 = match.group(4)
-        g4 = re.sub("<a.+?>(.+?)</a>", "\g<1>", g4)
-        g4url = urllib.quote_plus(g4)
-        g5 = match.group(5)
-        return """%s[<a id=\"ref-%s\">%s</a>]%s<a style=\"text-decoration: none\" href='https://www.google.com/search?sitesearch=datatracker.ietf.org%%2Fdoc%%2Fhtml%%2F&amp;q=inurl:draft-+%s'>%s</a>%s""" % (g1, g2, g2, g3, g4url, g4, g5)
-
-    text = re.sub("(\n *\n *)\[([-\w.]+)\](\s+.*?)(\".+\")(,\s+Work\s+in\s+Progress.)", workinprogress_replacement, text)
-    text = re.sub("(\n *\n *)\[([-\w.]+)\](\s)", "\g<1>[<a id=\"ref-\g<2>\">\g<2></a>]\g<3>", text)
-
-    text = re.sub("(\n *\n *)\[(RFC [-\w.]+)\](\s)", "\g<1>[<a id=\"ref-\g<2>\">\g<2></a>]\g<3>", text)
-
-    ref_targets = re.findall('<a id="ref-(.*?)"', text)
-
-    # reference link markup
-    def reference_replacement(match):
-        pre = match.group(1)
-        beg = match.group(2)
-        tag = match.group(3)
-        end = match.group(4)
-        isrfc = re.match("(?i)^rfc[ -]?([0-9]+)$", tag)
-        if isrfc:
-            rfcnum = isrfc.group(1)
-            if tag in reference:
-                return """%s%s<a href="%s?%srfc=%s" title="%s">%s</a>%s""" % (pre, beg, script, extra, rfcnum, reference[tag], tag, end)
-            else:
-                return """%s%s<a href="%s?%srfc=%s">%s</a>%s""" % (pre, beg, script, extra, rfcnum , tag, end)
-        else:
-            if tag in ref_targets:
+        def rfclist_rule(keyword):
+            return MarkupRule(f"{keyword.lower()} list",
+                              "\n(%s( RFCs| RFC)?: ?( RFCs| RFC)?)(( \d+,| \d+)+)(.*)\n(( *)((\d+, )*(\d+)))*" % keyword,
+                              rfclist_replacement, count=1)
+
+        def workinprogress_replacement(match, context):
+            g1 = match.group(1)
+            g2 = match.group(2)
+            g3 = match.group(3)
+            # eliminate embedded hyperlinks in text we'll use as anchor text
+            g4 = match.group(4)
+            g4 = workinprogress_anchor_pattern.sub("\g<1>", g4)
+            g4url = urllib.parse.quote_plus(g4)
+            g5 = match.group(5)
+            return """%s[<a id=\"ref-%s\">%s</a>]%s<a style=\"text-decoration: none\" href='https://www.google.com/search?sitesearch=datatracker.ietf.org%%2Fdoc%%2Fhtml%%2F&amp;q=inurl:draft-+%s'>%s</a>%s""" % (g1, g2, g2, g3, g4url, g4, g5)
+
+        def collect_reference_targets(text, context):
+            context.ref_targets = ref_target_pattern.findall(text)
+            return text
+
+        # reference link markup: returns the link for a reference tag, or None if the tag isn't a target
+        def reference_anchor(tag, context):
+            isrfc = reference_rfc_pattern.match(tag)
+            reference = context.reference
+            if isrfc:
+                rfcnum = isrfc.group(1)
                 if tag in reference:
-                    return """%s%s<a href="#ref-%s" title="%s">%s</a>%s""" % (pre, beg, tag, reference[tag], tag, end)
+                    return """<a href="%s?%srfc=%s" title="%s">%s</a>""" % (script, extra, rfcnum, reference[tag], tag)
                 else:
-                    return """%s%s<a href="#ref-%s">%s</a>%s""" % (pre, beg, tag, tag, end)
+                    return """<a href="%s?%srfc=%s">%s</a>""" % (script, extra, rfcnum , tag)
             else:
-                return match.group(0)
+                if tag in context.ref_targets:
+                    if tag in reference:
+                        return """<a href="#ref-%s" title="%s">%s</a>""" % (tag, reference[tag], tag)
+                    else:
+                        return """<a href="#ref-%s">%s</a>""" % (tag, tag)
+                else:
+                    return None
 
-    # Group:       1   2   3        45
-    text = re.sub("(\W)(\[)([-\w.]+)((, ?[-\w.]+)*\])", reference_replacement, text)
-    text = re.sub("(\W)(\[)(RFC [0-9]+)((, ?RFC [0-9]+)*\])", reference_replacement, text)
-    while True:
-        old = text
-        text = re.sub("(\W)(\[(?:<a.*?>.*?</a>, ?)+)([-\w.]+)((, ?[-\w.]+)*\])", reference_replacement, text)
-        if text == old:
-            break
-    while True:
-        old = text
-        text = re.sub("(\W)(\[(?:<a.*?>.*?</a>, ?)+)(RFC [-\w.]+)((, ?RFC [-\w.]+)*\])", reference_replacement, text)
-        if text == old:
-            break
-
-    # greying out the page headers and footers
-    text = re.sub("\n(.+\[Page \w+\])\n\f\n(.+)\n", """\n<span class="grey">\g<1></span>\n\f\n<span class="grey">\g<2></span>\n""", text)
-
-    # contents link markup: section links
-    #                   1    2   3        4        5        6         7
-    text = re.sub("(?m)^(\s*)(\d+(\.\d+)*)(\.?[ ]+)(.*[^ .])( *\. ?\.)(.*[0-9])$", """\g<1><a href="#section-\g<2>">\g<2></a>\g<4>\g<5>\g<6>\g<7>""", text)
-    text = re.sub("(?m)^(\s*)(Appendix |)([A-Z](\.\d+)*)(\.?[ ]+)(.*[^ .])( *\. ?\.)(.*[0-9])$", """\g<1><a href="#appendix-\g<3>">\g<2>\g<3></a>\g<5>\g<6>\g<7>\g<8>""", text)
-
-    # anchor markup: abstract, toc
-    text = re.sub("(?m)^(\s*)(Abstract)$", """\g<1><a id="abstract" href="#abstract" class="selflink">\g<2></a>""", text, count=1)
-    text = re.sub("(?m)^(\s*)(Table of Contents)$", """\g<1><a id="table-of-contents" href="#table-of-contents" class="selflink">\g<2></a>""", text, count=1)
-
-    # page number markup
-    multidoc_separator = "========================================================================"
-    if re.search(multidoc_separator, text):
-        parts = re.split(multidoc_separator, text)
-        for i in range(len(parts)):
-            parts[i] = re.sub("(?si)(\f)([^\f]*\[Page (\w+)\])", "\g<1><span id=\"%(page)s-\g<3>\" ></span>\g<2>"%{"page": "page-%s"%(i+1)}, parts[i])
-            parts[i] = re.sub("(?i)(\. ?\. +|\. \. \.|\.\.\. *)([0-9ivxlc]+)( *\n)", "\g<1><a href=\"#%(page)s-\g<2>\">\g<2></a>\g<3>"%{"page": "page-%s"%(i+1)}, parts[i])
-        text = multidoc_separator.join(parts)
-    else:
-        # page name tag markup
-        text = re.sub("(?si)(\f)([^\f]*\[Page (\w+)\])", "\g<1><span id=\"page-\g<3>\" ></span>\g<2>", text)
-        # contents link markup: page numbers
-        text = re.sub("(?i)(\. ?\. +|\. \. \.|\.\.\. *)([0-9ivxlc]+)( *\n)", "\g<1><a href=\"#page-\g<2>\">\g<2></a>\g<3>", text)
-
-    # section number tag markup
-    def section_anchor_replacement(match):
-        # exclude TOC entries
-        mstring = match.group(0)
-        if " \. \. " in mstring or "\.\.\." in mstring:
-            return mstring
-
-        level = len(re.findall("[^\.]+", match.group(1)))+1
-        if level > 6:
-            level = 6
-        html = """<span class="h%s"><a class=\"selflink\" id=\"section-%s\" href=\"#section-%s\">%s</a>%s</span>""" % (level, match.group(1), match.group(1), match.group(1), match.group(3))
-        html = html.replace("\n", """</span>\n<span class="h%s">""" % level)
-        return html
-            
-
-    text = re.sub("(?im)^(\d+(\.\d+)*)(\.?[ ]+\S.*?(\n +\w+.*)?(  |$))", section_anchor_replacement, text)
-    #text = re.sub("(?i)(\n *\n *)(\d+(\.\d+)*)(\.?[ ].*)", section_replacement, text)
-    # section number link markup
-    text = re.sub("(?i)(section\s)(\d+(\.\d+)*)", "<a href=\"#section-\g<2>\">\g<1>\g<2></a>", text)
-    text = re.sub("(?i)(section)\n(\s+)(\d+(\.\d+)*)", "<a href=\"#section-\g<3>\">\g<1></a>\n\g<2><a href=\"#section-\g<3>\">\g<3></a>", text)
-
-    # Special cases for licensing boilerplate
-    text = text.replace('<a href="#section-4">Section 4</a>.e of the Trust Legal Provisions',
-                        'Section 4.e of the <a href="https://trustee.ietf.org/license-info">Trust Legal Provisions</a>')
-
-    while True:
-        old = text
-        text = re.sub("(?i)(sections\s(<a.*?>.*?</a>(,\s|\s?-\s?|\sthrough\s|\sor\s|\sto\s|,?\sand\s))*)(\d+(\.\d+)*)", "\g<1><a href=\"#section-\g<4>\">\g<4></a>", text)
-        if text == old:
-            break
-
-    # appendix number tag markup
-    def appendix_replacement(match):
-        # exclude TOC entries
-        mstring = match.group(0)
-        if " \. \. " in mstring or "\.\.\." in mstring:
-            return mstring
-
-        txt = match.group(4)
-        num = match.group(2).rstrip('.')
-        if num != match.group(2):
-            txt = "." + txt
-        level = len(re.findall("[^\.]+", num))+1
-        if level > 6:
-            level = 6
-        return """<span class="h%s"><a class=\"selflink\" id=\"appendix-%s\" href=\"#appendix-%s\">%s%s</a>%s</span>""" % (level, num, num, match.group(1), num, txt)
-
-    text = re.sub("(?m)^(Appendix |)([A-Z](\.|\.\d+)+)(\.?[ ].*)$", appendix_replacement, text)
-    #text = re.sub("(?i)(\n *\n *)(\d+(\.\d+)*)(\.?[ ].*)", appendix_replacement, text)
-    # appendix number link markup                          
-    text = re.sub(" ([Aa]ppendix\s)([A-Z](\.\d+)*)", " <a href=\"#appendix-\g<2>\">\g<1>\g<2></a>", text)
-    text = re.sub(" ([Aa]ppendix)\n(\s+)([A-Z](\.\d+)*)", " <a href=\"#appendix-\g<3>\">\g<1></a>\n\g<2><a href=\"#appendix-\g<3>\">\g<3></a>", text)
-
-#        # section x of draft-y markup
-#        text = re.sub("(?i)<a href=\"[^\"]*\">(section)\s(\d+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"[^\"]*\">(draft-[-.a-zA-Z0-9]+[a-zA-Z0-9])</a>", "<a href=\"%s?%surl=%s/rfc\g<7>.txt#section-\g<2>\">\g<1>&nbsp;\g<2>\g<4>\g<6>\g<7></a>" % (script, extra, rfcs), text)
-#        # draft-y, section x markup
-#        text = re.sub("(?i)<a href=\"[^\"]*\">(draft-[-.a-zA-Z0-9]+[a-zA-Z0-9])</a>(,?\s)<a href=\"[^\"]*\">(section)\s(\d+(\.\d+)*)</a>", "<a href=\"%s?%surl=%s/rfc\g<2>.txt#section-\g<5>\">\g<1>\g<2>\g<3>\g<4>&nbsp;\g<5></a>" % (script, extra, rfcs), text)
-#        # [draft-y], section x markup
-#        text = re.sub("(?i)\[<a href=\"[^>\"]+\">(draft-[-.a-zA-Z0-9]+[a-zA-Z0-9])</a>\](,?\s)<a href=\"[^>\"]*\">(section)\s(\d+(\.\d+)*)</a>", "<a href=\"%s?%surl=%s/rfc\g<2>.txt#section-\g<5>\">[\g<1>\g<2>]\g<3>\g<4>&nbsp;\g<5></a>" % (script, extra, rfcs), text)
-
-    for n in ['rfc', 'bcp', 'fyi', 'std']:
-        # section x of rfc y markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
-            "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>\g<8>\g<9></a>" % (script, extra, n), text)
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(section)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>(\d+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
-            "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>\g<9>\g<10></a>" % (script, extra, n, script, extra, n), text)
-        # appendix x of rfc y markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
-            "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>\g<8>\g<9></a>" % (script, extra, n), text)
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>([A-Z]+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
-            "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>\g<9>\g<10></a>" % (script, extra, n, script, extra, n), text)
-
-        # rfc y, section x markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>(,?\s+)<a href=\"([^\"]*)\"[^>]*>(section)\s?(([^<]*))</a>"%n,
-            "<a href=\"%s?%s%s=\g<3>\g<5>\">\g<2>\g<3>\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n), text)
-        # rfc y, appendix x markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>(,?\s+)<a href=\"([^\"]*)\"[^>]*>(appendix)\s?(([^<]*))</a>"%n,
-            "<a href=\"%s?%s%s=\g<3>\g<5>\">\g<2>\g<3>\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n), text)
-
-        # section x of? [rfc y] markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
-            "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>[\g<8>\g<9>]</a>" % (script, extra, n), text)
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(section)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>(\d+(\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
-            "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>[\g<9>\g<10>]</a>" % (script, extra, n, script, extra, n), text)
-        # appendix x of? [rfc y] markup
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
-            "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>[\g<8>\g<9>]</a>" % (script, extra, n), text)
-        text = re.sub("(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>([A-Z](\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
-            "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>[\g<9>\g<10>]</a>" % (script, extra, n, script, extra, n), text)
-
-        # [rfc y], section x markup
-        text = re.sub("(?i)\[<a href=\"([^>\"]+)\"[^>]*>(%s[- ]?)([0-9]+)</a>\](,?\s+)<a href=\"([^>\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>"%n,
-            "<a href=\"%s?%s%s=\g<3>\g<5>\">[\g<2>\g<3>]\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n), text)
-        # [rfc y], appendix x markup
-        text = re.sub("(?i)\[<a href=\"([^>\"]+)\"[^>]*>(%s[- ]?)([0-9]+)</a>\](,?\s+)<a href=\"([^>\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>"%n,
-            "<a href=\"%s?%s%s=\g<3>\g<5>\">[\g<2>\g<3>]\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n), text)
-
-
-    # remove section link for section x.x (of|in) <something else>
-    old = text
-    text = re.sub("(?i)<a href=\"[^\"]*\"[^>]*>(section\s)(\d+(\.\d+)*)</a>(\.?[a-z]*\s+(of|in)\s+)(\[?)<a href=\"([^\"]*)\"([^>]*)>(.*)</a>(\]?)",
-        '\g<1>\g<2>\g<4>\g<6><a href="\g<7>"\g<8>>\g<9></a>\g<10>', text)
-    text = re.sub('(?i)(\[?)<a href="([^"]*#ref[^"]*)"([^>]*)>(.*?)</a>(\]?,\s+)<a href="[^"]*"[^>]*>(section\s)(\d+(\.\d+)*)</a>',
-        '\g<1><a href="\g<2>"\g<3>>\g<4></a>\g<5>\g<6>\g<7>', text)
-
-    # Special fix for referring to the trust legal provisons in
-    # boilerplate text:
-    text = re.sub("(?i)<a href=\"[^\"]*\"[^>]*>(section\s)(\d+(\.\d+)*)</a>(\.?[a-z]*\s+(of|in)\s*\n\s*the Trust Legal Provisions)",
-        '\g<1>\g<2>\g<4>', text)
-
-    #
-    #text = re.sub("\f", "<div class=\"newpage\" />", text)
-    text = re.sub("\n?\f\n?", "</pre>\n<hr class='noprint'/><!--NewPage--><pre class='newpage'>", text)
-
-    # restore indentation
-    if prefixlen:
-        text = re.sub("\n", "\n"+(" "*prefixlen), text)
-
-    if path:
-        text = re.sub("%s\?(rfc|bcp|std)=" % script, "%s/\g<1>" % path, text)
-        text = re.sub("%s\?draft=" % script, "%s/" % path, text)
-
-    return text
-  
\ No newline at end of file
+        def reference_replacement(match, context):
+            anchor = reference_anchor(match.group(3), context)
+            if anchor is None:
+                return match.group(0)
+            return match.group(1) + match.group(2) + anchor + match.group(4)
+
+        # reference list markup: links the remaining entries of a list like [<a ..>A</a>, B, C] in one go,
+        # stopping at the first entry which isn't a reference target
+        def reference_list_replacement(match, context):
+            parts = reference_list_separator_pattern.split(match.group(2))
+            for i in range(0, len(parts), 2):
+                anchor = reference_anchor(parts[i], context)
+                if anchor is None:
+                    break
+                parts[i] = anchor
+            return match.group(1) + "".join(parts) + "]"
+
+        # section list markup: links every section number of a list like "sections 3.1, 3.2 and 4" in one go
+        def section_list_replacement(match, context):
+            return section_list_entry_pattern.sub(lambda m: m.group(1) or "<a href=\"#section-%s\">%s</a>" % (m.group(2), m.group(2)),
+                                                  match.group(0))
+
+        # page number markup. The parts of a multi-document text get their own page ids. For a batch of pages,
+        # the page name tags have been determined on the whole document (see markup_in_batches()).
+        def page_markup(text, context):
+            parts = text.split(MULTIDOC_SEPARATOR)
+            multidoc = len(parts) > 1 if context.multidoc is None else context.multidoc
+            for i in range(len(parts)):
+                page = "page-%s" % (context.first_part + i + 1) if multidoc else "page"
+                if context.page_anchors is None:
+                    # page name tag markup
+                    parts[i] = PAGE_ANCHOR_PATTERN.sub("\g<1><span id=\"%s-\g<3>\" ></span>\g<2>" % page, parts[i])
+                # contents link markup: page numbers
+                parts[i] = page_link_pattern.sub("\g<1><a href=\"#%s-\g<2>\">\g<2></a>\g<3>" % page, parts[i])
+            text = MULTIDOC_SEPARATOR.join(parts)
+            if context.page_anchors is not None:
+                pages = text.split("\f")
+                for i, anchor in enumerate(context.page_anchors):
+                    if anchor is not None:
+                        pages[i + 1] = "<span id=\"%s\" ></span>%s" % (anchor, pages[i + 1])
+                text = "\f".join(pages)
+            return text
+
+        # section number tag markup
+        def section_anchor_replacement(match, context):
+            # exclude TOC entries
+            mstring = match.group(0)
+            if " \. \. " in mstring or "\.\.\." in mstring:
+                return mstring
+
+            level = len(level_pattern.findall(match.group(1)))+1
+            if level > 6:
+                level = 6
+            html = """<span class="h%s"><a class=\"selflink\" id=\"section-%s\" href=\"#section-%s\">%s</a>%s</span>""" % (level, match.group(1), match.group(1), match.group(1), match.group(3))
+            html = html.replace("\n", """</span>\n<span class="h%s">""" % level)
+            return html
+
+        # Special cases for licensing boilerplate
+        def licensing_boilerplate(text, context):
+            return text.replace('<a href="#section-4">Section 4</a>.e of the Trust Legal Provisions',
+                                'Section 4.e of the <a href="https://trustee.ietf.org/license-info">Trust Legal Provisions</a>')
+
+        # appendix number tag markup
+        def appendix_replacement(match, context):
+            # exclude TOC entries
+            mstring = match.group(0)
+            if " \. \. " in mstring or "\.\.\." in mstring:
+                return mstring
+
+            txt = match.group(4)
+            num = match.group(2).rstrip('.')
+            if num != match.group(2):
+                txt = "." + txt
+            level = len(level_pattern.findall(num))+1
+            if level > 6:
+                level = 6
+            return """<span class="h%s"><a class=\"selflink\" id=\"appendix-%s\" href=\"#appendix-%s\">%s%s</a>%s</span>""" % (level, num, num, match.group(1), num, txt)
+
+        # compound cross reference markup: a single scan finds the clusters of links which are only separated by
+        # connectors like ", ", " of ", "], " or a line break, and the cross reference rules are applied to those
+        # clusters instead of the whole document. Only these rules are combined: the rfc, bcp, draft, url, section
+        # and appendix links are still found by one pass over the whole document each.
+        def cross_references(text, context):
+            def replacement(match):
+                cluster = match.group(0)
+                if cluster.count("</a>") < 2:
+                    return cluster
+                for n, document_rules in xref_rules:
+                    if n in cluster.lower():
+                        for rule in document_rules:
+                            cluster = rule.apply(cluster, context)
+                return cluster
+            return xref_cluster_pattern.sub(replacement, text)
+
+        # restore indentation
+        def restore_indentation(text, context):
+            if context.prefixlen:
+                text = text.replace("\n", "\n"+(" "*context.prefixlen))
+            return text
+
+        indentation_pattern = re.compile("(?m)^([ ]*)\S")
+        ref_beg_pattern = re.compile("(?im)^(\d+(\.\d+)*)(\.?[ ]+)(References?|Normative References?|Informative References?)")
+        ref_stop_pattern = re.compile(r'(?im)^(?:Appendix\s+[A-Z]\.|[0-9]+\.)(?:[0-9.]+)?\s+\S.+$')
+        ref_def_pattern = re.compile("(?sm)^( *\n *)\[([-\w.]+?)\]( +)(.*?)(\n *)$")
+        title_pattern = re.compile("(?sm)^(.*?(\"[^\"]+?\").+?|.*?(,[^,]+?,)[^,]+?)$")
+        title_page_break_pattern = re.compile("(?s)\n\n\S+.*\n\n")
+        title_whitespace_pattern = re.compile("[\n\t ]+")
+        title_page_pattern = re.compile(r'(?i)(page|section|appendix)[- ]')
+        ref_url_pattern = re.compile(r"(http|https|ftp)://\S+")
+        rfclist_number_pattern = re.compile("\d+")
+        rfclist_anchor = """<a href=\"%s?%srfc=\g<0>\">\g<0></a>""" % (script, extra)
+        workinprogress_anchor_pattern = re.compile("<a.+?>(.+?)</a>")
+        ref_target_pattern = re.compile('<a id="ref-(.*?)"')
+        reference_rfc_pattern = re.compile("(?i)^rfc[ -]?([0-9]+)$")
+        reference_definition_rfc_pattern = re.compile(r"\bRFC[ -]?([0-9]+)\b")
+        reference_list_separator_pattern = re.compile("(, ?)")
+        section_list_separator = "(?:,\s|\s?-\s?|\sthrough\s|\sor\s|\sto\s|,?\sand\s)"
+        section_list_entry_pattern = re.compile("(<a.*?>.*?</a>)|(\d+(?:\.\d+)*)")
+        page_link_pattern = re.compile("(?i)(\. ?\. +|\. \. \.|\.\.\. *)([0-9ivxlc]+)( *\n)")
+        level_pattern = re.compile("[^\.]+")
+        xref_anchor = r'<a href="[^"]*"[^>]*>[^<]*</a>'
+        xref_cluster_pattern = re.compile(r'(?i)\[?%s(?:\]?[.,]?\s+(?:(?:of|in)\s+)?\[?%s)*\]?' % (xref_anchor, xref_anchor))
+
+        # the rules combining section and appendix links with the link of the referenced document. They are only
+        # applied to the clusters of adjacent links found by xref_cluster_pattern, grouped by document type. The
+        # engine keeps them as cross_reference_rules for tests/benchmark_cross_references.py.
+        xref_rules = []
+        self.cross_reference_rules = xref_rules
+        for n in ['rfc', 'bcp', 'fyi', 'std']:
+            xref_rules.append((n, [
+                # section x of rfc y markup
+                MarkupRule(f"section x of {n} y", "(?i)<a href=\"([^\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>\g<8>\g<9></a>" % (script, extra, n)),
+                MarkupRule(f"section x of {n} y crossing a line", "(?i)<a href=\"([^\"]*)\"[^>]*>(section)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>(\d+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>\g<9>\g<10></a>" % (script, extra, n, script, extra, n)),
+                # appendix x of rfc y markup
+                MarkupRule(f"appendix x of {n} y", "(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>\g<8>\g<9></a>" % (script, extra, n)),
+                MarkupRule(f"appendix x of {n} y crossing a line", "(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>([A-Z]+(\.\d+)*)</a>(\.?\s+(of|in)\s+)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>\g<9>\g<10></a>" % (script, extra, n, script, extra, n)),
+
+                # rfc y, section x markup
+                MarkupRule(f"{n} y, section x", "(?i)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>(,?\s+)<a href=\"([^\"]*)\"[^>]*>(section)\s?(([^<]*))</a>"%n,
+                           "<a href=\"%s?%s%s=\g<3>\g<5>\">\g<2>\g<3>\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n)),
+                # rfc y, appendix x markup
+                MarkupRule(f"{n} y, appendix x", "(?i)<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>(,?\s+)<a href=\"([^\"]*)\"[^>]*>(appendix)\s?(([^<]*))</a>"%n,
+                           "<a href=\"%s?%s%s=\g<3>\g<5>\">\g<2>\g<3>\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n)),
+
+                # section x of? [rfc y] markup
+                MarkupRule(f"section x of [{n} y]", "(?i)<a href=\"([^\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
+                           "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>[\g<8>\g<9>]</a>" % (script, extra, n)),
+                MarkupRule(f"section x of [{n} y] crossing a line", "(?i)<a href=\"([^\"]*)\"[^>]*>(section)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>(\d+(\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
+                           "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>[\g<9>\g<10>]</a>" % (script, extra, n, script, extra, n)),
+                # appendix x of? [rfc y] markup
+                MarkupRule(f"appendix x of [{n} y]", "(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
+                           "<a href=\"%s?%s%s=\g<9>\g<1>\">\g<2>&nbsp;\g<3>\g<5>[\g<8>\g<9>]</a>" % (script, extra, n)),
+                MarkupRule(f"appendix x of [{n} y] crossing a line", "(?i)<a href=\"([^\"]*)\"[^>]*>(appendix)</a>(\n\s+)<a href=\"(?:[^\"]*)\"[^>]*>([A-Z](\.\d+)*)</a>(\.?\s+(of\s+|in\s+)?)\[<a href=\"([^\"]*)\"[^>]*>(%s[- ]?)([0-9]+)</a>\]"%n,
+                           "<a href=\"%s?%s%s=\g<10>\g<1>\">\g<2></a>\g<3><a href=\"%s?%s%s=\g<10>\g<1>\">\g<4>\g<6>[\g<9>\g<10>]</a>" % (script, extra, n, script, extra, n)),
+
+                # [rfc y], section x markup
+                MarkupRule(f"[{n} y], section x", "(?i)\[<a href=\"([^>\"]+)\"[^>]*>(%s[- ]?)([0-9]+)</a>\](,?\s+)<a href=\"([^>\"]*)\"[^>]*>(section)\s(\d+(\.\d+)*)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<3>\g<5>\">[\g<2>\g<3>]\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n)),
+                # [rfc y], appendix x markup
+                MarkupRule(f"[{n} y], appendix x", "(?i)\[<a href=\"([^>\"]+)\"[^>]*>(%s[- ]?)([0-9]+)</a>\](,?\s+)<a href=\"([^>\"]*)\"[^>]*>(appendix)\s([A-Z](\.\d+)*)</a>"%n,
+                           "<a href=\"%s?%s%s=\g<3>\g<5>\">[\g<2>\g<3>]\g<4>\g<6>&nbsp;\g<7></a>" % (script, extra, n)),
+            ]))
+
+        rules = [
+            # ------------------------------------------------------------------------
+            # Start of markup handling
+
+            # Strip BOM if present
+            MarkupStep("strip bom", strip_bom),
+            # Convert \r which is not followed or preceded by a \n to \n
+            #  (in case this is a mac document)
+            MarkupRule("mac line ends", "([^\n])\r([^\n])", "\g<1>\n\g<2>"),
+            # Strip control characters with the exception of \t, \b and \n (we'll
+            # deal with \b later)
+            MarkupRule("control characters", r'[\x00-\x07\x0b-\x1f]', ''),
+
+            # -------------
+            # Normalization
+
+            # Remove whitespace at the end of lines
+            MarkupRule("trailing whitespace", "[\t ]+\n", "\n"),
+            # Remove whitespace (including formfeeds) at the end of the document.
+            # (Trailing formfeeds will result in trailing blank pages.)
+            MarkupRule("trailing document whitespace", "[\t \r\n\f]+$", "\n"),
+            MarkupStep("expand tabs", lambda text, context: text.expandtabs()),
+            # Remove extra blank lines at the start of the document
+            MarkupRule("leading blank lines", "^\n*", "", count=1),
+            # Fix up page breaks:
+            # \f should aways be preceeded and followed by \n
+            MarkupRule("newline before formfeed", "([^\n])\f", "\g<1>\n\f"),
+            MarkupRule("newline after formfeed", "\f([^\n])", "\f\n\g<1>"),
+            # Limit the number of blank lines after page break
+            MarkupRule("blank lines after formfeed", "\f\n+", "\f\n"),
+            # [Page nn] should be followed by \n\f\n
+            MarkupRule("formfeed after page footer", "(?i)(\[Page [0-9ivxlc]+\])[\n\f\t ]*(\n *[^\n\f\t ])", "\g<1>\n\f\g<2>"),
+            # Normalize indentation
+            MarkupStep("normalize indentation", normalize_indentation),
+            # reference name tag markup
+            MarkupStep("reference definitions", extract_references),
+
+            # -------------
+            # escape any html significant characters
+            MarkupStep("escape html", escape),
+
+            # -------------
+            # Adding markup
+            MarkupStep("enclose in pre", enclose_in_pre),
+            # Typewriter-style underline:
+            MarkupRule("underline", "_[\b](.)", "<u>\g<1></u>"),
+            # Strip remaining instances of \b
+            MarkupStep("strip backspaces", strip_backspaces),
+            # Document-specific fixes
+            MarkupStep("document specific fixes", document_specific_fixes),
+
+            # Obsoletes: ... markup
+            rfclist_rule("Obsoletes"),
+            rfclist_rule("Updates"),
+
+            # title markup
+            MarkupRule("title", """(?im)(([12][0-9][0-9][0-9]|^Obsoletes.*|^Category: (Standards Track|Informational|Experimental|Best Current Practice)) *\n\n+ +)([A-Z][^\n]+)$""",
+                       """\g<1><span class=\"h1\">\g<4></span>""", count=1, head_lines=28),
+            MarkupRule("title continuation", """(?i)(<span class="h1".+</span>)(\n +)([^<\n]+)\n""",
+                       """\g<1>\g<2><span class="h1">\g<3></span>\n""", count=1, head_lines=28),
+            MarkupRule("title second continuation", """(?i)(<span class="h1".+</span>)(\n +)([^<\n]+)\n""",
+                       """\g<1>\g<2><span class="h1">\g<3></span>\n""", count=1, head_lines=28),
+
+            # http link markup
+            # link crossing a line.  Not permitting ":" after the line break will
+            # result in some URLs broken across lines not being recognized, but
+            # will on the other hand correctly handle a series of URL listed line
+            # by line, one on each line.
+            #  Link crossing a line, where the continuation contains '.' or '/'
+            MarkupRule("url crossing a line", "(?im)(\s|^|[^=]\"|\()((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[./][A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|$)",
+                       "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>"),
+            MarkupRule("escaped url crossing a line", "(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(&gt;)",
+                       "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>"),
+            #  Link crossing a line, where first line ends in '-' or '/'
+            MarkupRule("url crossing a line after - or /", "(?im)(\s|^|[^=]\"|\()((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?[-/])(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|$)",
+                       "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>"),
+            MarkupRule("escaped url crossing a line (repeated)", "(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(&gt;)",
+                       "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>"),
+            # link crossing a line, enclosed in "<" ... ">"
+            MarkupRule("enclosed url crossing a line", "(?im)<((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])>",
+                       "<\g<1><a href=\"\g<1>\g<5>\">\g<1></a>\g<4><a href=\"\g<1>\g<5>\">\g<5></a>>"),
+            MarkupRule("escaped enclosed url crossing a line", "(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&;?#~=-]+[A-Za-z0-9_/@%&;?#~=-])(&gt;)",
+                       "\g<1><a href=\"\g<2>\g<6>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\">\g<6></a>\g<7>"),
+            # link crossing two lines, enclosed in "<" ... ">"
+            MarkupRule("enclosed url crossing two lines", "(?im)<((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])>",
+                       "<\g<1><a href=\"\g<1>\g<5>\g<7>\">\g<1></a>\g<4><a href=\"\g<1>\g<5>\g<7>\">\g<5></a>\g<6><a href=\"\g<1>\g<5>\g<7>\">\g<7></a>>"),
+            MarkupRule("escaped enclosed url crossing two lines", "(?im)(&lt;)((http|https|ftp)://([:A-Za-z0-9_./@%&?#~=-]+)?)(\n +)([A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])(\n +)([A-Za-z0-9_./@%&;?#~=-]+[A-Za-z0-9_/@%&;?#~=-])(&gt;)",
+                       "\g<1><a href=\"\g<2>\g<6>\g<8>\">\g<2></a>\g<5><a href=\"\g<2>\g<6>\g<8>\">\g<6></a>\g<7><a href=\"\g<2>\g<6>\g<8>\">\g<8></a>\g<9>"),
+            # link on a single line
+            MarkupRule("url", "(?im)(\s|^|[^=]\"|&lt;|\()((http|https|ftp)://[:A-Za-z0-9_./@%&?#~=-]+[A-Za-z0-9_/@%&?#~=-])([.,)\"\s]|&gt;|$)",
+                       "\g<1><a href=\"\g<2>\">\g<2></a>\g<4>"),
+
+            # undo markup if RFC2606 domain
+            MarkupRule("example domain", """(?i)<a href="[a-z]*?://([a-z0-9_-]+?\.)?example(\.(com|org|net))?(/.*?)?">(.*?)</a>""", "\g<5>"),
+
+            # draft markup
+            # draft name crossing line break
+            MarkupRule("draft crossing a line", "([^/#=\?\w-])(draft-([-a-zA-Z0-9]+-)?)((?: {3,}\S.*)?\n +)([-a-zA-Z0-9]+[a-zA-Z0-9](.txt)?)",
+                       "\g<1><a href=\"%s?%sdraft=\g<2>\g<5>\">\g<2></a>\g<4><a href=\"%s?%sdraft=\g<2>\g<5>\">\g<5></a>" % (script, extra, script, extra)),
+            # draft name on one line (but don't mess with what we just did above)
+            MarkupRule("draft", "([^/#=\?\w>=-])(draft-[-a-zA-Z0-9]+[a-zA-Z0-9](.txt)?)",
+                       "\g<1><a href=\"%s?%sdraft=\g<2>\">\g<2></a>" % (script, extra)),
+
+            # rfc markup
+            # rfc and number on the same line
+            MarkupRule("rfc", """(?i)([^[/>\w-])(rfc([- ]?))([0-9]+)(\W)""",
+                       """\g<1><a href=\"%s?%srfc=\g<4>\">\g<2>\g<4></a>\g<5>""" % (script, extra)),
+            # rfc and number on separate lines
+            MarkupRule("rfc crossing a line", "(?i)([^[/>\w-])(rfc([-]?))(\n +)([0-9]+)(\W)",
+                       "\g<1><a href=\"%s?%srfc=\g<5>\">\g<2></a>\g<4><a href=\"%s?%srfc=\g<5>\">\g<5></a>\g<6>" % (script, extra, script, extra)),
+            # spelled out Request For Comments markup
+            MarkupRule("request for comments", "(?i)(\s)(Request\s+For\s+Comments\s+\([^)]+\)\s+)([0-9]+)",
+                       "\g<1>\g<2><a href=\"%s?%srfc=\g<3>\">\g<3></a>" % (script, extra)),
+            # bcp markup
+            MarkupRule("bcp", "(?i)([^[/>\w.-])(bcp([- ]?))([0-9]+)(\W)",
+                       "\g<1><a href=\"%s?%sbcp=\g<4>\">\g<2>\g<4></a>\g<5>" % (script, extra)),
+            MarkupRule("bcp crossing a line", "(?i)([^[/>\w.-])(bcp([-]?))(\n +)([0-9]+)(\W)",
+                       "\g<1><a href=\"%s?%sbcp=\g<5>\">\g<2></a>\g<4><a href=\"%s?%sbcp=\g<5>\">\g<5></a>\g<6>" % (script, extra, script, extra)),
+
+            MarkupRule("work in progress reference", "(\n *\n *)\[([-\w.]+)\](\s+.*?)(\".+\")(,\s+Work\s+in\s+Progress.)",
+                       workinprogress_replacement),
+            MarkupRule("reference anchor", "(\n *\n *)\[([-\w.]+)\](\s)", "\g<1>[<a id=\"ref-\g<2>\">\g<2></a>]\g<3>"),
+            MarkupRule("rfc reference anchor", "(\n *\n *)\[(RFC [-\w.]+)\](\s)", "\g<1>[<a id=\"ref-\g<2>\">\g<2></a>]\g<3>"),
+            MarkupStep("reference targets", collect_reference_targets),
+
+            # reference link markup
+            # Group:       1   2   3        45
+            MarkupRule("reference", "(\W)(\[)([-\w.]+)((, ?[-\w.]+)*\])", reference_replacement),
+            MarkupRule("rfc reference", "(\W)(\[)(RFC [0-9]+)((, ?RFC [0-9]+)*\])", reference_replacement),
+            MarkupRule("reference list", "(?<=\W)(\[(?:<a.*?>.*?</a>, ?)+)([-\w.]+(?:, ?[-\w.]+)*|RFC [-\w.]+(?:, ?RFC [-\w.]+)*)\]",
+                       reference_list_replacement),
+
+            # greying out the page headers and footers
+            MarkupRule("page header and footer", "\n(.+\[Page \w+\])\n\f\n(.+)\n",
+                       """\n<span class="grey">\g<1></span>\n\f\n<span class="grey">\g<2></span>\n"""),
+
+            # contents link markup: section links
+            #                   1    2   3        4        5        6         7
+            MarkupRule("contents section", "(?m)^(\s*)(\d+(\.\d+)*)(\.?[ ]+)(.*[^ .])( *\. ?\.)(.*[0-9])$",
+                       """\g<1><a href="#section-\g<2>">\g<2></a>\g<4>\g<5>\g<6>\g<7>"""),
+            MarkupRule("contents appendix", "(?m)^(\s*)(Appendix |)([A-Z](\.\d+)*)(\.?[ ]+)(.*[^ .])( *\. ?\.)(.*[0-9])$",
+                       """\g<1><a href="#appendix-\g<3>">\g<2>\g<3></a>\g<5>\g<6>\g<7>\g<8>"""),
+
+            # anchor markup: abstract, toc
+            MarkupRule("abstract", "(?m)^(\s*)(Abstract)$", """\g<1><a id="abstract" href="#abstract" class="selflink">\g<2></a>""", count=1),
+            MarkupRule("table of contents", "(?m)^(\s*)(Table of Contents)$", """\g<1><a id="table-of-contents" href="#table-of-contents" class="selflink">\g<2></a>""", count=1),
+
+            # page number markup
+            MarkupStep("pages", page_markup),
+
+            # section number tag markup
+            MarkupRule("section anchor", "(?im)^(\d+(\.\d+)*)(\.?[ ]+\S.*?(\n +\w+.*)?(  |$))", section_anchor_replacement),
+            # section number link markup
+            MarkupRule("section", "(?i)(section\s)(\d+(\.\d+)*)", "<a href=\"#section-\g<2>\">\g<1>\g<2></a>"),
+            MarkupRule("section crossing a line", "(?i)(section)\n(\s+)(\d+(\.\d+)*)",
+                       "<a href=\"#section-\g<3>\">\g<1></a>\n\g<2><a href=\"#section-\g<3>\">\g<3></a>"),
+
+            # Special cases for licensing boilerplate
+            MarkupStep("licensing boilerplate", licensing_boilerplate),
+
+            MarkupRule("section list", "(?i)sections\s(?:(?:<a.*?>.*?</a>|\d+(?:\.\d+)*)%s)*\d+(?:\.\d+)*" % section_list_separator,
+                       section_list_replacement),
+
+            # appendix number tag markup
+            MarkupRule("appendix anchor", "(?m)^(Appendix |)([A-Z](\.|\.\d+)+)(\.?[ ].*)$", appendix_replacement),
+            # appendix number link markup
+            MarkupRule("appendix", " ([Aa]ppendix\s)([A-Z](\.\d+)*)", " <a href=\"#appendix-\g<2>\">\g<1>\g<2></a>"),
+            MarkupRule("appendix crossing a line", " ([Aa]ppendix)\n(\s+)([A-Z](\.\d+)*)",
+                       " <a href=\"#appendix-\g<3>\">\g<1></a>\n\g<2><a href=\"#appendix-\g<3>\">\g<3></a>"),
+
+            # compound cross references like "section x of rfc y"
+            MarkupStep("cross references", cross_references),
+            # remove section link for section x.x (of|in) <something else>
+            MarkupRule("section x of something else", "(?i)<a href=\"[^\"]*\"[^>]*>(section\s)(\d+(\.\d+)*)</a>(\.?[a-z]*\s+(of|in)\s+)(\[?)<a href=\"([^\"]*)\"([^>]*)>(.*)</a>(\]?)",
+                       '\g<1>\g<2>\g<4>\g<6><a href="\g<7>"\g<8>>\g<9></a>\g<10>'),
+            MarkupRule("reference, section x", '(?i)(\[?)<a href="([^"]*#ref[^"]*)"([^>]*)>(.*?)</a>(\]?,\s+)<a href="[^"]*"[^>]*>(section\s)(\d+(\.\d+)*)</a>',
+                       '\g<1><a href="\g<2>"\g<3>>\g<4></a>\g<5>\g<6>\g<7>'),
+
+            # Special fix for referring to the trust legal provisons in
+            # boilerplate text:
+            MarkupRule("trust legal provisions", "(?i)<a href=\"[^\"]*\"[^>]*>(section\s)(\d+(\.\d+)*)</a>(\.?[a-z]*\s+(of|in)\s*\n\s*the Trust Legal Provisions)",
+                       '\g<1>\g<2>\g<4>'),
+
+            MarkupRule("page breaks", "\n?\f\n?", PAGE_BREAK),
+
+            # restore indentation
+            MarkupStep("restore indentation", restore_indentation),
+        ]
+
+        if path:
+            rules += [
+                MarkupRule("document path", "%s\?(rfc|bcp|std)=" % script, "%s/\g<1>" % path),
+                MarkupRule("draft path", "%s\?draft=" % script, "%s/" % path),
+            ]
+        return rules
+
+
+__engines = {}
+
+
+# returns the (cached) markup engine for the given link configuration
+def get_engine(path=".", script="", extra=""):
+    key = (path, script, extra)
+    if key not in __engines:
+        __engines[key] = MarkupEngine(path, script, extra)
+    return __engines[key]
+
+
+def markup(text, path=".", script="", extra="", name=None, jobs=0, profile=None, budget=None, references=None):
+    try:
+        if jobs > 1:
+            return markup_in_batches(text, jobs, path, script, extra, name, profile, budget, references)
+        return get_engine(path, script, extra).markup(text, name, profile, budget, references)
+    except MarkupTimeout as e:
+        budget.exceeded.append(e)
+        return degraded_markup(text)
+
+
+# returns the text as it is, only escaped and with the page breaks of the markup: the fallback for documents which
+# exceed their MarkupBudget
+def degraded_markup(text):
+    text = text.lstrip(chr(BOM_CODE)).expandtabs()
+    text = DEGRADED_CONTROL_PATTERN.sub("", text)
+    return "<pre>" + DEGRADED_PAGE_BREAK_PATTERN.sub(PAGE_BREAK, html.escape(text)) + "</pre>"
+
+
+# returns the reference records of a text document: the tag, title, URL and RFC of each definition of its References
+# section, in their order. They only depend on the text, so they can be stored and passed to markup() later on,
+# which then doesn't need to locate the References section again. Returns None if the extraction exceeds the budget;
+# the MarkupTimeout is added to its exceeded list, and the document should get the degraded_markup().
+def references(text, path=".", script="", extra="", budget=None):
+    engine = get_engine(path, script, extra)
+    context = MarkupContext(budget=budget)
+    try:
+        engine.apply(text, context, 0, engine.index("reference definitions") + 1)
+    except MarkupTimeout as e:
+        budget.exceeded.append(e)
+        return None
+    return context.references
+
+
+# yields the lines of a text like str.splitlines(), without creating a list of all lines
+def iter_lines(text):
+    start = 0
+    for m in LINE_BREAK_PATTERN.finditer(text):
+        yield text[start:m.start()]
+        start = m.end()
+    if start < len(text):
+        yield text[start:]
+
+
+# returns the ids of the anchors defined in a marked up line
+def anchor_ids(line):
+    return tuple(ANCHOR_ID_PATTERN.findall(line))
+
+
+# returns the text of a marked up line without its tags, and with each entity shortened to its "&"
+def visible_text(line):
+    return VISIBLE_ENTITY_PATTERN.sub("&", VISIBLE_TAG_PATTERN.sub("", line))
+
+
+# returns the number of characters a marked up line shows
+def visible_width(line):
+    return len(visible_text(line))
+
+
+# yields the marked up lines of a text document, each one together with the ids of the anchors it defines and its
+# visible width
+def markup_lines(text, path=".", script="", extra="", name=None, jobs=0, profile=None, budget=None,
+                 references=None):
+    for line in iter_lines(markup(text, path, script, extra, name, jobs, profile, budget, references)):
+        yield line, anchor_ids(line), visible_width(line)
+
+
+# yields the lines of the degraded_markup() of a text document like markup_lines()
+def degraded_lines(text):
+    for line in iter_lines(degraded_markup(text)):
+        yield line, anchor_ids(line), visible_width(line)
+
+
+# marks up a batch of pages in a worker process
+def __markup_batch(job):
+    key, start, end, text, context = job
+    return get_engine(*key).apply(text, context, start, end), context
+
+
+# returns the names of the rules between start and end which only apply to their first match, mapped to the index
+# of the first batch containing a match. The other batches skip these rules.
+def __first_match_batches(engine, start, end, batches):
+    first = {}
+    for rule in engine.rules[start:end]:
+        if isinstance(rule, MarkupRule) and rule.count == 1:
+            first[rule.name] = next((i for i, batch in enumerate(batches) if rule.pattern.search(batch)), None)
+    return first
+
+
+# marks up a document with many pages in batches of pages, distributed over a pool of worker processes. Only the
+# markup depending on the whole document runs in this process: the normalization, the collection of reference
+# definitions and the title page before splitting, the reference targets between the two stages run by the
+# workers, and the page name tags. Short documents, and systems which can't fork workers, are marked up here.
+# The workers' profile records are added to the given profile, so the time of a rule is summed over all batches.
+# A budget limits the rules of each batch, and all batches share the deadline of the document.
+def markup_in_batches(text, jobs, path=".", script="", extra="", name=None, profile=None, budget=None,
+                      references=None):
+    engine = get_engine(path, script, extra)
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return engine.markup(text, name, profile, budget, references)
+    original = text
+    context = MarkupContext(name, profile, budget, references)
+    first_stage = engine.index("url crossing a line")
+    second_stage = engine.index("reference targets") + 1
+    text = engine.apply(text, context, 0, first_stage)
+    boundaries = [m.end() for m in PAGE_BOUNDARY_PATTERN.finditer(text)]
+    pages = len(boundaries) + 1
+    if pages < MIN_BATCH_PAGES:
+        return engine.apply(text, context, first_stage)
+
+    # the page name tags, by position of the form feed
+    parts = text.split(MULTIDOC_SEPARATOR)
+    page_anchors = {}
+    offset = 0
+    for i, part in enumerate(parts):
+        page = "page-%s" % (i + 1) if len(parts) > 1 else "page"
+        for m in PAGE_ANCHOR_PATTERN.finditer(part):
+            page_anchors[offset + m.start()] = "%s-%s" % (page, m.group(3))
+        offset += len(part) + len(MULTIDOC_SEPARATOR)
+
+    count = min(pages, 2 * jobs)
+    cuts = sorted(set(boundaries[pages * k // count - 1] for k in range(1, count)))
+    starts = [0] + cuts
+    ends = cuts + [len(text)]
+    batches = []
+    contexts = []
+    for start, end in zip(starts, ends):
+        # the batch gets a copy of the line break following it, which is removed again after the markup
+        batches.append(text[start:end] + ("\n" if end < len(text) else ""))
+        batch_context = MarkupContext(name, None if profile is None else MarkupProfile(profile.document), budget)
+        batch_context.deadline = context.deadline
+        batch_context.prefixlen = context.prefixlen
+        batch_context.reference = context.reference
+        batch_context.ref_url = context.ref_url
+        batch_context.page_anchors = [page_anchors.get(i) for i in range(start, end) if text[i] == "\f"]
+        batch_context.multidoc = len(parts) > 1
+        batch_context.first_part = text.count(MULTIDOC_SEPARATOR, 0, start)
+        contexts.append(batch_context)
+
+    key = (path, script, extra)
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+        for start, end in [(first_stage, second_stage), (second_stage, len(engine.rules))]:
+            first = __first_match_batches(engine, start, end, batches)
+            for i, batch_context in enumerate(contexts):
+                batch_context.skip = set(rule for rule, batch in first.items() if batch != i)
+            results = list(pool.map(__markup_batch, [(key, start, end, batch, batch_context)
+                                                     for batch, batch_context in zip(batches, contexts)]))
+            batches = [batch for batch, batch_context in results]
+            contexts = [batch_context for batch, batch_context in results]
+            ref_targets = [target for batch_context in contexts for target in batch_context.ref_targets]
+            for batch_context in contexts:
+                batch_context.ref_targets = ref_targets
+
+    if profile is not None:
+        for batch_context in contexts:
+            profile.records.extend(batch_context.profile.records)
+    tail = "\n" + " " * context.prefixlen
+    if not all(batch.endswith(tail) for batch in batches[:-1]):
+        return engine.markup(original, name, profile, budget, context.references)
+    return "".join(batch[:-len(tail)] for batch in batches[:-1]) + batches[-1]
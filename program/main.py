@@ -1,40 +1,169 @@
 import os
+import re
 import subprocess
 import sys
+import time
 from typing import Optional
 
-import annotations  # create_from_status, create_from_errata
+import annotations  # create_from_status, create_from_errata, GeneratedAnnotations
 import drafts       # download_drafts
 import errata       # read_errata, get_patches
 import output       # create_index, create_files
 import rfcfile      # download_rfcs
-import util         # get_from_environment, means_true, config_directories, info, error, verbose_output
+import rfcindex     # keep_in_memory
+import util         # get_from_environment, means_true, config_directories, filtered_files, info, warn, error, verbose_output, written_files
 
 ''' Main creator for RFC annotations tools '''
 
 
 # handles one (or a couple of) RFC lists: fetches all data and produces the html output
-def process_rfc_lists(rfc_lists: [([str], str)], index_prefix: Optional[str] = None):
+def process_rfc_lists(rfc_lists: [([str], str)], index_prefix: Optional[str] = None, fetch: bool = True):
     all_rfcs = []
     for rfc_list, s in rfc_lists:
         all_rfcs.extend(rfc_list)
 
-    if util.means_true(util.get_from_environment("FETCH_FILES", "YES")):
+    fetching = fetch and util.means_true(util.get_from_environment("FETCH_FILES", "YES"))
+    if fetching:
         # download desired RFC text files, if not already done
         rfcfile.download_rfcs(all_rfcs, TXT_DIR)
-        # create additional annotation files
-        annotations.create_from_status(all_rfcs, ANN_DIR_GENERATED, TXT_DIR, errata_list, patches)
-        annotations.create_from_errata(all_rfcs, ANN_DIR_GENERATED, errata_list, patches)
+
+    # create the status and errata annotations in memory, writing them to files only if desired
+    generated = annotations.GeneratedAnnotations(ANN_DIR_GENERATED)
+    annotations.create_from_status(all_rfcs, generated, TXT_DIR, errata_list, patches, fetch=fetching)
+    annotations.create_from_errata(all_rfcs, generated, errata_list, patches)
+    if util.means_true(util.get_from_environment("GENERATED_FILES", "NO")):
+        generated.write()
 
     # create html files
     rfcs_last_updated = output.create_files(all_rfcs, errata_list, patches, TXT_DIR, ANN_DIR, GEN_DIR,
-                                            "index.html" if index_prefix is None else f"{index_prefix}-index.html")
+                                            "index.html" if index_prefix is None else f"{index_prefix}-index.html",
+                                            generated=generated)
 
     # create index.html if necessary
     if util.means_true(util.get_from_environment("INDEX", "NO")):
         output.create_index(index_prefix, rfc_lists, GEN_DIR, TXT_DIR, rfcs_last_updated)
 
 
+# returns the normalized names of the RFCs whose html may be changed by the given files, or None for all RFCs
+def affected_rfcs(changed_files: [str]) -> Optional[set]:
+    ret = set()
+    annotation_directories = [os.path.abspath(directory.strip()) for directory in ANN_DIR.split(",")]
+    for path in changed_files:
+        if any(os.path.commonpath([os.path.abspath(path), directory]) == directory
+               for directory in annotation_directories):
+            # annotation files are named after their RFC or apply to all RFCs
+            file_name = os.path.basename(path)
+            match = re.match(r"(rfc[0-9]+)\.", file_name)
+            if match is not None:
+                ret.add(match.group(1))
+            elif file_name.startswith("global."):
+                return None
+        else:
+            # a changed config file, eg. a RFC list, html fragment or patch
+            return None
+    return ret
+
+
+# returns the normalized names of the RFCs of the given lists
+def normalized_rfcs(rfc_lists: [([str], str)]) -> set:
+    ret = set()
+    for rfc_list, s in rfc_lists:
+        for rfc in rfc_list:
+            rfc = rfc.lower().strip()
+            ret.add(rfc if rfc.startswith("rfc") else "rfc" + rfc)
+    return ret
+
+
+# returns the size and modification time of all files which may change the generated html. The generated annotations
+# are created in memory, so their files don't change it.
+def watched_files() -> dict:
+    ret = {}
+    for directory in [d.strip() for d in ANN_DIR.split(",")] + util.config_directories():
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d != ".git" and os.path.join(root, d) != ANN_DIR_GENERATED]
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                # noinspection PyBroadException
+                try:
+                    stat = os.stat(path)
+                    ret[path] = (stat.st_mtime_ns, stat.st_size)
+                except Exception:
+                    pass
+    return ret
+
+
+# handles all RFC lists, either given by the environment or by the config directories. If affected is given,
+# only the lists containing at least one of these RFCs are handled
+def process_all_rfc_lists(affected: Optional[set] = None, fetch: bool = True):
+    if isinstance(RFC_LIST, list) and len(RFC_LIST) > 0:
+        # the user used the environment to process a single list of RFCs
+        if affected is None or len(affected.intersection(normalized_rfcs([(RFC_LIST, INDEX_TEXT)]))) > 0:
+            process_rfc_lists([(RFC_LIST, INDEX_TEXT)], fetch=fetch)
+    else:
+        # collect and handle the desired collections of RFC lists
+        filenames = []
+        for directory in util.config_directories():
+            for file_name in util.filtered_files(directory, "", "-rfcs.txt"):
+                if file_name in filenames:
+                    util.info(f"RFC list {file_name} already handled. Ignoring file in {directory}.")
+                else:
+                    filenames.append(file_name)
+                    rfc_sections = []
+                    rfcs = []
+                    current_index_text = ""
+                    with open(os.path.join(directory, file_name), "r") as file:
+                        for line in file.readlines():
+                            if line.strip() == "####################":
+                                rfc_sections.append((rfcs, current_index_text))
+                                rfcs = []
+                                current_index_text = ""
+                            elif not line.startswith("#"):
+                                if len(line) > 0 and line[0] in "0123456789":
+                                    rfcs.append(line.strip())
+                                else:
+                                    current_index_text += line
+                    rfc_sections.append((rfcs, current_index_text))
+                    if affected is not None and len(affected.intersection(normalized_rfcs(rfc_sections))) == 0:
+                        continue
+                    util.info(f"\nCreating output for {file_name}...")
+                    if len(rfc_sections) > 0:
+                        process_rfc_lists(rfc_sections, file_name[0:-9], fetch)
+
+
+# polls the annotation and config directories and recreates the html of the RFCs affected by a changed file,
+# keeping errata, patches and the rfc index in memory between the runs
+def watch(interval: float):
+    global patches
+    if util.means_false(util.get_from_environment("INCREMENTAL", "on")):
+        util.warn("RFC_INCREMENTAL is disabled: every RFC of an affected list will be created again on each change.")
+    util.info(f"\nWatching {ANN_DIR} and {', '.join(util.config_directories())} for changes "
+              f"every {interval} seconds. Press Ctrl-C to stop.")
+    files = watched_files()
+    try:
+        while True:
+            time.sleep(interval)
+            current = watched_files()
+            changed = sorted(path for path in set(files).union(current) if files.get(path) != current.get(path))
+            files = current
+            if len(changed) == 0:
+                continue
+            for path in changed:
+                util.info(f"\nChanged: {path}")
+            affected = affected_rfcs(changed)
+            if affected is None:
+                # config fragments may change the patches of the errata
+                patches = errata.get_patches()
+            elif len(affected) == 0:
+                continue
+            util.info("Affected RFCs: " + ("all" if affected is None else " ".join(sorted(affected))))
+            written = dict(util.written_files)
+            process_all_rfc_lists(affected, False)
+            util.info(f"\n{util.written_files['changed'] - written['changed']} files written, "
+                      f"{util.written_files['unchanged'] - written['unchanged']} files unchanged.")
+    except KeyboardInterrupt:
+        util.info("\nStopped watching for changes.")
+
+
 # check python version
 python_version = sys.version_info
 if python_version[0] < 3 or (python_version[0] == 3 and python_version[1] < 7):
@@ -70,33 +199,13 @@ RFC_LIST = util.get_from_environment("LIST", None)
 if isinstance(RFC_LIST, str):
     RFC_LIST = RFC_LIST.strip().replace(",", " ").split()
 
-if isinstance(RFC_LIST, list) and len(RFC_LIST) > 0:
-    # the user used the environment to process a single list of RFCs
-    process_rfc_lists([(RFC_LIST, INDEX_TEXT)])
-else:
-    # collect and handle the desired collections of RFC lists
-    filenames = []
-    for directory in util.config_directories():
-        for file_name in util.filtered_files(directory, "", "-rfcs.txt"):
-            if file_name in filenames:
-                util.info(f"RFC list {file_name} already handled. Ignoring file in {directory}.")
-            else:
-                util.info(f"\nCreating output for {file_name}...")
-                filenames.append(file_name)
-                rfc_sections = []
-                rfcs = []
-                current_index_text = ""
-                with open(os.path.join(directory, file_name), "r") as file:
-                    for line in file.readlines():
-                        if line.strip() == "####################":
-                            rfc_sections.append((rfcs, current_index_text))
-                            rfcs = []
-                            current_index_text = ""
-                        elif not line.startswith("#"):
-                            if len(line) > 0 and line[0] in "0123456789":
-                                rfcs.append(line.strip())
-                            else:
-                                current_index_text += line
-                rfc_sections.append((rfcs, current_index_text))
-                if len(rfc_sections) > 0:
-                    process_rfc_lists(rfc_sections, file_name[0:-9])
+WATCH = "--watch" in sys.argv[1:]
+rfcindex.keep_in_memory = WATCH
+
+process_all_rfc_lists()
+
+util.info(f"\n{util.written_files['changed']} files written, "
+          f"{util.written_files['unchanged']} files unchanged.")
+
+if WATCH:
+    watch(float(util.get_from_environment("WATCH_INTERVAL", "2")))
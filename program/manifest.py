@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import annotations   # AnnotationIndex
+import errata        # errata_checksum
+import htmlize_rfcs  # MARKUP_VERSION
+import util          # correct_path, get_from_environment, means_false, debug, warn
+
+''' Build manifest recording the inputs of each generated RFC page, so unchanged pages are not created again '''
+
+MANIFEST_DIRECTORY = "build-manifest"
+ENTRY_SUFFIX = ".json"
+# the extensions of the files of the program directory whose content is part of every page's inputs
+PROGRAM_SUFFIXES = (".py", ".json")
+
+# the hashes of files already read in this run, by path, together with the modification time and size they had
+__file_hashes = {}
+
+
+# returns the manifest directory inside the directory of the text documents, or None if incremental builds are
+# switched off
+def manifest_directory(read_directory: str) -> Optional[str]:
+    if util.means_false(util.get_from_environment("INCREMENTAL", "on")):
+        return None
+    directory = util.correct_path(read_directory) + MANIFEST_DIRECTORY
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        util.warn(f"can't create build manifest directory {directory}: {e}. All RFCs will be created.")
+        return None
+    return directory
+
+
+def __hash(data) -> str:
+    return hashlib.sha256(data.encode("utf-8", "surrogatepass") if isinstance(data, str) else data).hexdigest()
+
+
+# returns the hash of the content of a file, or None if it can't be read
+def file_hash(path: str) -> Optional[str]:
+    try:
+        stat = os.stat(path)
+        known = __file_hashes.get(path)
+        if known is not None and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+        with open(path, "rb") as f:
+            h = __hash(f.read())
+        __file_hashes[path] = (stat.st_mtime_ns, stat.st_size, h)
+        return h
+    except OSError:
+        return None
+
+
+# returns the hash of the inputs shared by all pages of a run: the program creating them, its settings, the css and
+# scripts, and the list of RFCs which is used for rewriting links
+def common_inputs(rfc_list: list, css: Optional[str], scripts: Optional[str], settings: dict) -> str:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    program = {file: file_hash(os.path.join(directory, file))
+               for file in sorted(os.listdir(directory)) if file.endswith(PROGRAM_SUFFIXES)}
+    rfcs = sorted(set(rfc.lower().strip() for rfc in rfc_list))
+    return __hash(json.dumps({"markup": htmlize_rfcs.MARKUP_VERSION, "program": program, "settings": settings,
+                              "css": css, "scripts": scripts, "rfcs": rfcs}, sort_keys=True))
+
+
+# returns the inputs of the page of an RFC: the shared inputs, the text of the RFC and its annotation files, or the
+# texts of its generated annotations. Returns None if directory is None, or if the text can't be read.
+def inputs(directory: Optional[str], rfc: str, read_filename: str,
+           annotation_index: Optional[annotations.AnnotationIndex], common: str) -> Optional[dict]:
+    if directory is None or file_hash(read_filename) is None:
+        return None
+    annotation_hashes = {}
+    for path in [] if annotation_index is None else annotation_index.files(rfc):
+        content = annotation_index.content(path)
+        annotation_hashes[path] = file_hash(path) if content is None else __hash(content)
+    return {"common": common, "text": file_hash(read_filename), "annotations": annotation_hashes}
+
+
+# returns the checksums of the errata the annotations of a page are based on, by erratum id
+def errata_checksums(remarks: list, errata_list: list, patches: Optional[dict]) -> dict:
+    return {str(rem["errata_id"]): errata.errata_checksum(int(rem["errata_id"]), errata_list, patches)
+            for rem in remarks if "errata_id" in rem}
+
+
+# returns the manifest entry of an RFC if its page is up to date: it was created from the same inputs and errata,
+# and hasn't changed since. If compressed, the compressed copy of the page has to exist and mustn't be older than the
+# page. Returns None otherwise.
+def up_to_date_entry(directory: Optional[str], rfc: str, rfc_inputs: Optional[dict], write_filename: str,
+                     errata_list: list, patches: Optional[dict], compressed: bool = False) -> Optional[dict]:
+    if rfc_inputs is None:
+        return None
+    try:
+        with open(os.path.join(directory, rfc + ENTRY_SUFFIX), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry["inputs"] != rfc_inputs or os.path.getsize(write_filename) != entry["size"]:
+            return None
+        # a missing copy raises an OSError
+        if compressed and os.path.getmtime(write_filename + ".gz") < os.path.getmtime(write_filename):
+            return None
+        for eid, checksum in entry["errata"].items():
+            if errata.errata_checksum(int(eid), errata_list, patches) != checksum:
+                return None
+        return entry
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# records the inputs a page was created from, the errata checksums of its annotations and the date of their last
+# update
+def write_entry(directory: Optional[str], rfc: str, rfc_inputs: Optional[dict], write_filename: str,
+                checksums: dict, last_updated: Optional[str]):
+    if rfc_inputs is None:
+        return
+    file_name = os.path.join(directory, rfc + ENTRY_SUFFIX)
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "w", encoding="utf-8") as f:
+            json.dump({"inputs": rfc_inputs, "errata": checksums, "last_updated": last_updated,
+                       "size": os.path.getsize(write_filename)}, f, indent=1)
+        os.replace(temp_name, file_name)
+    except OSError as e:
+        util.debug(f"can't write build manifest entry {file_name}: {e}")
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
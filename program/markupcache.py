@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import htmlize_rfcs  # markup_lines, anchor_ids, visible_width, MARKUP_VERSION
+import util          # correct_path, get_from_environment, means_false, debug, warn
+
+''' Persistent cache of the marked up lines of RFC text documents '''
+
+CACHE_DIRECTORY = "markup-cache"
+DEFAULT_MAX_SIZE_MB = 256
+ENTRY_SUFFIX = ".jsonl"
+
+
+# returns the cache directory inside the directory of the text documents, or None if caching is switched off
+def cache_directory(read_directory: str) -> Optional[str]:
+    if util.means_false(util.get_from_environment("MARKUP_CACHE", "on")):
+        return None
+    directory = util.correct_path(read_directory) + CACHE_DIRECTORY
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        util.warn(f"can't create markup cache directory {directory}: {e}. Markup won't be cached.")
+        return None
+    return directory
+
+
+# returns the cache key of a text document: the hash of the text and everything else the markup depends on
+def __cache_key(text: str, path: str, script: str, extra: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{htmlize_rfcs.MARKUP_VERSION}\0{path}\0{script}\0{extra}\0".encode("utf-8"))
+    h.update(text.encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+# yields the marked up lines of a text document together with the ids of the anchors they define and their visible
+# width, see htmlize_rfcs.markup_lines(). If directory is
+# given, the lines are read from the cache, or stored there while they are created. An entry holds one JSON string
+# per line, so neither path keeps all lines in memory. Cache hits refresh the modification time of the entry,
+# which is used for eviction. Documents exceeding the markup budget aren't cached, so they get another chance.
+def markup_lines(text: str, directory: Optional[str], path: str = ".", script: str = "", extra: str = "",
+                 jobs: int = 0, profile: Optional[htmlize_rfcs.MarkupProfile] = None,
+                 budget: Optional[htmlize_rfcs.MarkupBudget] = None, references: Optional[list] = None):
+    if directory is None:
+        yield from htmlize_rfcs.markup_lines(text, path, script, extra, jobs=jobs, profile=profile, budget=budget,
+                                             references=references)
+        return
+    file_name = os.path.join(directory, __cache_key(text, path, script, extra) + ENTRY_SUFFIX)
+    try:
+        cached = open(file_name, "r", encoding="utf-8")
+    except OSError:
+        cached = None
+    if cached is not None:
+        with cached:
+            os.utime(file_name)
+            for row in cached:
+                line = json.loads(row)
+                yield line, htmlize_rfcs.anchor_ids(line), htmlize_rfcs.visible_width(line)
+        return
+
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        f = open(temp_name, "w", encoding="utf-8")
+    except OSError as e:
+        util.debug(f"can't write markup cache entry {file_name}: {e}")
+        f = None
+    complete = False
+    exceeded = 0 if budget is None else len(budget.exceeded)
+    try:
+        for line, ids, width in htmlize_rfcs.markup_lines(text, path, script, extra, jobs=jobs, profile=profile,
+                                                   budget=budget, references=references):
+            if f is not None:
+                try:
+                    f.write(json.dumps(line) + "\n")
+                except OSError as e:
+                    util.debug(f"can't write markup cache entry {file_name}: {e}")
+                    f.close()
+                    os.remove(temp_name)
+                    f = None
+            yield line, ids, width
+        complete = budget is None or len(budget.exceeded) == exceeded
+    finally:
+        if f is not None:
+            f.close()
+            if complete:
+                os.replace(temp_name, file_name)
+            else:
+                os.remove(temp_name)
+
+
+# removes the least recently used entries until the cache doesn't exceed its size limit (RFC_MARKUP_CACHE_SIZE in MB)
+def limit_size(directory: Optional[str], max_size: Optional[int] = None):
+    if directory is None:
+        return
+    if max_size is None:
+        try:
+            max_size = int(util.get_from_environment("MARKUP_CACHE_SIZE", str(DEFAULT_MAX_SIZE_MB))) * 1024 * 1024
+        except ValueError:
+            util.warn("RFC_MARKUP_CACHE_SIZE has to be a number of megabytes. Using the default.")
+            max_size = DEFAULT_MAX_SIZE_MB * 1024 * 1024
+    entries = []
+    total = 0
+    for file in util.filtered_files(directory, suffix=ENTRY_SUFFIX):
+        try:
+            stat = os.stat(os.path.join(directory, file))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, file))
+        total += stat.st_size
+    entries.sort()
+    for mtime, size, file in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(directory, file))
+            total -= size
+        except OSError as e:
+            util.debug(f"can't remove markup cache entry {file}: {e}")
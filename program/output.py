@@ -1,13 +1,33 @@
+import bisect
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
 import os.path
+import re
+import sys
 from typing import Optional
 
-import annotations   # get_annotations, special_annotation_types
-import htmlize_rfcs  # markup
+import annotationcache  # cache_directory, evict
+import annotations   # get_annotations, special_annotation_types, AnnotationIndex, GeneratedAnnotations
+import htmlize_rfcs  # MarkupProfile, MarkupBudget, visible_text, degraded_lines
+import manifest      # manifest_directory, common_inputs, inputs, errata_checksums, up_to_date_entry, write_entry
+import markupcache   # cache_directory, markup_lines, limit_size
+import referencestore # store_directory, references
 import rfcindex      # read_xml_document, fetch_element
-import util          # correct_path, get_from_environment, config_directories, create_anchor, debug, info, error
+import util          # correct_path, get_from_environment, config_directories, create_anchor, debug, info, error, write_if_changed, written_files, LinkResolver
 
 ''' Create the new HTMLized RFCs for RFC annotations tools '''
 
+# the subdirectory of the output directory containing the style sheets and scripts shared by all pages
+STATIC_DIRECTORY = "static"
+# the supported values of RFC_OUTPUT_MODE. Compact pages number their lines with CSS counters and don't pad them
+OUTPUT_MODES = ["default", "compact"]
+# finds the links to lines of the same page in annotations
+LINE_LINK_PATTERN = re.compile(r"""href=["']#(line-[0-9]+)["']""")
+
 
 # creates an index html page containing details and links to the given RFCs
 def create_index(prefix: Optional[str], sections: [tuple], write_directory: str = ".", path: str = ".",
@@ -20,8 +40,12 @@ def create_index(prefix: Optional[str], sections: [tuple], write_directory: str
     util.info(f"Creating {file_name}...", end="")
     css = __read_html_fragments("css.html", util.get_from_environment("CSS", None))
     scripts = __read_html_fragments("index-scripts.html", util.get_from_environment("INDEX_SCRIPTS", None))
+    compressed = util.means_true(util.get_from_environment("GZIP", "NO"))
+    if util.means_true(util.get_from_environment("STATIC_ASSETS", "NO")):
+        css = static_assets(css, write_directory, "css", compressed)
+        scripts = static_assets(scripts, write_directory, "index-scripts", compressed)
     try:
-        with open(os.path.join(write_directory, file_name), "w") as f:
+        with io.StringIO() as f:
             title = 'Overview' if prefix is None else f'Overview of {prefix.upper()}-related RFCs'
             f.write(f'<!DOCTYPE html>\n<html lang="en" id="html">\n<head>\n<meta charset="UTF-8">'
                     f'<title>{title}</title>\n')
@@ -36,6 +60,7 @@ def create_index(prefix: Optional[str], sections: [tuple], write_directory: str
                 rfc_list, index_text = section
                 f.write(index_text)
                 if len(rfc_list) > 0:
+                    links = util.LinkResolver(rfc_list)
                     f.write(f'<table class="index" id="table{nr}">\n<thead><tr class="header">'
                             '<th class="rfc" data-type="int">RFC</th>')
                     if root is not None:
@@ -67,8 +92,8 @@ def create_index(prefix: Optional[str], sections: [tuple], write_directory: str
                                     rfc = node.firstChild.data
                                     suffix += "; Obsoleted by" if len(suffix) == 0 else ","
                                     text = f"{rfc[0:3]} {rfc[3:]}" if len(rfc) > 3 else rfc
-                                    suffix += __rewrite_anchor(util.create_anchor(prefix=" ", href=rfc.lower(),
-                                                                                  text=text), rfc_list)
+                                    suffix += links.rewrite_anchors(util.create_anchor(prefix=" ", href=rfc.lower(),
+                                                                                       text=text))
                             status = f"{status}{suffix}"
                             f.write(f"<td class='title'>{title}</td>"
                                     f"<td class='date'>{date}</td>"
@@ -79,32 +104,12 @@ def create_index(prefix: Optional[str], sections: [tuple], write_directory: str
                         f.write("</tr>\n")
                     f.write("</tbody></table>\n")
             f.write("</body></html>")
+            util.write_if_changed(os.path.join(write_directory, file_name), f.getvalue(), compressed)
             util.info(" Done.")
     except Exception as e:
         util.error(f"can't create index.html: {e}.")
 
 
-def __rewrite_anchor(line: str, rfc_list: list) -> str:
-    anchor_target = '<a href="./rfc'
-    if anchor_target in line:
-        fragments = line.split(anchor_target)
-        for index in range(len(fragments)):
-            if index == 0:
-                line = fragments[index]
-            else:
-                s = fragments[index]
-                rfc_nr = ""
-                while s[0].isdigit():
-                    rfc_nr += s[0]
-                    s = s[1:]
-                if rfc_nr in rfc_list:
-                    line += anchor_target + rfc_nr + ".html"
-                else:
-                    line += '<a href="https://datatracker.ietf.org/doc/rfc' + rfc_nr + '/'
-                line += s
-    return line
-
-
 # searches for a given filename in the different config directories and returns the first found version, if present
 def __read_html_fragments(file: str, extra: Optional[str]) -> str:
     for directory in util.config_directories():
@@ -120,6 +125,50 @@ def __read_html_fragments(file: str, extra: Optional[str]) -> str:
     return ""
 
 
+# writes the contents of the <style> and <script> elements of a html fragment to files named after their content
+# and returns the fragment referencing these files instead, so browsers can cache them across all pages. The files
+# written for an earlier content of the fragment are removed, including their compressed copies.
+def static_assets(fragment: str, write_directory: str, name: str, compressed: bool = False) -> str:
+    directory = os.path.join(write_directory, STATIC_DIRECTORY)
+    written = set()
+
+    def write_asset(element: re.Match) -> str:
+        suffix = ".css" if element.group(1) == "style" else ".js"
+        content = element.group(2)
+        file_name = f"{name}.{hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]}{suffix}"
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+        util.write_if_changed(os.path.join(directory, file_name), content, compressed)
+        written.add(file_name)
+        href = f"{STATIC_DIRECTORY}/{file_name}"
+        return f'<link rel="stylesheet" href="{href}">' if suffix == ".css" else f'<script src="{href}"></script>'
+
+    # elements with attributes (eg. a type or an already given source) are kept as they are
+    ret = re.sub(r"<(style|script)>(.*?)</\1>", write_asset, fragment, flags=re.DOTALL)
+    if os.path.exists(directory):
+        pattern = re.compile(re.escape(name) + r"\.[0-9a-f]{16}\.(css|js)")
+        for file_name in os.listdir(directory):
+            asset = file_name[:-3] if file_name.endswith(".gz") else file_name
+            if pattern.fullmatch(asset) and asset not in written:
+                util.debug(f"Removing outdated static file {file_name}")
+                try:
+                    os.remove(os.path.join(directory, file_name))
+                except OSError as e:
+                    util.warn(f"can't remove outdated static file {file_name}: {e}.")
+    return ret
+
+
+# fills a marked up line of the given visible width, so that we have a fixed number of visible characters (=fixed width)
+# unless fill is False. Lines longer than that are reported in any case
+def __adjust_line_length(line: str, width: int, rfc_nr: str, line_nr: int, desired_len: int = 75,
+                         fill: bool = True) -> str:
+    if width > desired_len:
+        stripped = htmlize_rfcs.visible_text(line)
+        util.warn(f"RFC{rfc_nr}: line#{line_nr} '{line}' is too long. Counted {len(stripped)} chars in '{stripped}'.")
+        return line
+    return line + " " * (desired_len - width) if fill else line
+
+
 # iterates all annotations and unifies the different 'section' references
 def __normalize_annotation_references(remark_list: list) -> list:
     ret = []
@@ -152,153 +201,288 @@ def __normalize_annotation_references(remark_list: list) -> list:
     return ret
 
 
+# returns the number of the first of the texts containing each of the targets by target. The texts are joined to one
+# buffer, so each distinct target takes one str.find over the whole document instead of a search in every single text.
+# This is one scan per distinct target, not one combined scan for all of them: a single pass with an Aho-Corasick
+# automaton in Python is slower up to thousands of targets, see tests/benchmark_fragment_references.py.
+def __find_first_texts(targets: set, texts: list) -> dict:
+    ret = {}
+    if len(texts) == 0:
+        return ret
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + 1
+    buffer = "\n".join(texts)
+    for target in targets:
+        # the texts are lines, so a target spanning the separator isn't contained in any of them
+        if "\n" not in target:
+            position = buffer.find(target)
+            if position >= 0:
+                ret[target] = bisect.bisect_right(starts, position) - 1
+    return ret
+
+
 # searches for annotations with a 'fragment-' section reference and tries to determine the current line containing
-# the desired text fragment.
+# the desired text fragment. The lines are normalized once, then every distinct fragment is searched in the lines
+# first, and in the combinations of two lines if it isn't found.
 def __handle_annotations_with_fragment_references(remark_list: list, lines: list) -> list:
+    targets = {remark["section"][9:] for remark in remark_list
+               if "section" in remark and remark["section"].startswith("fragment-")}
+    if len(targets) == 0:
+        return list(remark_list)
+    # remove generated comment characters contained in newer RFCs
+    normalized = [line.replace("|", "") for line in lines]
+    found = {target: f"line-{nr + 1}" for target, nr in __find_first_texts(targets, normalized).items()}
+    combined_targets = {target for target in targets if target not in found and len(target) > 1}
+    if len(combined_targets) > 0:
+        # try to find the remaining strings by combining two lines
+        combined = [normalized[nr - 1] + " " + normalized[nr].strip() for nr in range(1, len(normalized))]
+        found.update({target: f"line-{nr + 1}" for target, nr in __find_first_texts(combined_targets, combined).items()})
     ret = []
     for remark in remark_list:
-        if "section" in remark:
-            target: str = remark["section"]
-            if target.startswith("fragment-"):
-                target = target[9:]
-                found = False
-                # find the target in the lines
-                for nr, line in enumerate(lines):
-                    line = line.replace("|", "")    # remove generated comment characters contained in newer RFCs
-                    if target in line:
-                        remark["section"] = f"line-{nr+1}"
-                        found = True
-                        break
-                if not found and len(target) > 1:
-                    # try to find the string by combining two lines
-                    for nr, line in enumerate(lines):
-                        combined = lines[nr - 1].replace("|", "") + " " + line.replace("|", "").strip()
-                        if nr > 0 and target in combined:
-                            remark["section"] = f"line-{nr}"
-                            break
+        if "section" in remark and remark["section"].startswith("fragment-") and remark["section"][9:] in found:
+            remark["section"] = found[remark["section"][9:]]
         ret.append(remark)
     return ret
 
 
-# creates annotated html files for a given list of RFCs.
+# writes the report of a markup profile as JSON and prints the slowest rules and documents to the console
+def __write_markup_profile(profile: htmlize_rfcs.MarkupProfile, file_name: str, count: int = 15):
+    rules = profile.rules()
+    documents = profile.documents()
+    seconds = sum(rule["seconds"] for rule in rules)
+    try:
+        with open(file_name, "w") as f:
+            json.dump({"seconds": seconds, "rules": rules, "documents": documents}, f, indent=2)
+    except Exception as e:
+        util.error(f"can't write markup profile {file_name}: {e}.")
+    util.info(f"\nMarkup of {len(documents)} documents took {seconds:.2f}s. Profile written to '{file_name}'.")
+    util.info(f"Slowest rules:\n{'seconds':>9} {'share':>6} {'calls':>6} {'matches':>8} {'input MB':>9}  rule")
+    for rule in rules[:count]:
+        share = 100 * rule["seconds"] / seconds if seconds > 0 else 0
+        matches = "" if rule["matches"] is None else rule["matches"]
+        util.info(f"{rule['seconds']:>9.3f} {share:>5.1f}% {rule['calls']:>6} {matches:>8} "
+                  f"{rule['size'] / 1048576:>9.1f}  {rule['rule']}")
+    util.info("Slowest documents:")
+    for document in documents[:count // 3]:
+        util.info(f"{document['seconds']:>9.3f}  {document['document']} (slowest rule: {document['slowest rule']}, "
+                  f"{document['slowest rule seconds']:.3f}s)")
+
+
+# returns the time budget in seconds configured by the environment variable, or None if it's switched off
+def __read_markup_budget(name: str, default: str) -> Optional[float]:
+    value = util.get_from_environment(name, default)
+    if util.means_false(value):
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        util.warn(f"RFC_{name} has to be a number of seconds. Using {default}s instead.")
+        seconds = float(default)
+    return seconds if seconds > 0 else None
+
+
+# the create_file() function of the running create_files(), inherited by its worker processes
+__file_creator = None
+
+
+# creates the file of an RFC in a worker process. Returns the date of the last update of its annotations, the output
+# the creation printed to stdout and stderr, and the counts of util.written_files it added.
+def __create_file_in_worker(rfc: str) -> (dict, str, str, dict):
+    out = io.StringIO()
+    err = io.StringIO()
+    written_files = dict(util.written_files)
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        last_updated = __file_creator(rfc)
+    written_files = {key: count - written_files[key] for key, count in util.written_files.items()}
+    return last_updated, out.getvalue(), err.getvalue(), written_files
+
+
+# creates annotated html files for a given list of RFCs. If RFC_JOBS (default: the number of processors) is greater
+# than 1, the files are created by a pool of worker processes. If generated annotations are given, they are added to
+# the annotation files, and the files of their directory aren't read.
 def create_files(rfc_list: list, errata_list: list, patches: Optional[dict], read_directory: str = ".",
                  annotation_directory: str = None, write_directory: str = ".", index: Optional[str] = None,
-                 anchor_prefix: Optional[str] = "../") \
+                 anchor_prefix: Optional[str] = "../", generated: Optional[annotations.GeneratedAnnotations] = None) \
         -> dict:
 
-    def create_unique_erratum_ref(eid: str) -> str:
-        if eid in erratum_references:
-            ret = erratum_references[eid] + 1
-        else:
-            ret = 0
-        erratum_references[eid] = ret
-        return "rfc.erratum." + eid + ("" if ret == 0 else f".{ret}")
-
-    def write_annotation(remarks_present: bool, annotation_text: str) -> (bool, str):
-        erratum_id = str(rem["errata_id"]) if "errata_id" in rem else None
-        caption = str(rem["caption"]).replace("{rfc_nr}", f"{rfc_nr}") if "caption" in rem else None
-        date = str(rem["date"]) if "date" in rem else ""
-        if len(date) > 0:
-            if rfc in rfcs_last_updated:
-                old_entry = rfcs_last_updated[rfc]
-                if old_entry < date:
-                    rfcs_last_updated[rfc] = date
-            else:
-                rfcs_last_updated[rfc] = date
-        annotation_type = str(rem["type"]) if "type" in rem else None
-        title = rem["submitter_name"] if "submitter_name" in rem else "Unknown Author"
-        author = rem["submitter_name"] if "submitter_name" in rem else None
-        if author is not None:
-            author = author.lower().replace("'", "").replace('"', '')
-
-        if not remarks_present:
-            f.write(f'</span></pre>\n<div class="annotation">{annotation_text}</div></div>'
-                    f'\n\n<div class="area">\n<pre class="{rfc_class}">'
-                    f'<span class="{rfc_class}">')
-            remarks_present = True
-            annotation_text = ""
-
-        if erratum_id is None:
-            entry_type = "entry"
-            if annotation_type is not None:
-                if annotation_type in annotations.built_in_annotation_types():
-                    entry_type = f"status {annotation_type.replace('_', '')}"
-                else:
-                    entry_type += f" {annotation_type}"
-            if "path" in rem and anchor_prefix is not None:
-                caption = util.create_anchor(anchor_prefix + rem["path"], caption)
-        else:
-            entry_type = "err"
-            prefix = ""
-            suffix = ""
-            if annotation_type is not None:
-                prefix = f'{annotation_type} '
-                entry_type += f' {annotation_type.lower()}'
-            if "errata_status_code" in rem:
-                s = rem["errata_status_code"]
-                suffix = f' [{s}]'
-                entry_type += f' {s.lower().replace(" ", "")}'
-            if "outdated" in rem:
-                entry_type += ' outdated'
-            # eclipsed annotations are not supported anymore...
-            # if "eclipsed" in rem:
-            #     entry_type += ' eclipsed'
-            link_title = f'{author} ({rem["type"]})'
-            link = "https://www.rfc-editor.org/errata/eid" + erratum_id
-            if caption is None:
-                caption = ""
-            else:
-                caption += " "
-            caption = f'<span id="' + create_unique_erratum_ref(erratum_id) + f'">{caption}'\
-                      + util.create_anchor(prefix=f"({prefix}Erratum #", href=link, text=erratum_id,
-                                           suffix=")" + suffix + "</span>", attributes={"title": link_title})
-
-        if author is not None:
-            entry_type += f' {author}'
-
-        annotation_text += f'<div onclick="clicked(this)" class="{entry_type}">' \
-                           '<div class="title"><span class="reference">'
-        if section == "global":
-            annotation_text += '<a href="">GLOBAL</a> '
-        else:
-            annotation_text += f'<a href="#{section}">{section}</a> '
-        annotation_text += f'{title}</span>' \
-                           f'<span class="caption">{caption}</span>' \
-                           f'<span class="timestamp">{date}</span>' \
-                           f'</div>'
-        if "outdated" in rem:
-            annotation_text += '<span class="info">based on outdated version</span>'
-        annotation_text += f'<div class="notes">'
-
-        if "notes" in rem and rem["notes"] is not None:
-            if type(rem["notes"]) is list:
-                for entry in rem["notes"]:
-                    annotation_text += entry.replace("{rfc_nr}", f"{rfc_nr}")
-
-        annotation_text += "</div></div>"
-        return remarks_present, annotation_text
-
     rfcs_last_updated = {}
     read_directory = util.correct_path(read_directory)
     write_directory = util.correct_path(write_directory)
     css = __read_html_fragments("css.html", util.get_from_environment("CSS", None))
     scripts = __read_html_fragments("scripts.html", util.get_from_environment("SCRIPTS", None))
+    compressed = util.means_true(util.get_from_environment("GZIP", "NO"))
+    output_mode = util.get_from_environment("OUTPUT_MODE", "default").lower()
+    if output_mode not in OUTPUT_MODES:
+        util.warn(f"RFC_OUTPUT_MODE has to be one of {', '.join(OUTPUT_MODES)}. Using the default output mode.")
+        output_mode = "default"
+    compact = output_mode == "compact"
+    # the styles and scripts numbering the lines of compact pages are only added to these pages
+    compact_fragment = __read_html_fragments("compact.html", None) if compact else ""
+    if util.means_true(util.get_from_environment("STATIC_ASSETS", "NO")):
+        css = static_assets(css, write_directory, "css", compressed)
+        scripts = static_assets(scripts, write_directory, "scripts", compressed)
+        compact_fragment = static_assets(compact_fragment, write_directory, "compact", compressed)
+    if len(compact_fragment) > 0:
+        css += "\n" + compact_fragment
+    markup_profile = None
+    if util.means_true(util.get_from_environment("PROFILE_MARKUP", "NO")):
+        # every RFC has to be marked up to get profiled, so neither the markup cache nor the manifest are used
+        markup_profile = htmlize_rfcs.MarkupProfile()
+        markup_cache = None
+        manifest_directory = None
+    else:
+        markup_cache = markupcache.cache_directory(read_directory)
+        manifest_directory = manifest.manifest_directory(read_directory)
+    common_inputs = manifest.common_inputs(rfc_list, css, scripts, {"write_directory": os.path.abspath(write_directory),
+                                                                    "annotation_directory": annotation_directory,
+                                                                    "index": index, "anchor_prefix": anchor_prefix,
+                                                                    "compressed": compressed, "output_mode": output_mode})
+    reference_store = referencestore.store_directory(read_directory)
+    links = util.LinkResolver(rfc_list)
+    annotation_index = annotations.AnnotationIndex(annotation_directory, generated)
+    annotation_cache = annotationcache.cache_directory(read_directory)
+    try:
+        markup_jobs = int(util.get_from_environment("MARKUP_JOBS", "0"))
+    except ValueError:
+        util.warn("RFC_MARKUP_JOBS has to be a number of processes. Pages will be marked up sequentially.")
+        markup_jobs = 0
+    markup_budget = htmlize_rfcs.MarkupBudget(__read_markup_budget("MARKUP_BUDGET", "60"),
+                                              __read_markup_budget("MARKUP_RULE_BUDGET", "20"))
+    try:
+        jobs = int(util.get_from_environment("JOBS", str(os.cpu_count() or 1)))
+    except ValueError:
+        util.warn("RFC_JOBS has to be a number of processes. RFCs will be created one after another.")
+        jobs = 1
+    if markup_profile is not None:
+        # the rules are timed one RFC after another, without competing for the processors
+        jobs = 1
+    elif jobs > 1 and len(rfc_list) > 1:
+        # the RFCs are already spread over the processors
+        markup_jobs = 0
     util.info(f"Converting {len(rfc_list)} RFC text documents. Writing output to '{write_directory}'.")
     if not util.verbose_output:
         util.info("Did write:", end="")
-    for rfc in rfc_list:
-        rfc: str = rfc.lower().strip()
+
+    # creates the file of one RFC and returns the date of the last update of its annotations, keyed by the RFC
+    def create_file(rfc: str) -> dict:
+
+        def create_unique_erratum_ref(eid: str) -> str:
+            if eid in erratum_references:
+                ret = erratum_references[eid] + 1
+            else:
+                ret = 0
+            erratum_references[eid] = ret
+            return "rfc.erratum." + eid + ("" if ret == 0 else f".{ret}")
+
+        def write_annotation(remarks_present: bool, annotation_text: str) -> (bool, str):
+            erratum_id = str(rem["errata_id"]) if "errata_id" in rem else None
+            caption = str(rem["caption"]).replace("{rfc_nr}", f"{rfc_nr}") if "caption" in rem else None
+            date = str(rem["date"]) if "date" in rem else ""
+            if len(date) > 0:
+                if rfc in rfcs_last_updated:
+                    old_entry = rfcs_last_updated[rfc]
+                    if old_entry < date:
+                        rfcs_last_updated[rfc] = date
+                else:
+                    rfcs_last_updated[rfc] = date
+            annotation_type = str(rem["type"]) if "type" in rem else None
+            title = rem["submitter_name"] if "submitter_name" in rem else "Unknown Author"
+            author = rem["submitter_name"] if "submitter_name" in rem else None
+            if author is not None:
+                author = author.lower().replace("'", "").replace('"', '')
+
+            if not remarks_present:
+                f.write(f'</span></pre>\n<div class="annotation">{annotation_text}</div></div>'
+                        f'\n\n<div class="area">\n<pre class="{rfc_class}">'
+                        f'<span class="{rfc_class}">')
+                remarks_present = True
+                annotation_text = ""
+
+            if erratum_id is None:
+                entry_type = "entry"
+                if annotation_type is not None:
+                    if annotation_type in annotations.built_in_annotation_types():
+                        entry_type = f"status {annotation_type.replace('_', '')}"
+                    else:
+                        entry_type += f" {annotation_type}"
+                if "path" in rem and anchor_prefix is not None:
+                    caption = util.create_anchor(anchor_prefix + rem["path"], caption)
+            else:
+                entry_type = "err"
+                prefix = ""
+                suffix = ""
+                if annotation_type is not None:
+                    prefix = f'{annotation_type} '
+                    entry_type += f' {annotation_type.lower()}'
+                if "errata_status_code" in rem:
+                    s = rem["errata_status_code"]
+                    suffix = f' [{s}]'
+                    entry_type += f' {s.lower().replace(" ", "")}'
+                if "outdated" in rem:
+                    entry_type += ' outdated'
+                # eclipsed annotations are not supported anymore...
+                # if "eclipsed" in rem:
+                #     entry_type += ' eclipsed'
+                link_title = f'{author} ({rem["type"]})'
+                link = "https://www.rfc-editor.org/errata/eid" + erratum_id
+                if caption is None:
+                    caption = ""
+                else:
+                    caption += " "
+                caption = f'<span id="' + create_unique_erratum_ref(erratum_id) + f'">{caption}'\
+                          + util.create_anchor(prefix=f"({prefix}Erratum #", href=link, text=erratum_id,
+                                               suffix=")" + suffix + "</span>", attributes={"title": link_title})
+
+            if author is not None:
+                entry_type += f' {author}'
+
+            annotation_text += f'<div onclick="clicked(this)" class="{entry_type}">' \
+                               '<div class="title"><span class="reference">'
+            if section == "global":
+                annotation_text += '<a href="">GLOBAL</a> '
+            else:
+                annotation_text += f'<a href="#{section}">{section}</a> '
+            annotation_text += f'{title}</span>' \
+                               f'<span class="caption">{caption}</span>' \
+                               f'<span class="timestamp">{date}</span>' \
+                               f'</div>'
+            if "outdated" in rem:
+                annotation_text += '<span class="info">based on outdated version</span>'
+            annotation_text += f'<div class="notes">'
+
+            if "notes" in rem and rem["notes"] is not None:
+                if type(rem["notes"]) is list:
+                    for entry in rem["notes"]:
+                        annotation_text += entry.replace("{rfc_nr}", f"{rfc_nr}")
+
+            annotation_text += "</div></div>"
+            return remarks_present, annotation_text
+
+        rfc = rfc.lower().strip()
         rfc = rfc if rfc.startswith("rfc") else "rfc" + rfc
         rfc_nr = rfc[3:]
         read_filename = read_directory + rfc + ".txt"
         write_filename = write_directory + rfc + ".html"
+        rfc_inputs = manifest.inputs(manifest_directory, rfc, read_filename, annotation_index, common_inputs)
+        manifest_entry = manifest.up_to_date_entry(manifest_directory, rfc, rfc_inputs, write_filename, errata_list,
+                                                   patches, compressed)
+        if manifest_entry is not None:
+            util.debug(f"{rfc}.html is up to date")
+            util.written_files["unchanged"] += 1
+            if manifest_entry["last_updated"] is not None:
+                rfcs_last_updated[rfc] = manifest_entry["last_updated"]
+            return {rfc: rfcs_last_updated[rfc]} if rfc in rfcs_last_updated else {}
         if util.verbose_output:
             util.debug(f"Writing {rfc}.html")
         else:
             util.info(f" {rfc}.html", end="")
-        remarks = annotations.get_annotations(rfc, annotation_directory, errata_list, patches, rfc_list)
+        remarks = annotations.get_annotations(rfc, annotation_index, errata_list, patches, links, annotation_cache)
+        errata_checksums = None if rfc_inputs is None else manifest.errata_checksums(remarks, errata_list, patches)
         try:
-            with open(write_filename, "w") as f:
+            with io.StringIO() as f:
                 rfc_class = "rfc"
                 for r in remarks:
                     if "type" in r:
@@ -312,7 +496,8 @@ def create_files(rfc_list: list, errata_list: list, patches: Optional[dict], rea
                 if scripts is not None:
                     f.write(f'{scripts}\n')
                 f.write('</head>\n')
-                f.write('<body onload="adjustFontSize()">\n')
+                f.write('<body class="compact" onload="adjustFontSize()">\n' if compact else
+                        '<body onload="adjustFontSize()">\n')
                 if scripts is not None:
                     f.write("<noscript>For full functionality of this page please enable JavaScript</noscript>\n")
                 if index is not None:
@@ -322,11 +507,45 @@ def create_files(rfc_list: list, errata_list: list, patches: Optional[dict], rea
                 f.write(f'<div class="area">\n<pre class="{rfc_class}"><span class="{rfc_class}">')
                 line_nr = 0
                 annotation = ""
-                lines = htmlize_rfcs.markup(open(read_filename).read()).splitlines()
-                remarks = __handle_annotations_with_fragment_references(remarks, lines)
+                if markup_profile is not None:
+                    markup_profile.document = rfc
+                exceeded = len(markup_budget.exceeded)
+                rfc_text = open(read_filename).read()
+                references = referencestore.references(rfc_text, reference_store, rfc, markup_budget)
+                if len(markup_budget.exceeded) > exceeded:
+                    # the References section alone exceeded the budget
+                    lines = htmlize_rfcs.degraded_lines(rfc_text)
+                else:
+                    lines = markupcache.markup_lines(rfc_text, markup_cache, jobs=markup_jobs, profile=markup_profile,
+                                                     budget=markup_budget, references=references)
+                # the lines are only kept in memory if annotations have to be located by their text
+                if any(str(rem.get("section", "")).startswith("fragment-") for rem in remarks):
+                    lines = list(lines)
+                    remarks = __handle_annotations_with_fragment_references(remarks, [line for line, ids, width in lines])
                 remarks_sections = __normalize_annotation_references(remarks)
+                # the annotations of each section, in their order. Annotations at the top are only shown there.
+                section_remarks = {}
+                for rem in remarks:
+                    for section in dict.fromkeys(rem["section"]):
+                        section_remarks.setdefault(section, []).append(rem)
+                for rem in section_remarks.get("top", []):
+                    remarks.remove(rem)
+                    for section in dict.fromkeys(rem["section"]):
+                        if section != "top":
+                            section_remarks[section].remove(rem)
+                # the sections whose annotations aren't written yet, mapped to their position. The top and the global
+                # annotations are written at the first line.
+                pending = {section: i for i, section in enumerate(dict.fromkeys(["top"] + remarks_sections))
+                           if section in section_remarks}
                 erratum_references = {}
-                for line in lines:
+                if compact:
+                    # compact pages only keep the ids of lines which are annotated or linked by annotations. Links from
+                    # other pages to lines without an id are handled by the scripts
+                    linked_lines = {section for section in section_remarks if section.startswith("line-")}
+                    for rem in remarks:
+                        for note in rem.get("notes") or []:
+                            linked_lines.update(LINE_LINK_PATTERN.findall(str(note)))
+                for line, anchor_ids, width in lines:
                     # cut leading and trailing <pre> elements
                     if line.endswith("</pre>"):
                         line = line[:-6]
@@ -341,62 +560,40 @@ def create_files(rfc_list: list, errata_list: list, patches: Optional[dict], rea
                     else:
                         line_nr += 1
                         aid = "line-" + str(line_nr)
-                        text = str(line_nr).rjust(5)
-
-                        # fills the line so that we have a fixed number of visible characters (=fixed width)
-                        def adjust_line_length(current_line: str, desired_len: int = 75, fill_with: str = " ") -> str:
-                            stripped = ""
-                            in_element = False
-                            in_entity = False
-                            for ch in current_line:
-                                if ch == "&" and not in_element:
-                                    in_entity = True
-                                    stripped += ch
-                                elif ch == ";" and in_entity:
-                                    in_entity = False
-                                elif ch == "<":
-                                    in_element = True
-                                elif ch == ">":
-                                    in_element = False
-                                elif not in_element and not in_entity:
-                                    stripped += ch
-                            if len(stripped) > desired_len:
-                                util.warn(f"RFC{rfc_nr}: line#{line_nr} '{current_line}' is too long. "
-                                          f"Counted {len(stripped)} chars in '{stripped}'.")
-                                return current_line
-                            else:
-                                return current_line + fill_with*(desired_len - len(stripped))
-
-                        line = f'<a class="line" id="{aid}" href="#{aid}">{text}</a> ' + adjust_line_length(line)
-                    line = __rewrite_anchor(line, rfc_list)
+                        if not compact:
+                            text = str(line_nr).rjust(5)
+                            line = f'<a class="line" id="{aid}" href="#{aid}">{text}</a> ' + \
+                                __adjust_line_length(line, width, rfc_nr, line_nr)
+                        elif aid in linked_lines:
+                            line = f'<a class="ln" id="{aid}" href="#{aid}"></a>' + \
+                                __adjust_line_length(line, width, rfc_nr, line_nr, fill=False)
+                        else:
+                            line = '<a class="ln"></a>' + __adjust_line_length(line, width, rfc_nr, line_nr, fill=False)
+                        anchor_ids += (aid,)
+                    line = links.rewrite_anchors(line)
 
                     rem_present = False
-                    for section in ["top"] + remarks_sections:
-                        if section == "global" or section == "top" or (f'id="{section}"' in line):
-                            remark_written = False
-                            for rem in remarks:
-                                if section in rem["section"]:
-                                    remark_written = True
-                                    rem_present, annotation = write_annotation(rem_present, annotation)
-                                    if section == "top":
-                                        remarks.remove(rem)
-                            if remark_written:
-                                remarks_sections.remove(section)
+                    sections = {section for section in ("top", "global") + anchor_ids if section in pending}
+                    for section in sorted(sections, key=pending.get):
+                        for rem in section_remarks[section]:
+                            rem_present, annotation = write_annotation(rem_present, annotation)
+                        if len(section_remarks[section]) > 0:
+                            del pending[section]
                     f.write(line)
                     if not skip_line_end:
                         f.write("\n")
 
                 # check whether we do have unhandled annotations
+                remarks_sections = list(pending)
                 if len(remarks_sections) > 0:
                     error = None
                     for section in remarks_sections:
                         files = None
-                        for rem in remarks:
-                            if section in rem["section"]:
-                                rem_present, annotation = write_annotation(rem_present, annotation)
-                                # do not add a warning for rejected errata
-                                if "errata_id" not in rem or rem["errata_status_code"] != "Rejected":
-                                    files = rem["path"] if files is None else files + ", " + rem["path"]
+                        for rem in section_remarks[section]:
+                            rem_present, annotation = write_annotation(rem_present, annotation)
+                            # do not add a warning for rejected errata
+                            if "errata_id" not in rem or rem["errata_status_code"] != "Rejected":
+                                files = rem["path"] if files is None else files + ", " + rem["path"]
                         if files is not None:
                             if error is None:
                                 error = f"annotations for {rfc.upper()} have {len(remarks_sections)} INVALID "\
@@ -409,8 +606,44 @@ def create_files(rfc_list: list, errata_list: list, patches: Optional[dict], rea
 
                 f.write(f'</span></pre><div class="annotation">{annotation}</div></div>\n')
                 f.write('\n</body></html>\n')
+                util.write_if_changed(write_filename, f.getvalue(), compressed)
+            for timeout in markup_budget.exceeded[exceeded:]:
+                util.warn(f"{rfc}: {timeout}. It is published as plain text.")
+            # pages published as plain text are created again by the next run
+            if len(markup_budget.exceeded) == exceeded:
+                manifest.write_entry(manifest_directory, rfc, rfc_inputs, write_filename, errata_checksums,
+                                     rfcs_last_updated.get(rfc))
         except Exception as e:
             util.error(f"can't read {read_filename}: {e}.")
+        return {rfc: rfcs_last_updated[rfc]} if rfc in rfcs_last_updated else {}
+
+    if jobs > 1 and len(rfc_list) > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # the workers inherit create_file() together with everything it uses, only the RFC names and the results
+        # are passed between the processes. The console output of each RFC is printed in the order of rfc_list.
+        global __file_creator
+        __file_creator = create_file
+        try:
+            with concurrent.futures.ProcessPoolExecutor(min(jobs, len(rfc_list)),
+                                                        mp_context=multiprocessing.get_context("fork")) as pool:
+                for last_updated, out, err, written_files in pool.map(__create_file_in_worker, rfc_list):
+                    sys.stdout.write(out)
+                    sys.stderr.write(err)
+                    rfcs_last_updated.update(last_updated)
+                    for key, count in written_files.items():
+                        util.written_files[key] += count
+        finally:
+            __file_creator = None
+    else:
+        for rfc in rfc_list:
+            create_file(rfc)
+    markupcache.limit_size(markup_cache)
+    # the annotations of all RFCs of the list were generated
+    generated_rfcs = [rfc.lower().strip() for rfc in rfc_list]
+    annotationcache.evict(annotation_cache, annotation_index.paths(),
+                          None if generated is None else generated.directory,
+                          [rfc if rfc.startswith("rfc") else "rfc" + rfc for rfc in generated_rfcs])
     if not util.verbose_output:
         util.info(". Done.")
+    if markup_profile is not None:
+        __write_markup_profile(markup_profile, util.get_from_environment("PROFILE_MARKUP_FILE", "markup-profile.json"))
     return rfcs_last_updated
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+import htmlize_rfcs  # references, MarkupBudget, MARKUP_VERSION
+import util          # correct_path, get_from_environment, means_false, debug, warn
+
+''' Persistent store of the reference records of RFC text documents '''
+
+STORE_DIRECTORY = "reference-store"
+RECORD_SUFFIX = ".json"
+
+
+# returns the store directory inside the directory of the text documents, or None if the store is switched off
+def store_directory(read_directory: str) -> Optional[str]:
+    if util.means_false(util.get_from_environment("REFERENCE_STORE", "on")):
+        return None
+    directory = util.correct_path(read_directory) + STORE_DIRECTORY
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        util.warn(f"can't create reference store directory {directory}: {e}. References won't be stored.")
+        return None
+    return directory
+
+
+# returns the hash of a text document the stored references are valid for
+def __text_hash(text: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{htmlize_rfcs.MARKUP_VERSION}\0".encode("utf-8"))
+    h.update(text.encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+# returns the reference records of a text document, see htmlize_rfcs.references(). They are read from the store if
+# the text didn't change since they were stored, otherwise extracted within the budget and stored. Returns None if
+# directory is None, or if the extraction exceeds the budget.
+def references(text: str, directory: Optional[str], name: str,
+               budget: Optional[htmlize_rfcs.MarkupBudget] = None) -> Optional[list]:
+    if directory is None:
+        return None
+    file_name = os.path.join(directory, name + RECORD_SUFFIX)
+    text_hash = __text_hash(text)
+    try:
+        with open(file_name, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if record["hash"] == text_hash:
+            return record["references"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    records = htmlize_rfcs.references(text, budget=budget)
+    if records is None:
+        return None
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "w", encoding="utf-8") as f:
+            json.dump({"hash": text_hash, "references": records}, f, indent=1)
+        os.replace(temp_name, file_name)
+    except OSError as e:
+        util.debug(f"can't write reference record {file_name}: {e}")
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+    return records
+
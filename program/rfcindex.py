@@ -7,11 +7,18 @@ import util  # debug, info, error
 
 ''' Create the RFC index for RFC annotations tools '''
 
+# if set, a parsed rfc-index.xml is kept in memory and not checked against the source of truth again
+keep_in_memory = False
+__documents = {}
 
-# returns a cached version of https://www.rfc-editor.org/rfc-index.xml. Will be automatically created if absent.
-def read_xml_document(path: str = ".", url: str = "https://www.rfc-editor.org/rfc-index.xml") \
+
+# returns a cached version of https://www.rfc-editor.org/rfc-index.xml. Will be automatically created if absent. If
+# revalidate is False, the cached version is used without checking whether it's still up-to-date.
+def read_xml_document(path: str = ".", url: str = "https://www.rfc-editor.org/rfc-index.xml", revalidate: bool = True) \
         -> Tuple[Optional[Document], Optional[dict]]:
     file_path = os.path.join(path, "rfc-index.xml")
+    if keep_in_memory and file_path in __documents:
+        return __documents[file_path]
     xml_content = None
 
     # fetch cached version of rfc-index.xml
@@ -22,8 +29,11 @@ def read_xml_document(path: str = ".", url: str = "https://www.rfc-editor.org/rf
     except Exception:
         pass
 
-    util.info(f"\nFetching data from source of truth {url}... ", end='')
-    if xml_content is not None:
+    if xml_content is not None and not revalidate:
+        util.debug("\nUsing cached rfc-index.xml.")
+    else:
+        util.info(f"\nFetching data from source of truth {url}... ", end='')
+    if xml_content is not None and revalidate:
         # check whether the cached version is still up-to-date
         try:
             with open(file_path + ".etag", "r") as f:
@@ -60,6 +70,9 @@ def read_xml_document(path: str = ".", url: str = "https://www.rfc-editor.org/rf
             doc: Document = document
             root: Node = doc.firstChild
             util.debug(f"Got {len(root.childNodes)} entries.\n")
+            if keep_in_memory:
+                __documents[file_path] = doc, __build_lookup_map(doc)
+                return __documents[file_path]
             return doc, __build_lookup_map(doc)
         else:
             util.debug("")
@@ -1,3 +1,4 @@
+import gzip
 import os
 import hashlib
 import re
@@ -8,6 +9,8 @@ from typing import Optional
 
 _running_in_test = False
 verbose_output = False
+# the number of files write_if_changed() did write, and of those it left alone because they didn't change
+written_files = {"changed": 0, "unchanged": 0}
 
 
 def debug(s: str, end='\n'):
@@ -54,6 +57,50 @@ def filtered_files(directory: str, prefix: str = "", suffix: str = "") -> list:
     return ret
 
 
+# writes the content to a file unless the file already contains it, so unchanged files keep their modification time.
+# The content is written to a temporary file replacing the file, so a failed run never leaves a half-written file.
+# If compressed is set, a gzip compressed copy of the content is kept next to the file, named like it plus ".gz"
+def write_if_changed(file_name: str, content: str, compressed: bool = False) -> bool:
+    data = content.encode("utf-8")
+    changed = __write_data_if_changed(file_name, data)
+    if compressed:
+        gz_file_name = file_name + ".gz"
+        try:
+            # an unchanged file doesn't need to be compressed again, as long as its copy isn't older
+            up_to_date = not changed and os.path.getmtime(gz_file_name) >= os.path.getmtime(file_name)
+        except OSError:
+            up_to_date = False
+        if up_to_date:
+            written_files["unchanged"] += 1
+        elif not __write_data_if_changed(gz_file_name, gzip.compress(data, 9, mtime=0)):
+            # the unchanged copy mustn't look outdated anymore
+            os.utime(gz_file_name)
+    return changed
+
+
+# writes the data to a file unless the file already contains it, counting the written and unchanged files
+def __write_data_if_changed(file_name: str, data: bytes) -> bool:
+    try:
+        if os.path.getsize(file_name) == len(data):
+            with open(file_name, "rb") as f:
+                if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                    written_files["unchanged"] += 1
+                    return False
+    except OSError:
+        pass
+    temp_name = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        with open(temp_name, "wb") as f:
+            f.write(data)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    written_files["changed"] += 1
+    return True
+
+
 def create_checksum(d: dict) -> str:
     s: str = ""
     for key in sorted(d.keys()):
@@ -100,20 +147,35 @@ def replace_links_in_text(line: str, replace_special_chars: bool) -> str:
     return line
 
 
-def get_rfc_target(rfc: str, rfc_list: Optional[list] = None, target_id: Optional[str] = None) -> str:
-    if rfc_list is not None and rfc in rfc_list:
-        if target_id is None:
-            return f"./rfc{rfc}.html"
-        else:
-            return f"./rfc{rfc}.html#{target_id}"
-    else:
-        if target_id is None:
-            return f"https://datatracker.ietf.org/doc/rfc{rfc}/"
-        else:
-            return f"https://datatracker.ietf.org/doc/html/rfc{rfc}.html#{target_id}"
+# resolves the link targets of RFCs: RFCs of the list are linked locally, all others to the datatracker.
+# Created once per run, as the targets are looked up for every link of every annotation and line
+class LinkResolver:
+    LOCAL_ANCHOR_PATTERN = re.compile(r'<a href="\./rfc([0-9]*)')
+
+    def __init__(self, rfc_list: Optional[list] = None):
+        self.rfcs = frozenset() if rfc_list is None else frozenset(rfc_list)
+        self.targets = {}
+
+    # returns the URL of the RFC, or of the element with the given id inside the RFC
+    def target(self, rfc: str, target_id: Optional[str] = None) -> str:
+        key = (rfc, target_id)
+        if key not in self.targets:
+            if rfc in self.rfcs:
+                self.targets[key] = f"./rfc{rfc}.html" if target_id is None else f"./rfc{rfc}.html#{target_id}"
+            elif target_id is None:
+                self.targets[key] = f"https://datatracker.ietf.org/doc/rfc{rfc}/"
+            else:
+                self.targets[key] = f"https://datatracker.ietf.org/doc/html/rfc{rfc}.html#{target_id}"
+        return self.targets[key]
+
+    # points the anchors to other RFCs created by the markup (like '<a href="./rfc1035#section-2">') to their targets
+    def rewrite_anchors(self, line: str) -> str:
+        if '<a href="./rfc' not in line:
+            return line
+        return self.LOCAL_ANCHOR_PATTERN.sub(lambda match: '<a href="' + self.target(match.group(1)), line)
 
 
-def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
+def rewrite_rfc_anchor(line: str, links: Optional[LinkResolver]) -> str:
     def get_target_id(entity: str, number: str) -> str:
         reftype = entity.lower()
         if reftype == "section" and len(number) > 1 and number[:1].isalpha():
@@ -121,6 +183,8 @@ def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
         return reftype + "-" + number.upper()
 
     if "@@" in line:
+        if links is None:
+            links = LinkResolver()
         start = line.index("@@")
         split = line[start + 2:]
         if "@@" in split:
@@ -140,9 +204,9 @@ def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
             if match is not None:
                 target_rfc = match.group("docno")
                 target_section = get_target_id(match.group("sectiontype"), match.group("sectionno"))
-                a1 = create_anchor(href=get_rfc_target(target_rfc, rfc_list, target_section),
+                a1 = create_anchor(href=links.target(target_rfc, target_section),
                                    text=match.group("sectionstring"), suffix=match.group("fill1"))
-                a2 = create_anchor(href=get_rfc_target(target_rfc, rfc_list), text=match.group("docstring"),
+                a2 = create_anchor(href=links.target(target_rfc), text=match.group("docstring"),
                                    suffix=match.group("fill2"))
                 replacement = f"{a1}{a2}"
             else:
@@ -150,9 +214,9 @@ def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
                 if match is not None:
                     target_rfc = match.group("docno")
                     target_section = get_target_id(match.group("sectiontype"), match.group("sectionno"))
-                    a1 = create_anchor(href=get_rfc_target(target_rfc, rfc_list, target_section),
+                    a1 = create_anchor(href=links.target(target_rfc, target_section),
                                        text=match.group("sectionstring"))
-                    a2 = create_anchor(prefix=match.group("fill1"), href=get_rfc_target(target_rfc, rfc_list),
+                    a2 = create_anchor(prefix=match.group("fill1"), href=links.target(target_rfc),
                                        text=match.group("docstring"), suffix=match.group("fill2"))
                     replacement = f"{a2}{a1}"
                 else:
@@ -160,7 +224,7 @@ def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
                     if match is not None:
                         target_rfc = match.group("docno")
                         replacement = create_anchor(prefix=match.group("fill1"),
-                                                    href=get_rfc_target(target_rfc, rfc_list),
+                                                    href=links.target(target_rfc),
                                                     text=match.group("docstring"), suffix=match.group("fill2"))
                     else:
                         match = re.search(fmt4, target_text, flags=re.IGNORECASE)
@@ -171,15 +235,15 @@ def rewrite_rfc_anchor(line: str, rfc_list: Optional[list]) -> str:
 
             if replacement is not None:
                 line = line.replace(f"@@{target_text}@@", replacement)
-                return rewrite_rfc_anchor(line, rfc_list)
-        return line[0:start + 2] + rewrite_rfc_anchor(split, rfc_list)
+                return rewrite_rfc_anchor(line, links)
+        return line[0:start + 2] + rewrite_rfc_anchor(split, links)
     return line
 
 
-def rewrite_rfc_anchors(lines: [str], rfc_list: Optional[list]) -> [str]:
+def rewrite_rfc_anchors(lines: [str], links: Optional[LinkResolver]) -> [str]:
     ret = []
     for line in lines:
-        ret.append(rewrite_rfc_anchor(line, rfc_list))
+        ret.append(rewrite_rfc_anchor(line, links))
     return ret
 
 
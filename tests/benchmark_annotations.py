@@ -0,0 +1,81 @@
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import annotations
+import util
+
+''' Benchmark comparing the parsing of every annotation file for every RFC, as get_annotations() did before, with
+    parsing each file once per run. Uses synthetic global annotations and one annotation file per RFC.
+    Run it with: python3 tests/benchmark_annotations.py '''
+
+GLOBAL_FILES = 50
+RFCS = 170
+# the errata of a run, which are the same object for all RFCs
+ERRATA = []
+
+ANNOTATION = """#A J. Doe
+#D 2024-01-01
+#S {section}
+<p>See @@Section 2.1 of RFC 1035@@ and @@RFC 2181@@, as well as
+<a href="https://www.example.com/{name}">the <b>notes</b> on {name}</a>.</p>
+<ul><li>one</li><li>two</li></ul>
+####################
+#A J. Doe
+#D 2024-01-02
+This plain text annotation of {name} continues
+over a few lines.
+"""
+
+
+# creates the annotation files in the directory
+def create_annotations(directory: str, rfc_list: [str]):
+    for nr in range(GLOBAL_FILES):
+        with open(os.path.join(directory, f"global.note{nr}"), "w") as f:
+            f.write(ANNOTATION.format(section="global", name=f"global {nr}"))
+    for rfc in rfc_list:
+        with open(os.path.join(directory, f"rfc{rfc}.note"), "w") as f:
+            f.write(ANNOTATION.format(section="2", name=f"RFC {rfc}"))
+
+
+# reads the annotations of all RFCs, parsing the annotation files for every RFC again
+def parse_every_file(index: annotations.AnnotationIndex, links: util.LinkResolver, rfc_list: [str]) -> list:
+    return [[annotation for path in index.files(f"rfc{rfc}")
+             for annotation in annotations.__parse_annotation_file(path, ERRATA, None, links)] for rfc in rfc_list]
+
+
+# reads the annotations of all RFCs, parsing each annotation file once
+def parse_once(index: annotations.AnnotationIndex, links: util.LinkResolver, rfc_list: [str]) -> list:
+    annotations.__parsed_files.clear()
+    return [[annotation for path in index.files(f"rfc{rfc}")
+             for annotation in annotations.get_annotation_from_file(path, ERRATA, None, links)] for rfc in rfc_list]
+
+
+# returns the fastest of some runs of function
+def measure(function, runs: int = 3) -> float:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    rfcs = [str(1000 + nr) for nr in range(RFCS)]
+    with tempfile.TemporaryDirectory() as directory:
+        create_annotations(directory, rfcs)
+        annotation_index = annotations.AnnotationIndex(directory)
+        resolver = util.LinkResolver(rfcs)
+        assert parse_every_file(annotation_index, resolver, rfcs) == parse_once(annotation_index, resolver, rfcs)
+        before = measure(lambda: parse_every_file(annotation_index, resolver, rfcs))
+        after = measure(lambda: parse_once(annotation_index, resolver, rfcs))
+    print(f"\n{GLOBAL_FILES} global annotation files, {RFCS} RFCs")
+    print(f"{'':>22} {'total (s)':>10} {'per RFC (ms)':>13}")
+    for name, seconds in [("every file per RFC", before), ("each file once", after)]:
+        print(f"{name:>22} {seconds:>10.3f} {seconds * 1000 / RFCS:>13.2f}")
+    print(f"speedup {before / after:.1f}x")
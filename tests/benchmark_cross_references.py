@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+import util
+from test_htmlize_rfcs import DOCUMENT
+
+''' Benchmark comparing the compound cross reference rules ("section x of rfc y" and its variants) applied to the
+    whole document one after another, as the markup did before, with their application to the clusters of adjacent
+    links found by a single scan. It also reports the share of the markup still taken by the link passes over the
+    whole document (rfc, bcp, draft, url, section and appendix).
+    Uses the RFC text files in RFC_TXT_DIR (default: raw-originals) if there are any, a synthetic document otherwise.
+    Run it with: python3 tests/benchmark_cross_references.py '''
+
+# the rules finding the links the cross references are made of, each one a pass over the whole document
+LINK_RULES = ["url", "draft", "rfc", "request for comments", "bcp", "section", "appendix"]
+
+
+# returns the fastest of some runs of function
+def measure(function, runs: int = 5) -> float:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# applies all compound cross reference rules to the whole text
+def whole_document_passes(engine: htmlize_rfcs.MarkupEngine, text: str) -> str:
+    context = htmlize_rfcs.MarkupContext()
+    for n, rules in engine.cross_reference_rules:
+        for rule in rules:
+            text = rule.apply(text, context)
+    return text
+
+
+def benchmark(title: str, text: str):
+    engine = htmlize_rfcs.get_engine()
+    step = engine.index("cross references")
+    # the text as the cross reference step gets it
+    linked = engine.apply(text, htmlize_rfcs.MarkupContext(), 0, step)
+    passes = sum(len(rules) for n, rules in engine.cross_reference_rules)
+    assert whole_document_passes(engine, linked) == engine.apply(linked, htmlize_rfcs.MarkupContext(), step, step + 1)
+    before = measure(lambda: whole_document_passes(engine, linked))
+    after = measure(lambda: engine.apply(linked, htmlize_rfcs.MarkupContext(), step, step + 1))
+    print(f"\n{title}: {len(text) / 1e6:.2f} MB")
+    print(f"{'cross references':>28} {'total (ms)':>11} {'per MB (ms)':>12}")
+    for name, seconds in [(f"{passes} whole document passes", before), ("scan of link clusters", after)]:
+        print(f"{name:>28} {seconds * 1000:>11.2f} {seconds * 1000 / (len(linked) / 1e6):>12.2f}")
+    print(f"speedup {before / after:.1f}x")
+    profile = htmlize_rfcs.MarkupProfile(title)
+    engine.markup(text, profile=profile)
+    rules = profile.rules()
+    total = sum(rule["seconds"] for rule in rules)
+    links = [rule for rule in rules if rule["rule"].replace(" crossing a line", "") in LINK_RULES
+             or rule["rule"].startswith(("url ", "escaped ", "enclosed ", "draft "))]
+    step_seconds = sum(rule["seconds"] for rule in rules if rule["rule"] == "cross references")
+    print(f"markup {total * 1000:.2f} ms: {len(links)} link passes {sum(r['seconds'] for r in links) * 1000:.2f} ms, "
+          f"cross references {step_seconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    directory = util.get_from_environment("TXT_DIR", "raw-originals")
+    files = sorted(util.filtered_files(directory, "rfc", ".txt")) if os.path.isdir(directory) else []
+    if len(files) > 0:
+        for file in files:
+            with open(os.path.join(directory, file), "r") as f:
+                benchmark(file, f.read())
+    else:
+        first, page = DOCUMENT.split("\f\n")
+        benchmark("synthetic document (50 pages)", first + "".join("\f\n" + page for _ in range(49)))
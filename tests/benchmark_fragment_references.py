@@ -0,0 +1,115 @@
+import random
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+import output
+import util
+from test_htmlize_rfcs import DOCUMENT
+
+''' Benchmark comparing ways to find the first marked up line containing each of the text fragments annotations refer
+    to: the search of every fragment line by line, as create_files did before, one str.find per distinct fragment in
+    the joined lines, as it does now, and a single pass over the lines with an Aho-Corasick automaton.
+    Uses RFC 1035 from RFC_TXT_DIR (default: raw-originals) if it's there, a synthetic document otherwise.
+    Run it with: python3 tests/benchmark_fragment_references.py '''
+
+TARGET_COUNTS = [10, 100, 1000, 3000]
+
+
+# the former search of create_files: every fragment is searched in one line after another
+def line_by_line(targets: set, lines: list) -> dict:
+    ret = {}
+    for target in targets:
+        for nr, line in enumerate(lines):
+            if target in line.replace("|", ""):
+                ret[target] = nr
+                break
+    return ret
+
+
+# searches all fragments in a single pass over the lines, using an Aho-Corasick automaton
+def single_pass(targets: set, lines: list) -> dict:
+    transitions = [{}]
+    outputs = [[]]
+    for target in targets:
+        state = 0
+        for ch in target:
+            if ch not in transitions[state]:
+                transitions.append({})
+                outputs.append([])
+                transitions[state][ch] = len(transitions) - 1
+            state = transitions[state][ch]
+        outputs[state].append(target)
+    fallbacks = [0] * len(transitions)
+    queue = list(transitions[0].values())
+    for state in queue:
+        for ch, next_state in transitions[state].items():
+            fallback = fallbacks[state]
+            while fallback and ch not in transitions[fallback]:
+                fallback = fallbacks[fallback]
+            fallbacks[next_state] = transitions[fallback].get(ch, 0)
+            outputs[next_state] = outputs[next_state] + outputs[fallbacks[next_state]]
+            queue.append(next_state)
+    ret = {}
+    for nr, line in enumerate(lines):
+        state = 0
+        for ch in line.replace("|", ""):
+            while state and ch not in transitions[state]:
+                state = fallbacks[state]
+            state = transitions[state].get(ch, 0)
+            for target in outputs[state]:
+                if target not in ret:
+                    ret[target] = nr
+        if len(ret) == len(targets):
+            break
+    return ret
+
+
+# the current search of create_files
+def find_per_target(targets: set, lines: list) -> dict:
+    return getattr(output, "__find_first_texts")(targets, [line.replace("|", "") for line in lines])
+
+
+# returns the fastest of some runs of function
+def measure(function, runs: int = 3) -> float:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(title: str, text: str):
+    lines = htmlize_rfcs.markup(text).splitlines()
+    random.seed(1)
+    print(f"\n{title}: {len(lines)} marked up lines")
+    print(f"{'fragments':>10} {'line by line (ms)':>18} {'find per fragment (ms)':>23} {'single pass (ms)':>17}")
+    for count in TARGET_COUNTS:
+        targets = set()
+        while len(targets) < count:
+            line = random.choice(lines).replace("|", "")
+            if random.random() < 0.1:
+                # a fragment which isn't contained anymore
+                targets.add(f"not contained {len(targets)}")
+            elif len(line) > 10:
+                start = random.randrange(len(line) - 10)
+                targets.add(line[start:start + random.randint(10, 40)])
+        expected = line_by_line(targets, lines)
+        assert find_per_target(targets, lines) == expected and single_pass(targets, lines) == expected
+        times = [measure(lambda: search(targets, lines)) for search in [line_by_line, find_per_target, single_pass]]
+        print(f"{count:>10} {times[0] * 1000:>18.2f} {times[1] * 1000:>23.2f} {times[2] * 1000:>17.2f}")
+
+
+if __name__ == "__main__":
+    file_name = os.path.join(util.get_from_environment("TXT_DIR", "raw-originals"), "rfc1035.txt")
+    if os.path.exists(file_name):
+        with open(file_name, "r") as f:
+            benchmark("RFC 1035", f.read())
+    else:
+        first, page = DOCUMENT.split("\f\n")
+        benchmark("synthetic document (50 pages)", first + "".join("\f\n" + page for _ in range(49)))
@@ -0,0 +1,79 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+import util
+from test_htmlize_rfcs import DOCUMENT
+
+''' Benchmark comparing the padding of marked up lines to a fixed width by scanning every character, as
+    create_files did before, with the padding by the visible width reported by the markup.
+    Uses RFC 1035 from RFC_TXT_DIR (default: raw-originals) if it's there, a synthetic document otherwise.
+    Run it with: python3 tests/benchmark_line_length.py '''
+
+DESIRED_LEN = 75
+
+
+# the former adjust_line_length() of create_files, stripping tags and entities character by character
+def scanned_line_length(current_line: str, desired_len: int = DESIRED_LEN, fill_with: str = " ") -> str:
+    stripped = ""
+    in_element = False
+    in_entity = False
+    for ch in current_line:
+        if ch == "&" and not in_element:
+            in_entity = True
+            stripped += ch
+        elif ch == ";" and in_entity:
+            in_entity = False
+        elif ch == "<":
+            in_element = True
+        elif ch == ">":
+            in_element = False
+        elif not in_element and not in_entity:
+            stripped += ch
+    if len(stripped) > desired_len:
+        return current_line
+    else:
+        return current_line + fill_with*(desired_len - len(stripped))
+
+
+# pads a line using its visible width, which markup_lines() yields together with the line
+def padded_line_length(current_line: str, width: int, desired_len: int = DESIRED_LEN) -> str:
+    return current_line if width > desired_len else current_line + " " * (desired_len - width)
+
+
+# returns the fastest of some runs of function
+def measure(function, runs: int = 5) -> float:
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(title: str, text: str):
+    lines = htmlize_rfcs.markup(text).splitlines()
+    before = measure(lambda: [scanned_line_length(line) for line in lines])
+    # the width is computed while the lines are yielded by the markup, so it's part of the cost
+    after = measure(lambda: [padded_line_length(line, htmlize_rfcs.visible_width(line)) for line in lines])
+    assert [scanned_line_length(line) for line in lines] == \
+           [padded_line_length(line, htmlize_rfcs.visible_width(line)) for line in lines]
+    print(f"\n{title}: {len(lines)} lines")
+    print(f"{'':>22} {'total (ms)':>11} {'per line (us)':>14}")
+    for name, seconds in [("character scan", before), ("visible width", after)]:
+        print(f"{name:>22} {seconds * 1000:>11.2f} {seconds * 1e6 / len(lines):>14.2f}")
+    print(f"speedup {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    file_name = os.path.join(util.get_from_environment("TXT_DIR", "raw-originals"), "rfc1035.txt")
+    if os.path.exists(file_name):
+        with open(file_name, "r") as f:
+            benchmark("RFC 1035", f.read())
+    else:
+        first, page = DOCUMENT.split("\f\n")
+        benchmark("synthetic document (50 pages)", first + "".join("\f\n" + page for _ in range(49)))
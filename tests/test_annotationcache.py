@@ -0,0 +1,110 @@
+import json
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import annotationcache
+import annotations
+import output
+import util
+from test_htmlize_rfcs import DOCUMENT
+
+''' Test class checking the persistent cache of parsed annotation files '''
+
+ANNOTATION = """#A J. Doe
+#D 2024-13-01
+#X errata_id:1
+#S 2
+<p>See @@RFC 1035@@.</p>
+"""
+
+
+def test_cached_annotations(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("RFC_ANNOTATION_CACHE", raising=False)
+    directory = annotationcache.cache_directory(str(tmp_path / "txt"))
+    path = str(tmp_path / "rfc1035.note")
+    with open(path, "w") as f:
+        f.write(ANNOTATION)
+    links = util.LinkResolver(["1035"])
+    errata_list = []
+    parsed = annotations.get_annotation_from_file(path, errata_list, None, links, directory)
+    assert "./rfc1035.html" in parsed[0]["notes"][0] and parsed[0]["outdated"]
+    assert "invalid formatted date" in capsys.readouterr().err
+    assert len(os.listdir(directory)) == 1
+
+    # the next run reads the annotations from the cache, repeating the messages of the parser
+    monkeypatch.setattr(annotations, "__parsed_files", {})
+    monkeypatch.setattr(annotations, "__parse_annotation_file", None)
+    assert annotations.get_annotation_from_file(path, errata_list, None, links, directory) == parsed
+    assert "invalid formatted date" in capsys.readouterr().err
+    monkeypatch.undo()
+
+    # changed errata are checked again
+    monkeypatch.setattr(annotations, "__parsed_files", {})
+    errata_list = [{"errata_id": 1, "doc-id": "RFC1035"}]
+    with monkeypatch.context() as m:
+        m.setattr(annotations, "__parse_annotation_file", None)
+        try:
+            annotations.get_annotation_from_file(path, errata_list, None, links, directory)
+            assert False, "the annotations have to be parsed again"
+        except TypeError:
+            pass
+    assert annotations.get_annotation_from_file(path, errata_list, None, links, directory) == parsed
+
+    # entries of deleted files are removed
+    annotationcache.evict(directory, [path])
+    assert len(os.listdir(directory)) == 1
+    os.remove(path)
+    annotationcache.evict(directory, [])
+    assert os.listdir(directory) == []
+
+
+def test_clear_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("RFC_ANNOTATION_CACHE", "off")
+    assert annotationcache.cache_directory(str(tmp_path)) is None
+    monkeypatch.setenv("RFC_ANNOTATION_CACHE", "on")
+    directory = annotationcache.cache_directory(str(tmp_path))
+    open(os.path.join(directory, "entry.json"), "w").close()
+    monkeypatch.setenv("RFC_ANNOTATION_CACHE", "clear")
+    assert annotationcache.cache_directory(str(tmp_path)) == directory
+    assert os.listdir(directory) == []
+
+
+def test_generated_annotations_of_other_lists(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    monkeypatch.setattr(util, "_running_in_test", True)
+    monkeypatch.setenv("RFC_JOBS", "1")
+    monkeypatch.delenv("RFC_ANNOTATION_CACHE", raising=False)
+    read_directory, annotation_directory, write_directory = (str(tmp_path / d) for d in ["txt", "ann", "html"])
+    for d in [read_directory, annotation_directory, write_directory]:
+        os.mkdir(d)
+    for rfc in ["1034", "1035"]:
+        with open(os.path.join(read_directory, f"rfc{rfc}.txt"), "w") as f:
+            f.write(DOCUMENT)
+    directory = annotationcache.cache_directory(read_directory)
+    generated_directory = os.path.join(annotation_directory, "_generated")
+
+    # creates the pages of a list containing a single RFC with the given generated annotations
+    def create_files(rfc: str, texts: dict):
+        generated = annotations.GeneratedAnnotations(generated_directory)
+        generated.rfc_texts(f"rfc{rfc}").update(texts)
+        output.create_files([rfc], None, None, read_directory, annotation_directory, write_directory, None,
+                            generated=generated)
+
+    def cached_paths() -> [str]:
+        paths = []
+        for file in os.listdir(directory):
+            with open(os.path.join(directory, file), "r", encoding="utf-8") as f:
+                paths.append(json.load(f)["path"])
+        return sorted(paths)
+
+    note = "#A\n#C UPDATED\n#T updated\n#\n#\n<div>Updated by RFC 1</div>\n\n"
+    create_files("1034", {"rfc1034.updated.txt": note})
+    create_files("1035", {"rfc1035.updated.txt": note})
+    # the entries of the generated annotations of the other list are kept, although their files don't exist
+    paths = [os.path.abspath(os.path.join(generated_directory, f"rfc{rfc}.updated.txt")) for rfc in ["1034", "1035"]]
+    assert cached_paths() == paths
+    # annotations which aren't generated anymore for the RFCs of the list are removed
+    create_files("1035", {})
+    assert cached_paths() == paths[:1]
@@ -40,3 +40,94 @@ def test_annotation_conversion():
                     f.write(json.dumps(created))
                     created_results.append(file)
     assert created_results == [], "all expected result files should already be present"
+
+
+def test_annotation_index(tmp_path):
+    for path in ["global.a", "rfc1035.a", "rfc10350.a", "README.md", "src/rfc1035.b", "src/global.b",
+                 "src/.git/rfc1035.c", "ignored/.ignore", "ignored/rfc1035.d"]:
+        os.makedirs(os.path.dirname(os.path.join(tmp_path, path)), exist_ok=True)
+        open(os.path.join(tmp_path, path), "w").close()
+    index = annotations.AnnotationIndex(f"{tmp_path}, {os.path.join(tmp_path, 'missing')}")
+    assert index.files("rfc1035") == [os.path.join(tmp_path, path)
+                                      for path in ["global.a", "rfc1035.a", "src/global.b", "src/rfc1035.b"]]
+    assert index.files("rfc9999") == [os.path.join(tmp_path, path) for path in ["global.a", "src/global.b"]]
+    assert index.missing == [os.path.join(tmp_path, "missing")]
+    assert annotations.AnnotationIndex(None).files("rfc1035") == []
+
+
+def test_parsed_annotation_files_are_reused(tmp_path):
+    path = os.path.join(tmp_path, "global.note")
+    with open(path, "w") as f:
+        f.write("#S 2\n<p>See @@RFC 1035@@.</p>\n")
+    links = util.LinkResolver(["1035"])
+    errata_list = []
+    first = annotations.get_annotation_from_file(path, errata_list, None, links)
+    assert "./rfc1035.html" in first[0]["notes"][0]
+    # the caller gets copies it may modify
+    first[0]["section"] = ["section-2"]
+    second = annotations.get_annotation_from_file(path, errata_list, None, links)
+    assert second[0]["section"] == "2" and second[0] is not first[0]
+    # other linked RFCs and changed files are parsed again
+    assert "datatracker" in annotations.get_annotation_from_file(path, errata_list, None, util.LinkResolver())[0]["notes"][0]
+    with open(path, "w") as f:
+        f.write("#S 3\n<p>See @@RFC 1035@@ again.</p>\n")
+    assert annotations.get_annotation_from_file(path, errata_list, None, links)[0]["section"] == "3"
+
+
+def test_generated_annotations(tmp_path, capsys):
+    erratum = {"errata_id": 1, "doc-id": "RFC1035", "submitter_name": "J. Doe", "section": "2",
+               "errata_type_code": "Technical", "errata_status_code": "Verified", "orig_text": "a", "correct_text": "b"}
+    errata_list = [erratum, dict(erratum, errata_id=2)]
+    generated = annotations.GeneratedAnnotations(os.path.join(tmp_path, "_generated"))
+    annotations.create_from_errata(["1035"], generated, errata_list)
+    assert generated.paths() == [os.path.join(tmp_path, "_generated", f"rfc1035.erratum.{eid}") for eid in [1, 2]]
+    # stale files of the generated annotations are ignored, and edited errata replace the generated ones
+    os.makedirs(generated.directory)
+    with open(os.path.join(generated.directory, "rfc1035.erratum.3"), "w") as f:
+        f.write("#A J. Doe\n#X errata_id:3\n<p>stale</p>\n")
+    with open(os.path.join(tmp_path, "rfc1035.edited"), "w") as f:
+        f.write("#A J. Doe\n#X errata_id:2\n<p>edited</p>\n")
+    index = annotations.AnnotationIndex(str(tmp_path), generated)
+    # the generated annotations take the place of the files of their directory, ordered by name
+    generated_paths = [path for path in index.files("rfc1035") if os.path.dirname(path) == generated.directory]
+    assert generated_paths == sorted(generated.paths())
+    remarks = annotations.get_annotations("rfc1035", index, errata_list, None, None)
+    assert [(remark["errata_id"], remark["path"]) for remark in remarks] == \
+           [("1", generated.paths()[0]), ("2", os.path.join(tmp_path, "rfc1035.edited"))]
+    assert "It should say:" in "".join(remarks[0]["notes"]) and "outdated" not in remarks[0]
+    # outdated files are replaced, and files of errata which aren't generated anymore are removed, unless they were
+    # changed or not written by the tool
+    generated.write()
+    texts = generated.rfc_texts("rfc1035")
+    texts["rfc1035.erratum.1"] += "<p>changed</p>\n"
+    texts["rfc1035.erratum.4"] = texts.pop("rfc1035.erratum.2")
+    generated.write()
+    assert sorted(name for name in os.listdir(generated.directory) if not name.startswith(".")) == \
+           ["rfc1035.erratum.1", "rfc1035.erratum.3", "rfc1035.erratum.4"]
+    with open(os.path.join(generated.directory, "rfc1035.erratum.1"), "r") as f:
+        assert f.read().endswith("<p>changed</p>\n")
+    with open(os.path.join(generated.directory, "rfc1035.erratum.1"), "a") as f:
+        f.write("<p>edited</p>\n")
+    texts["rfc1035.erratum.1"] += "<p>changed again</p>\n"
+    generated.write()
+    with open(os.path.join(generated.directory, "rfc1035.erratum.1"), "r") as f:
+        assert f.read().endswith("<p>edited</p>\n")
+    assert "rfc1035.erratum.1, rfc1035.erratum.3" in capsys.readouterr().err
+
+
+def test_status_annotations_without_fetching(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(annotations.rfcindex, "get", None)
+    monkeypatch.setattr(annotations.drafts, "get_draft_status", None)
+    generated = annotations.GeneratedAnnotations(os.path.join(tmp_path, "_generated"))
+    # without a cached RFC index, nothing is fetched and no status annotations are created
+    annotations.create_from_status(["1035"], generated, str(tmp_path), fetch=False)
+    assert generated.paths() == []
+    assert "no cached rfc-index.xml" in capsys.readouterr().err
+    # the cached RFC index is used as it is, and the drafts are skipped without their cached status
+    with open(os.path.join(tmp_path, "rfc-index.xml"), "w") as f:
+        f.write("<rfc-index><rfc-entry><doc-id>RFC1035</doc-id>"
+                "<updated-by><doc-id>RFC2181</doc-id></updated-by></rfc-entry></rfc-index>")
+    annotations.create_from_status(["1035"], generated, str(tmp_path), fetch=False)
+    assert list(generated.rfc_texts("rfc1035")) == ["rfc1035.updated.txt"]
+    assert "RFC2181" in generated.rfc_texts("rfc1035")["rfc1035.updated.txt"]
+    assert "drafts are skipped" in capsys.readouterr().err
@@ -0,0 +1,141 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+
+''' Test class checking the markup of RFC text documents '''
+
+DOCUMENT = """Network Working Group                                     J. Doe
+Request for Comments: 9999                                       Example
+Obsoletes: RFCs 882, 883                                       June 2000
+
+
+                      A Document About Markup
+
+Abstract
+
+   This document refers to RFC 1035 and to Section 2.1 of RFC 1034.
+
+1.  Introduction
+
+   See [RFC2181], Section 5 and sections 2.1, 2.2 and 3 of this
+   document, as well as [FOO] and <https://www.iana.org/assignments>.
+
+2.  References
+
+   [FOO]      Doe, J., "The Foo Protocol", RFC 9998, June 2000.
+
+Doe                          Standards Track                    [Page 1]
+\f
+RFC 9999                A Document About Markup                June 2000
+
+
+3.  Security Considerations
+
+   None.
+
+Doe                          Standards Track                    [Page 2]
+"""
+
+
+def test_engine_is_reused():
+    engine = htmlize_rfcs.get_engine()
+    assert htmlize_rfcs.get_engine() is engine
+    assert htmlize_rfcs.get_engine(path="..") is not engine
+    assert len(set(rule.name for rule in engine.rules)) == len(engine.rules), "rule names must be unique"
+
+
+def test_markup():
+    text = htmlize_rfcs.markup(DOCUMENT)
+    assert text.startswith("<pre>") and text.endswith("</pre>")
+    assert 'Obsoletes: RFCs <a href="./rfc882">882</a>, <a href="./rfc883">883</a>' in text
+    assert '<span class="h1">A Document About Markup</span>' in text
+    assert '<a href="./rfc1035">RFC 1035</a>' in text
+    assert '<a href="./rfc1034#section-2.1">Section&nbsp;2.1 of RFC 1034</a>' in text
+    assert '<a href="./rfc2181#section-5">[RFC2181], Section&nbsp;5</a>' in text
+    assert 'sections <a href="#section-2.1">2.1</a>, <a href="#section-2.2">2.2</a> and ' \
+           '<a href="#section-3">3</a>' in text
+    assert '[<a href="#ref-FOO" title="&quot;The Foo Protocol&quot;">FOO</a>]' in text
+    assert '<a href="https://www.iana.org/assignments">https://www.iana.org/assignments</a>' in text
+    assert '<span class="grey">Doe ' in text
+    assert '<span id="page-2" ></span>' in text
+    assert '<span class="h2"><a class="selflink" id="section-3" href="#section-3">3</a>.  Security' in text
+    assert htmlize_rfcs.MarkupEngine().markup(DOCUMENT) == text
+
+
+# creates a document citing `count` references in a single list, and enumerating as many sections
+def create_chained_document(count):
+    tags = [f"REF{i}" for i in range(count)]
+    text = "A Document With Long Lists\n\n"
+    text += "   See [" + ", ".join(tags) + ", UNKNOWN, REF0],\n"
+    text += "   as well as sections " + ", ".join(str(i + 1) for i in range(count)) + ".\n\n"
+    text += "9.  References\n\n"
+    for tag in tags:
+        text += f'   [{tag}]  Doe, J., "The {tag} Protocol", June 2000.\n\n'
+    return text
+
+
+def test_markup_of_chained_lists():
+    count = 300
+    text = htmlize_rfcs.markup(create_chained_document(count))
+    for i in range(count):
+        assert f'<a href="#ref-REF{i}" title="&quot;The REF{i} Protocol&quot;">REF{i}</a>' in text
+        assert f'<a href="#section-{i + 1}">{i + 1}</a>' in text
+    # the list is linked up to the first entry which isn't a reference
+    assert f'<a href="#ref-REF{count - 1}" title="&quot;The REF{count - 1} Protocol&quot;">REF{count - 1}</a>, UNKNOWN, REF0]' in text
+
+
+def test_markup_in_batches():
+    # a document with twice as many pages as needed for splitting it into batches
+    pages = DOCUMENT.split("\f\n")
+    text = pages[0] + "".join(f"\f\n{pages[1].replace('[Page 2]', f'[Page {i}]')}"
+                              for i in range(2, 2 * htmlize_rfcs.MIN_BATCH_PAGES + 1))
+    expected = htmlize_rfcs.markup(text)
+    assert f'<span id="page-{2 * htmlize_rfcs.MIN_BATCH_PAGES}" ></span>' in expected
+    assert htmlize_rfcs.markup(text, jobs=3) == expected
+    multidoc = text + htmlize_rfcs.MULTIDOC_SEPARATOR + "\n" + text
+    assert htmlize_rfcs.markup(multidoc, jobs=3) == htmlize_rfcs.markup(multidoc)
+
+
+def test_markup_lines():
+    text = htmlize_rfcs.markup(DOCUMENT)
+    lines = list(htmlize_rfcs.markup_lines(DOCUMENT))
+    assert [line for line, ids, width in lines] == text.splitlines()
+    assert ("page-2",) in [ids for line, ids, width in lines]
+    assert ("ref-FOO",) in [ids for line, ids, width in lines]
+    assert [width for line, ids, width in lines if "A Document About Markup" in line] == [45, 72]
+    assert htmlize_rfcs.visible_text('<a href="#s-5">Section&nbsp;5</a> &lt;x&gt;') == "Section&5 &x&"
+
+
+def test_markup_profile():
+    profile = htmlize_rfcs.MarkupProfile("rfc9999")
+    assert htmlize_rfcs.markup(DOCUMENT, profile=profile) == htmlize_rfcs.markup(DOCUMENT)
+    rules = {rule["rule"]: rule for rule in profile.rules()}
+    assert len(rules) == len(htmlize_rfcs.get_engine().rules)
+    assert rules["section anchor"]["matches"] == 3
+    assert rules["pages"]["matches"] is None
+    assert rules["strip bom"]["size"] == len(DOCUMENT)
+    documents = profile.documents()
+    assert [document["document"] for document in documents] == ["rfc9999"]
+    assert abs(documents[0]["seconds"] - sum(rule["seconds"] for rule in rules.values())) < 1e-6
+
+
+def test_markup_budget():
+    # a rule backtracking catastrophically is interrupted
+    engine = htmlize_rfcs.MarkupEngine()
+    engine.rules.insert(0, htmlize_rfcs.MarkupRule("catastrophic", "(a+)+b", ""))
+    budget = htmlize_rfcs.MarkupBudget(rule=0.1)
+    try:
+        engine.markup("a" * 40, budget=budget)
+        assert False, "the markup has to exceed the budget"
+    except htmlize_rfcs.MarkupTimeout as e:
+        assert e.rule == "catastrophic" and not e.document
+    # a document exceeding its budget is published as plain text
+    budget = htmlize_rfcs.MarkupBudget(document=1e-9)
+    text = htmlize_rfcs.markup(DOCUMENT, budget=budget)
+    assert text == htmlize_rfcs.degraded_markup(DOCUMENT)
+    assert text.count(htmlize_rfcs.PAGE_BREAK) == 1 and "[RFC2181], Section 5" in text
+    assert len(budget.exceeded) == 1 and budget.exceeded[0].document
+    assert htmlize_rfcs.markup(DOCUMENT, budget=htmlize_rfcs.MarkupBudget(60, 20)) == htmlize_rfcs.markup(DOCUMENT)
@@ -0,0 +1,78 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import annotations
+import output
+import util
+from test_htmlize_rfcs import DOCUMENT
+
+''' Test class checking that only RFC pages with changed inputs are created again '''
+
+
+def create_files(read_directory, annotation_directory, write_directory, generated=None) -> dict:
+    written_files = dict(util.written_files)
+    output.create_files(["9999"], None, None, read_directory, annotation_directory, write_directory, None,
+                        generated=generated)
+    return {key: count - written_files[key] for key, count in util.written_files.items()}
+
+
+def test_incremental_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    monkeypatch.setattr(util, "_running_in_test", True)
+    monkeypatch.setenv("RFC_JOBS", "1")
+    monkeypatch.delenv("RFC_INCREMENTAL", raising=False)
+    read_directory, annotation_directory, write_directory = (str(tmp_path / d) for d in ["txt", "ann", "html"])
+    for d in [read_directory, annotation_directory, write_directory]:
+        os.mkdir(d)
+    with open(os.path.join(read_directory, "rfc9999.txt"), "w") as f:
+        f.write(DOCUMENT)
+    annotation = os.path.join(annotation_directory, "rfc9999.note")
+    with open(annotation, "w") as f:
+        f.write("#A Jane Doe\n#S 3\n<p>A note</p>\n")
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 1, "unchanged": 0}
+    # the page is neither created nor written again if none of its inputs changed
+    with monkeypatch.context() as m:
+        m.setattr(output.markupcache, "markup_lines", None)
+        assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 0, "unchanged": 1}
+    with open(annotation, "a") as f:
+        f.write("<p>Another note</p>\n")
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 1, "unchanged": 0}
+    with open(os.path.join(write_directory, "rfc9999.html"), "r") as f:
+        assert "Another note" in f.read()
+    # missing or outdated compressed copies of an unchanged page are written again
+    monkeypatch.setenv("RFC_GZIP", "YES")
+    page = os.path.join(write_directory, "rfc9999.html")
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 1, "unchanged": 1}
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 0, "unchanged": 1}
+    os.remove(page + ".gz")
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 1, "unchanged": 1}
+    os.utime(page + ".gz", (0, 0))
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 0, "unchanged": 2}
+    assert os.path.getmtime(page + ".gz") >= os.path.getmtime(page)
+    monkeypatch.delenv("RFC_GZIP")
+    monkeypatch.setenv("RFC_INCREMENTAL", "off")
+    assert create_files(read_directory, annotation_directory, write_directory) == {"changed": 0, "unchanged": 1}
+
+
+def test_generated_annotations_are_inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(os.path.join(os.path.dirname(__file__), ".."))
+    monkeypatch.setattr(util, "_running_in_test", True)
+    monkeypatch.setenv("RFC_JOBS", "1")
+    monkeypatch.delenv("RFC_INCREMENTAL", raising=False)
+    read_directory, annotation_directory, write_directory = (str(tmp_path / d) for d in ["txt", "ann", "html"])
+    for d in [read_directory, annotation_directory, write_directory]:
+        os.mkdir(d)
+    with open(os.path.join(read_directory, "rfc9999.txt"), "w") as f:
+        f.write(DOCUMENT)
+    generated = annotations.GeneratedAnnotations(os.path.join(annotation_directory, "_generated"))
+    texts = generated.rfc_texts("rfc9999")
+    texts["rfc9999.updated.txt"] = "#A\n#C UPDATED\n#T updated\n#\n#\n<div>Updated by RFC 1</div>\n\n"
+    assert create_files(read_directory, annotation_directory, write_directory, generated) == {"changed": 1, "unchanged": 0}
+    assert create_files(read_directory, annotation_directory, write_directory, generated) == {"changed": 0, "unchanged": 1}
+    # a changed generated annotation creates the page again, although none of the annotation files changed
+    texts["rfc9999.updated.txt"] = texts["rfc9999.updated.txt"].replace("RFC 1", "RFC 2")
+    assert create_files(read_directory, annotation_directory, write_directory, generated) == {"changed": 1, "unchanged": 0}
+    with open(os.path.join(write_directory, "rfc9999.html"), "r") as f:
+        assert "Updated by RFC 2" in f.read()
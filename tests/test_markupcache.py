@@ -0,0 +1,66 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+import markupcache
+from test_htmlize_rfcs import DOCUMENT
+
+''' Test class checking the persistent cache of marked up RFC text documents '''
+
+
+def cached_lines(text, directory):
+    return [line for line, ids, width in markupcache.markup_lines(text, directory)]
+
+
+def test_cached_markup(tmp_path, monkeypatch):
+    monkeypatch.delenv("RFC_MARKUP_CACHE", raising=False)
+    directory = markupcache.cache_directory(str(tmp_path))
+    assert os.path.isdir(directory)
+    expected = htmlize_rfcs.markup(DOCUMENT).splitlines()
+    assert cached_lines(DOCUMENT, directory) == expected
+    entries = os.listdir(directory)
+    assert len(entries) == 1
+    # a hit returns the stored lines without running the markup
+    monkeypatch.setattr(htmlize_rfcs, "markup", None)
+    lines = list(markupcache.markup_lines(DOCUMENT, directory))
+    assert [line for line, ids, width in lines] == expected
+    assert ("section-3",) in [ids for line, ids, width in lines]
+    assert [width for line, ids, width in lines] == [htmlize_rfcs.visible_width(line) for line in expected]
+    assert os.listdir(directory) == entries
+
+
+def test_cache_switched_off(tmp_path, monkeypatch):
+    monkeypatch.setenv("RFC_MARKUP_CACHE", "off")
+    assert markupcache.cache_directory(str(tmp_path)) is None
+    assert os.listdir(tmp_path) == []
+    assert cached_lines(DOCUMENT, None) == htmlize_rfcs.markup(DOCUMENT).splitlines()
+
+
+def test_degraded_markup_is_not_cached(tmp_path):
+    budget = htmlize_rfcs.MarkupBudget(document=1e-9)
+    lines = [line for line, ids, width in markupcache.markup_lines(DOCUMENT, str(tmp_path), budget=budget)]
+    assert lines == htmlize_rfcs.degraded_markup(DOCUMENT).splitlines()
+    assert len(budget.exceeded) == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_incomplete_entries_are_discarded(tmp_path):
+    directory = str(tmp_path)
+    lines = markupcache.markup_lines(DOCUMENT, directory)
+    next(lines)
+    lines.close()
+    assert os.listdir(directory) == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    directory = str(tmp_path)
+    for i in range(4):
+        cached_lines(DOCUMENT + "\n" * i + "Appendix\n", directory)
+    entries = sorted(os.listdir(directory))
+    for i, entry in enumerate(entries):
+        os.utime(os.path.join(directory, entry), (1000 + i, 1000 + i))
+    size = os.path.getsize(os.path.join(directory, entries[-1])) + os.path.getsize(os.path.join(directory, entries[-2]))
+    markupcache.limit_size(directory, size)
+    assert sorted(os.listdir(directory)) == entries[-2:]
@@ -1,3 +1,4 @@
+import re
 import sys
 import os
 
@@ -8,6 +9,7 @@ import util
 import errata
 import rfcfile
 import annotations
+from test_htmlize_rfcs import DOCUMENT
 
 ''' Test class checking the correct generation of html output '''
 
@@ -37,8 +39,9 @@ def prepare_files() -> tuple:
     rfcfile.download_rfcs(RFC_LIST, TXT_DIR)
     errata_list = errata.read_errata(TXT_DIR)
     patches = errata.get_patches()
-    annotations.create_from_status(RFC_LIST, ANN_DIR_GENERATED, TXT_DIR, errata_list, patches)
-    annotations.create_from_errata(RFC_LIST, ANN_DIR_GENERATED, errata_list, patches)
+    generated = annotations.GeneratedAnnotations(ANN_DIR_GENERATED)
+    annotations.create_from_status(RFC_LIST, generated, TXT_DIR, errata_list, patches)
+    annotations.create_from_errata(RFC_LIST, generated, errata_list, patches)
     return errata_list, patches
 
 
@@ -60,3 +63,91 @@ def test_html_output_annotated():
     output.create_files(RFC_LIST, errata_list, patches, TXT_DIR, os.path.join(my_dir, "rfc-annotations"), GEN_DIR, None, None)
     for rfc in RFC_LIST:
         compare_file(f"rfc{rfc}.html", GEN_DIR, os.path.join(RESULT_DIR, "annotated"))
+
+
+def test_html_output_in_parallel(monkeypatch):
+    monkeypatch.setenv("RFC_JOBS", "2")
+    errata_list, patches = prepare_files()
+    output.create_files(RFC_LIST, errata_list, patches, TXT_DIR, os.path.join(my_dir, "rfc-annotations"), GEN_DIR, None, None)
+    for rfc in RFC_LIST:
+        compare_file(f"rfc{rfc}.html", GEN_DIR, os.path.join(RESULT_DIR, "annotated"))
+
+
+def test_html_output_compact(monkeypatch, tmp_path):
+    monkeypatch.setenv("RFC_OUTPUT_MODE", "compact")
+    errata_list, patches = prepare_files()
+    output.create_files(RFC_LIST, errata_list, patches, TXT_DIR, os.path.join(my_dir, "rfc-annotations"), str(tmp_path), None, None)
+    for rfc in RFC_LIST:
+        with open(os.path.join(tmp_path, f"rfc{rfc}.html"), "r") as f:
+            compact = f.read()
+        with open(os.path.join(RESULT_DIR, "annotated", f"rfc{rfc}.html"), "r") as f:
+            expected = f.read()
+        assert compact.count('<a class="ln"') == expected.count('<a class="line"')
+        # the lines linked by annotations keep their ids
+        for line_id in re.findall(r"""href=["']#(line-[0-9]+)["']""", compact):
+            assert f'<a class="ln" id="{line_id}" href="#{line_id}"></a>' in compact
+        assert len(compact) < len(expected)
+
+
+def test_static_assets(tmp_path):
+    fragment = '<style>\n pre {margin:0;}\n</style>\n<script src="x.js"></script>\n<script>\n var a = 1;\n</script>\n'
+    html = output.static_assets(fragment, str(tmp_path), "test")
+    files = sorted(os.listdir(os.path.join(tmp_path, output.STATIC_DIRECTORY)), key=lambda f: os.path.splitext(f)[1])
+    assert len(files) == 2 and files[0].endswith(".css") and files[1].endswith(".js")
+    assert html == f'<link rel="stylesheet" href="static/{files[0]}">\n<script src="x.js"></script>\n' \
+                   f'<script src="static/{files[1]}"></script>\n'
+    with open(os.path.join(tmp_path, output.STATIC_DIRECTORY, files[0]), "r") as f:
+        assert f.read() == "\n pre {margin:0;}\n"
+    # changed content is written to a new file, so cached versions are never used by mistake, and the outdated file
+    # is removed together with its compressed copy. Files of other fragments are kept.
+    output.static_assets(fragment, str(tmp_path), "test", True)
+    output.static_assets(fragment, str(tmp_path), "other")
+    assert output.static_assets(fragment.replace("1", "2"), str(tmp_path), "test") != html
+    remaining = os.listdir(os.path.join(tmp_path, output.STATIC_DIRECTORY))
+    assert len(remaining) == 5 and files[0] in remaining and f"{files[0]}.gz" in remaining and files[1] not in remaining
+    assert f"{files[1]}.gz" not in remaining and len([f for f in remaining if f.startswith("other.")]) == 2
+
+
+def test_fragment_references():
+    lines = ["Network Working Group", "   The domain |system", "   is a tree of nodes,", "   The domain system"]
+    remarks = [{"section": f"fragment-{fragment}"} for fragment in
+               ["The domain system", "system is a", "tree", "of nodes, The", "not contained", ""]] + [{"section": "2"}]
+    remarks = output.__handle_annotations_with_fragment_references(remarks, lines)
+    # the first line containing the fragment wins, fragments spanning two lines refer to the first of them
+    assert [remark["section"] for remark in remarks] == ["line-2", "line-2", "line-3", "line-3",
+                                                          "fragment-not contained", "line-1", "2"]
+
+
+def test_compact_fragment(tmp_path, monkeypatch):
+    monkeypatch.setattr(util, "_running_in_test", True)
+    monkeypatch.setenv("RFC_INCREMENTAL", "off")
+    with open(os.path.join(tmp_path, "rfc9999.txt"), "w") as f:
+        f.write(DOCUMENT)
+    pages = {}
+    for mode in ["default", "compact"]:
+        monkeypatch.setenv("RFC_OUTPUT_MODE", mode)
+        os.mkdir(os.path.join(tmp_path, mode))
+        output.create_files(["9999"], None, None, str(tmp_path), None, str(os.path.join(tmp_path, mode)), None)
+        with open(os.path.join(tmp_path, mode, "rfc9999.html"), "r") as f:
+            pages[mode] = f.read()
+    # the styles and scripts of compact pages are only added to them
+    assert "scrollToLine" not in pages["default"] and ".compact .ln" not in pages["default"]
+    assert "scrollToLine" in pages["compact"] and ".compact .ln" in pages["compact"]
+
+
+def test_references_exceeding_budget(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(util, "_running_in_test", True)
+    monkeypatch.setenv("RFC_JOBS", "1")
+    monkeypatch.setenv("RFC_MARKUP_RULE_BUDGET", "0.2")
+    monkeypatch.delenv("RFC_INCREMENTAL", raising=False)
+    monkeypatch.delenv("RFC_REFERENCE_STORE", raising=False)
+    # the title of a long reference without a blank line backtracks for seconds
+    document = "1.  Introduction\n\n   See [FOO].\n\n2.  References\n\n   [FOO]  " + \
+               "\n".join(["   " + "x,y" * 20 + ","] * 4000) + "\n\n"
+    with open(os.path.join(tmp_path, "rfc9999.txt"), "w") as f:
+        f.write(document)
+    os.mkdir(os.path.join(tmp_path, "html"))
+    output.create_files(["9999"], None, None, str(tmp_path), None, str(os.path.join(tmp_path, "html")), None)
+    assert "rule 'reference definitions' exceeded its time budget" in capsys.readouterr().err
+    with open(os.path.join(tmp_path, "html", "rfc9999.html"), "r") as f:
+        assert 'id="ref-FOO"' not in f.read()
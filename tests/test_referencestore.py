@@ -0,0 +1,55 @@
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import htmlize_rfcs
+import referencestore
+from test_htmlize_rfcs import DOCUMENT
+
+''' Test class checking the persistent store of the references of RFC text documents '''
+
+
+def test_references():
+    records = htmlize_rfcs.references(DOCUMENT)
+    assert records == [{"tag": "FOO", "title": '"The Foo Protocol"', "url": None, "rfc": "rfc9998"}]
+    assert htmlize_rfcs.markup(DOCUMENT, references=records) == htmlize_rfcs.markup(DOCUMENT)
+
+
+def test_stored_references(tmp_path, monkeypatch):
+    monkeypatch.delenv("RFC_REFERENCE_STORE", raising=False)
+    directory = referencestore.store_directory(str(tmp_path))
+    records = referencestore.references(DOCUMENT, directory, "rfc9999")
+    assert records == htmlize_rfcs.references(DOCUMENT)
+    assert os.listdir(directory) == ["rfc9999.json"]
+    # the stored records are used as long as the text doesn't change
+    extract = htmlize_rfcs.references
+    monkeypatch.setattr(htmlize_rfcs, "references", None)
+    assert referencestore.references(DOCUMENT, directory, "rfc9999") == records
+    monkeypatch.setattr(htmlize_rfcs, "references", extract)
+    changed = DOCUMENT.replace("[FOO]", "[BAR]")
+    assert referencestore.references(changed, directory, "rfc9999")[0]["tag"] == "BAR"
+    # the records of the changed text replace the stored ones
+    monkeypatch.setattr(htmlize_rfcs, "references", None)
+    assert referencestore.references(changed, directory, "rfc9999") == extract(changed)
+    assert os.listdir(directory) == ["rfc9999.json"]
+
+
+def test_store_switched_off(tmp_path, monkeypatch):
+    monkeypatch.setenv("RFC_REFERENCE_STORE", "no")
+    assert referencestore.store_directory(str(tmp_path)) is None
+    assert referencestore.references(DOCUMENT, None, "rfc9999") is None
+
+
+def test_references_within_budget(tmp_path, monkeypatch):
+    monkeypatch.delenv("RFC_REFERENCE_STORE", raising=False)
+    # the title of a long reference without a blank line backtracks for seconds
+    document = "1.  Introduction\n\n   See [FOO].\n\n2.  References\n\n   [FOO]  " + \
+               "\n".join(["   " + "x,y" * 20 + ","] * 4000) + "\n\n"
+    budget = htmlize_rfcs.MarkupBudget(rule=0.2)
+    assert htmlize_rfcs.references(document, budget=budget) is None
+    assert len(budget.exceeded) == 1 and budget.exceeded[0].rule == "reference definitions"
+    # records exceeding the budget aren't stored, so they get another chance
+    directory = referencestore.store_directory(str(tmp_path))
+    assert referencestore.references(document, directory, "rfc9999", budget) is None
+    assert len(budget.exceeded) == 2 and os.listdir(directory) == []
@@ -0,0 +1,55 @@
+import gzip
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../program'))
+
+import util
+
+''' Test class checking utility functions '''
+
+
+def test_write_if_changed(tmp_path):
+    file_name = os.path.join(tmp_path, "rfc9999.html")
+    written_files = dict(util.written_files)
+    assert util.write_if_changed(file_name, "<html>ä</html>")
+    os.utime(file_name, (0, 0))
+    assert not util.write_if_changed(file_name, "<html>ä</html>")
+    assert os.stat(file_name).st_mtime == 0
+    assert util.write_if_changed(file_name, "<html>ö</html>")
+    with open(file_name, "r", encoding="utf-8") as f:
+        assert f.read() == "<html>ö</html>"
+    assert os.listdir(tmp_path) == ["rfc9999.html"]
+    assert util.written_files["changed"] == written_files["changed"] + 2
+    assert util.written_files["unchanged"] == written_files["unchanged"] + 1
+
+
+def test_write_if_changed_compressed(tmp_path):
+    file_name = os.path.join(tmp_path, "rfc9999.html")
+    assert util.write_if_changed(file_name, "<pre>ä</pre>" * 100, True)
+    with gzip.open(file_name + ".gz", "rt", encoding="utf-8") as f:
+        assert f.read() == "<pre>ä</pre>" * 100
+    os.utime(file_name + ".gz", (0, 0))
+    assert not util.write_if_changed(file_name, "<pre>ä</pre>" * 100, True)
+    # the compressed copy is older than the file, so it is compressed again. The same data is not written, but the copy
+    # is touched, so it isn't outdated anymore
+    assert os.stat(file_name + ".gz").st_mtime >= os.stat(file_name).st_mtime
+    assert util.write_if_changed(file_name, "<pre>ö</pre>", True)
+    with gzip.open(file_name + ".gz", "rt", encoding="utf-8") as f:
+        assert f.read() == "<pre>ö</pre>"
+    assert sorted(os.listdir(tmp_path)) == ["rfc9999.html", "rfc9999.html.gz"]
+
+
+def test_link_resolver():
+    links = util.LinkResolver(["1034", "1035"])
+    assert links.target("1035") == "./rfc1035.html"
+    assert links.target("1035", "section-2") == "./rfc1035.html#section-2"
+    assert links.target("2181") == "https://datatracker.ietf.org/doc/rfc2181/"
+    assert links.target("2181", "section-5") == "https://datatracker.ietf.org/doc/html/rfc2181.html#section-5"
+    assert links.target("1035") is links.target("1035")
+    assert links.rewrite_anchors('<a href="./rfc1034#section-2.1">2.1</a> <a href="./rfc2181">RFC 2181</a>') == \
+           '<a href="./rfc1034.html#section-2.1">2.1</a> <a href="https://datatracker.ietf.org/doc/rfc2181/">RFC 2181</a>'
+    assert util.rewrite_rfc_anchor("see @@Section 2 of RFC 1034@@", links) == \
+           "see <a target='_blank' href='./rfc1034.html#section-2'>Section 2</a> of " \
+           "<a target='_blank' href='./rfc1034.html'>RFC 1034</a>"
+    assert util.LinkResolver().target("1035") == "https://datatracker.ietf.org/doc/rfc1035/"